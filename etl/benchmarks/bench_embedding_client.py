@@ -0,0 +1,68 @@
+"""
+Throughput of EmbeddingClient against the local fake embedding server, at several
+concurrencies, with injected 429s. Every text must come back embedded.
+
+    $ cd platform/etl
+    $ python -m benchmarks.bench_embedding_client --texts 2000 --throttle-rate 0.1
+"""
+
+import argparse
+import logging
+import time
+
+from benchmarks.fake_embedding_server import start_server
+from knowledge_graph.embedding_client import EmbeddingClient, RateLimiter
+
+
+def run(server, texts, batch_size, concurrency, rpm, tpm):
+    client = EmbeddingClient(
+        api_key="fake",
+        base_url=server.base_url,
+        concurrency=concurrency,
+        limiter=RateLimiter(rpm, tpm),
+    )
+    batches = [
+        (texts[i : i + batch_size], None) for i in range(0, len(texts), batch_size)
+    ]
+    start = time.perf_counter()
+    results = client.embed_many(batches, "text-embedding-ada-002")
+    elapsed = time.perf_counter() - start
+    failed = sum(
+        len(b[0]) for b, r in zip(batches, results) if isinstance(r, Exception)
+    )
+    return elapsed, failed, client.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--throttle-rate", type=float, default=0.1)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rpm", type=int, default=60000)
+    parser.add_argument("--tpm", type=int, default=10000000)
+    args = parser.parse_args()
+
+    # Retry warnings would drown the results
+    logging.getLogger().setLevel(logging.ERROR)
+    server = start_server(
+        throttle_rate=args.throttle_rate, latency=args.latency, retry_after=0
+    )
+    texts = [f"synthetic node {i} " * 10 for i in range(args.texts)]
+    print(f"{'concurrency':>11} {'seconds':>8} {'texts/s':>9} {'failed':>7}  stats")
+    for concurrency in args.concurrency:
+        elapsed, failed, stats = run(
+            server, texts, args.batch_size, concurrency, args.rpm, args.tpm
+        )
+        print(
+            f"{concurrency:>11} {elapsed:>8.2f} {len(texts) / elapsed:>9.0f} "
+            f"{failed:>7}  {stats}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
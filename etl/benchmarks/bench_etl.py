@@ -0,0 +1,239 @@
+"""
+Per-stage throughput of the ETL on synthetic airbyte data: Airbyte2jsonlTransformer
+per mapkey, every *GraphGenerator processor, and Neo4jUploader against a recording
+fake driver (no Neo4j or OpenAI needed). Each stage runs in a forked process so the
+reported peak RSS belongs to that stage alone.
+
+    $ cd platform/etl
+    $ python -m benchmarks.bench_etl --rows 100000
+"""
+
+import argparse
+import contextlib
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import generate_dataset
+from etl.neo4j.schema import Neo4jSchemaManager
+from etl.neo4j.upload import Neo4jUploader
+from etl.transforms import (
+    Airbyte2jsonlTransformer,
+    ConfluenceGraphGenerator,
+    JiraGraphGenerator,
+    SlackGraphGenerator,
+)
+
+GRAPH_GENERATORS = {
+    "confluence": ConfluenceGraphGenerator,
+    "slack": SlackGraphGenerator,
+    "jira": JiraGraphGenerator,
+}
+
+
+class RecordingTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, parameters=None, **kwargs):
+        self.driver.queries += 1
+        self.driver.query_texts.add(query)
+        if query == "SHOW CONSTRAINTS":
+            return self.driver.constraints
+        return []
+
+
+class RecordingSession(RecordingTransaction):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        self.driver.transactions += 1
+        return transaction_function(RecordingTransaction(self.driver), *args, **kwargs)
+
+    execute_read = execute_write
+
+
+class RecordingDriver:
+    """
+    Stands in for a neo4j Driver, counting transactions, queries and distinct
+    query texts instead of talking to a database. It reports the constraints of
+    a bootstrapped schema.
+    """
+
+    def __init__(self):
+        self.transactions = 0
+        self.queries = 0
+        self.query_texts = set()
+        self.constraints = [
+            {"type": "UNIQUENESS", "labelsOrTypes": [label], "properties": ["id"]}
+            for label in Neo4jSchemaManager(None).labels()
+        ]
+
+    def session(self, **kwargs):
+        return RecordingSession(self)
+
+    def verify_connectivity(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullEmbeddingManager:
+    def update_embeddings_for_neo4j(self, node_label, node_id):
+        pass
+
+    def update_embeddings_bulk(self, items):
+        return []
+
+
+def _count_lines(filepath):
+    with open(filepath, "rb") as fh:
+        return sum(1 for _ in fh)
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_transform(mapkey, csv_filepath, output_filepath):
+    Airbyte2jsonlTransformer().transform_airbyte2jsonl_format(
+        csv_filepath, output_filepath, mapkey
+    )
+    return _count_lines(output_filepath), {}
+
+
+def bench_graph_generator(source, data_type, input_directory, output_directory):
+    graph_generator = GRAPH_GENERATORS[source]()
+    output_filepaths = graph_generator.generate_graph_schema_format_data_files(
+        input_directory, output_directory, data_types=[data_type]
+    )
+    return _count_lines(f"{input_directory}/{data_type}.jsonl"), {
+        "records": _count_lines(output_filepaths[0])
+    }
+
+
+def bench_uploader(graph_filepath, batch_size, workers):
+    driver = RecordingDriver()
+    uploader = Neo4jUploader(
+        None,
+        None,
+        None,
+        neo4j_manager=NullEmbeddingManager(),
+        driver=driver,
+        batch_size=batch_size,
+        workers=workers,
+    )
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        uploader.upload_file_to_neo4j(graph_filepath)
+    return _count_lines(graph_filepath), {
+        "transactions": driver.transactions,
+        "queries": driver.queries,
+        "query_texts": len(driver.query_texts),
+    }
+
+
+def _run_stage(connection, stage, args):
+    logging.disable(logging.WARNING)
+    start = time.perf_counter()
+    rows, extra = stage(*args)
+    seconds = time.perf_counter() - start
+    connection.send((rows, seconds, _peak_rss_mb(), extra))
+
+
+def run_stage(stage, *args):
+    """
+    Runs stage(*args) in a forked process, returns (rows, seconds, peak_rss_mb, extra).
+    """
+    context = multiprocessing.get_context("fork")
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_run_stage, args=(child, stage, args))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def report(name, result):
+    rows, seconds, peak_rss_mb, extra = result
+    details = " ".join(f"{key}={value}" for key, value in extra.items())
+    print(f"{name:<44}{rows:>10}{rows / seconds:>14.0f}{peak_rss_mb:>12.1f}  {details}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--mapkeys", nargs="*", help="limit to these mapkeys")
+    parser.add_argument("--skip-upload", action="store_true")
+    parser.add_argument(
+        "--upload-batch-size",
+        type=int,
+        default=1000,
+        help="Neo4jUploader batch_size, 0 uploads record by record",
+    )
+    parser.add_argument(
+        "--upload-workers",
+        type=int,
+        default=1,
+        help="Neo4jUploader workers, > 1 uploads partitions in parallel",
+    )
+    parser.add_argument("--directory", help="working directory, default temporary")
+    args = parser.parse_args()
+
+    directory = args.directory or tempfile.mkdtemp(prefix="etl_bench_")
+    print(f"Generating {args.rows} rows per mapkey in {directory}")
+    datasets = generate_dataset(directory, args.rows, args.mapkeys)
+
+    print(f"{'stage':<44}{'rows':>10}{'rows/sec':>14}{'peak MB':>12}")
+    for mapkey, csv_filepath in datasets.items():
+        source, data_type = mapkey.split("/")
+        transformed_directory = f"{directory}/transformed/{source}"
+        graph_directory = f"{directory}/graph_output/{source}"
+        os.makedirs(transformed_directory, exist_ok=True)
+
+        report(
+            f"transform {mapkey}",
+            run_stage(
+                bench_transform,
+                mapkey,
+                csv_filepath,
+                f"{transformed_directory}/{data_type}.jsonl",
+            ),
+        )
+        report(
+            f"{GRAPH_GENERATORS[source].__name__} {data_type}",
+            run_stage(
+                bench_graph_generator,
+                source,
+                data_type,
+                transformed_directory,
+                graph_directory,
+            ),
+        )
+        if not args.skip_upload:
+            report(
+                f"Neo4jUploader {data_type}",
+                run_stage(
+                    bench_uploader,
+                    f"{graph_directory}/{data_type}_data.jsonl",
+                    args.upload_batch_size,
+                    args.upload_workers,
+                ),
+            )
+
+
+if __name__ == "__main__":
+    main()
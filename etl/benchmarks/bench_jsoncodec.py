@@ -0,0 +1,67 @@
+"""
+Compares the JSON codecs of etl.jsoncodec on synthetic Jira issues, covering the
+parse of the airbyte payload, the transform and the JSONL serialize of the output.
+
+    $ cd platform/etl
+    $ python -m benchmarks.bench_jsoncodec --rows 50000
+"""
+
+import argparse
+import time
+
+from benchmarks.synthetic import SyntheticWorkspace
+from etl.transforms import Airbyte2jsonlTransformer
+
+from etl import jsoncodec
+
+
+def bench(codec, payloads, transformer):
+    start = time.perf_counter()
+    decoded = [codec.loads(payload) for payload in payloads]
+    parse = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = [transformer.transform_airbyte_row(data, "jira/issues") for data in decoded]
+    transform = time.perf_counter() - start
+
+    start = time.perf_counter()
+    lines = [codec.dumps(row) + b"\n" for row in rows]
+    serialize = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for line in lines:
+        codec.loads(line)
+    reparse = time.perf_counter() - start
+    return parse, transform, serialize, reparse
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    workspace = SyntheticWorkspace(args.rows)
+    stdlib = jsoncodec.get_codec("json")
+    payloads = [
+        stdlib.dumps(workspace.jira_issue(i)).decode() for i in range(args.rows)
+    ]
+    transformer = Airbyte2jsonlTransformer()
+
+    codecs = [stdlib]
+    if jsoncodec.orjson is not None:
+        codecs.append(jsoncodec.get_codec("orjson"))
+    else:
+        print("orjson not installed, only benchmarking the stdlib codec")
+
+    print(f"{'codec':<8}{'parse':>10}{'transform':>12}{'serialize':>12}{'reparse':>10}")
+    for codec in codecs:
+        timings = bench(codec, payloads, transformer)
+        rates = "".join(
+            f"{args.rows / seconds:>{width}.0f}"
+            for seconds, width in zip(timings, (10, 12, 12, 10))
+        )
+        print(f"{codec.name:<8}{rates}  rows/sec")
+
+
+if __name__ == "__main__":
+    main()
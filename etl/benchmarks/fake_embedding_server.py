@@ -0,0 +1,162 @@
+"""
+Local OpenAI compatible /embeddings server for exercising EmbeddingClient without
+an API key: deterministic vectors, a fixed latency, and 429 responses with
+Retry-After, randomly at --throttle-rate and whenever more than --rpm requests
+arrive within a minute.
+
+    $ cd platform/etl
+    $ python -m benchmarks.fake_embedding_server --port 8099 --throttle-rate 0.1
+
+and point EmbeddingClient at it with EMBEDDING_API_BASE_URL=http://127.0.0.1:8099/v1.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DIMENSIONS = 1536
+
+
+def fake_embedding(text, dimensions=DIMENSIONS):
+    # Same text, same vector
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(dimensions)]
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, address, throttle_rate=0.0, rpm=None, latency=0.0, retry_after=1
+    ):
+        super().__init__(address, FakeEmbeddingHandler)
+        self.throttle_rate = throttle_rate
+        self.rpm = rpm
+        self.latency = latency
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.requests = 0
+        self.throttled = 0
+
+    def should_throttle(self):
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            while self.recent and now - self.recent[0] > 60:
+                self.recent.popleft()
+            throttle = random.random() < self.throttle_rate or (
+                self.rpm is not None and len(self.recent) >= self.rpm
+            )
+            if throttle:
+                self.throttled += 1
+            else:
+                self.recent.append(now)
+            return throttle
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if not self.path.endswith("/embeddings"):
+            self._respond(404, {"error": {"message": "not found"}})
+            return
+        if self.server.should_throttle():
+            self._respond(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                {"Retry-After": str(self.server.retry_after)},
+            )
+            return
+        time.sleep(self.server.latency)
+        inputs = body["input"]
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self._respond(
+            200,
+            {
+                "object": "list",
+                "model": body.get("model"),
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": i,
+                        "embedding": fake_embedding(text),
+                    }
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": sum(len(text) // 4 + 1 for text in inputs)},
+            },
+        )
+
+
+def start_server(port=0, **options):
+    """
+    Returns a FakeEmbeddingServer serving on a daemon thread, port 0 picks a
+    free port (see base_url).
+    """
+    server = FakeEmbeddingServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument(
+        "--throttle-rate", type=float, default=0.0, help="fraction of 429s"
+    )
+    parser.add_argument("--rpm", type=int, help="requests per minute before 429s")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = FakeEmbeddingServer(
+        ("127.0.0.1", args.port),
+        throttle_rate=args.throttle_rate,
+        rpm=args.rpm,
+        latency=args.latency,
+        retry_after=args.retry_after,
+    )
+    logger.info(f"Serving fake embeddings on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    logger.info(f"{server.requests} requests, {server.throttled} throttled")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Generates realistic airbyte CSV files for every s3_files_field_map key, laid out
+like the airbyte S3 destination (<directory>/airbyte/<source>/<data_type>/).
+
+    $ cd platform/etl
+    $ python -m benchmarks.synthetic /tmp/synthetic --rows 100000
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+
+from etl.transforms import AIRBYTE_CSV_FIELDNAMES
+
+WORDS = [
+    "graph",
+    "etl",
+    "pipeline",
+    "neo4j",
+    "sprint",
+    "deploy",
+    "lambda",
+    "slack",
+    "jira",
+    "index",
+    "query",
+    "bot",
+    "embedding",
+    "review",
+    "merge",
+    "release",
+    "customer",
+    "onboarding",
+    "backlog",
+    "migration",
+]
+
+EMITTED_AT = 1714557600000  # 2024-05-01T10:00:00Z in milliseconds
+
+
+def _text(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _timestamp(rng):
+    return f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T10:00:00.000+0000"
+
+
+class SyntheticWorkspace:
+    """
+    Produces airbyte _airbyte_data payloads for one workspace. Ids of referenced
+    entities (users, projects, boards, issues, channels) are drawn from pools sized
+    relative to rows so relationships between streams line up.
+    """
+
+    def __init__(self, rows, seed=0):
+        self.rows = rows
+        self.rng = random.Random(seed)
+        self.users = max(10, rows // 100)
+        self.projects = max(2, rows // 5000)
+        self.boards = self.projects * 2
+        self.channels = max(5, rows // 2000)
+
+    def user_id(self):
+        return f"5b10a2844c20165700ede{self.rng.randrange(self.users):05d}"
+
+    def factories(self):
+        return {
+            "confluence/space": self.confluence_space,
+            "confluence/pages": self.confluence_page,
+            "jira/users": self.jira_user,
+            "jira/projects": self.jira_project,
+            "jira/boards": self.jira_board,
+            "jira/sprints": self.jira_sprint,
+            "jira/issues": self.jira_issue,
+            "jira/issue_comments": self.jira_issue_comment,
+            "jira/sprint_issues": self.jira_sprint_issue,
+            "slack/channels": self.slack_channel,
+            "slack/channel_messages": self.slack_channel_message,
+            "slack/users": self.slack_user,
+        }
+
+    def confluence_space(self, i):
+        return {
+            "id": 1000 + i,
+            "key": f"SP{i}",
+            "name": _text(self.rng, 3),
+            "type": "global",
+        }
+
+    def confluence_page(self, i):
+        return {
+            "id": str(20000 + i),
+            "type": "page",
+            "title": _text(self.rng, 6),
+            "history": {
+                "createdBy": {"accountId": self.user_id(), "displayName": "Jane Doe"},
+                "createdDate": _timestamp(self.rng),
+            },
+        }
+
+    def jira_user(self, i):
+        return {
+            "accountId": f"5b10a2844c20165700ede{i % self.users:05d}",
+            "emailAddress": f"user{i}@example.com",
+            "displayName": f"User {i}",
+            "active": True,
+        }
+
+    def jira_project(self, i):
+        return {
+            "id": str(10000 + i),
+            "key": f"P{i}",
+            "name": _text(self.rng, 2),
+            "description": _text(self.rng, 20),
+            "lead": {"accountId": self.user_id()},
+        }
+
+    def jira_board(self, i):
+        return {"id": i, "projectId": 10000 + i % self.projects, "type": "scrum"}
+
+    def jira_sprint(self, i):
+        return {
+            "id": i,
+            "name": f"Sprint {i}",
+            "startDate": _timestamp(self.rng),
+            "endDate": _timestamp(self.rng),
+            "boardId": i % self.boards,
+            "state": self.rng.choice(["active", "closed", "future"]),
+        }
+
+    def jira_issue(self, i):
+        assignee = self.rng.random() < 0.8
+        return {
+            "id": str(30000 + i),
+            "key": f"P{i % self.projects}-{i}",
+            "fields": {
+                "assignee": {"accountId": self.user_id()} if assignee else None,
+                "created": _timestamp(self.rng),
+                "updated": _timestamp(self.rng),
+                "creator": {"accountId": self.user_id()},
+                "issuetype": {"name": "Story", "description": _text(self.rng, 8)},
+                "parent": {"key": f"P0-{self.rng.randrange(i + 1)}"},
+                "project": {"id": str(10000 + i % self.projects)},
+                "status": {"statusCategory": {"name": "In Progress"}},
+                "summary": _text(self.rng, 8),
+                "labels": ["backend"],
+            },
+        }
+
+    def jira_issue_comment(self, i):
+        paragraphs = [
+            {
+                "type": "paragraph",
+                "content": [{"type": "text", "text": _text(self.rng)}],
+            }
+            for _ in range(self.rng.randint(1, 3))
+        ]
+        return {
+            "id": str(50000 + i),
+            "author": {"accountId": self.user_id()},
+            "body": {"type": "doc", "version": 1, "content": paragraphs},
+            "issueId": str(30000 + self.rng.randrange(self.rows)),
+            "created": _timestamp(self.rng),
+        }
+
+    def jira_sprint_issue(self, i):
+        return {"sprintId": i % self.boards, "issueId": str(30000 + i)}
+
+    def slack_channel(self, i):
+        return {
+            "id": f"C{i:08d}",
+            "name": f"channel-{i}",
+            "creator": f"U{self.rng.randrange(self.users):08d}",
+            "purpose": {"value": _text(self.rng, 6)},
+            "is_private": False,
+            "num_members": self.rng.randint(2, 300),
+            "created": 1714557600 + i,
+        }
+
+    def slack_channel_message(self, i):
+        return {
+            "client_msg_id": f"{i:08d}-8d3f-4b5a-9c1e-5f6a7b8c9d0e",
+            "user": f"U{self.rng.randrange(self.users):08d}",
+            "text": _text(self.rng, self.rng.randint(5, 60)),
+            "team": "T00000001",
+            "channel_id": f"C{self.rng.randrange(self.channels):08d}",
+            "ts": f"{1714557600 + i}.000100",
+            "type": "message",
+        }
+
+    def slack_user(self, i):
+        return {
+            "id": f"U{i % self.users:08d}",
+            "team_id": "T00000001",
+            "real_name": f"User {i}",
+            "profile": {
+                "first_name": "User",
+                "last_name": str(i),
+                "title": "Engineer",
+                "email": f"user{i}@example.com",
+            },
+            "is_admin": i == 0,
+        }
+
+
+def write_airbyte_csv(filepath, payloads):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, "w", newline="") as fh:
+        writer = csv.writer(fh)
+        writer.writerow(AIRBYTE_CSV_FIELDNAMES)
+        for i, payload in enumerate(payloads):
+            writer.writerow([f"ab-{i:012d}", EMITTED_AT + i, json.dumps(payload)])
+
+
+def generate_dataset(directory, rows, mapkeys=None, seed=0):
+    """
+    Writes an airbyte CSV of rows rows per mapkey, returns {mapkey: filepath}.
+    """
+    workspace = SyntheticWorkspace(rows, seed)
+    filepaths = {}
+    for mapkey, factory in workspace.factories().items():
+        if mapkeys is not None and mapkey not in mapkeys:
+            continue
+        filepath = f"{directory}/airbyte/{mapkey}/synthetic.csv"
+        write_airbyte_csv(filepath, (factory(i) for i in range(rows)))
+        filepaths[mapkey] = filepath
+    return filepaths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("directory")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for mapkey, filepath in generate_dataset(
+        args.directory, args.rows, seed=args.seed
+    ).items():
+        print(f"{mapkey}: {filepath}")
+
+
+if __name__ == "__main__":
+    main()
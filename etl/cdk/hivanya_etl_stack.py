@@ -19,7 +19,10 @@ class HiVanyaEtlStack(Stack):
         etl_lambda = aws_lambda.DockerImageFunction(
             self,
             "EtlLambda",
-            code=aws_lambda.DockerImageCode.from_image_asset(directory="etl"),
+            # Built from the repository root to include knowledge_graph
+            code=aws_lambda.DockerImageCode.from_image_asset(
+                directory=".", file="etl/Dockerfile"
+            ),
             architecture=aws_lambda.Architecture.ARM_64,
             environment={
                 "NEO4J_URI": secrets.secret_value_from_json("NEO4J_URI").to_string(),
@@ -0,0 +1,174 @@
+import hashlib
+import logging
+import os
+
+from etl import jsoncodec
+from etl.metrics import metrics
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Share of the Lambda's memory (AWS_LAMBDA_FUNCTION_MEMORY_SIZE, in MB) used by
+# the deduplicator when ETL_DEDUP_MEMORY_MB isn't set, 64MB outside Lambda
+DEDUP_LAMBDA_MEMORY_SHARE = 0.125
+
+# Share of the memory budget reserved for the Bloom filter, which takes over
+# when the exact keys have used the rest
+DEDUP_BLOOM_SHARE = 0.25
+
+# Bytes per tracked key, the most measured with tracemalloc (right after the
+# dict or set resizes) for a node's 16 byte digest key and value in a dict and
+# for a relationship's 16 byte digest in a set, both about 155
+DEDUP_ENTRY_BYTES = 160
+
+BLOOM_HASHES = 7
+
+
+def _default_memory_budget():
+    if os.getenv("ETL_DEDUP_MEMORY_MB"):
+        megabytes = int(os.getenv("ETL_DEDUP_MEMORY_MB"))
+    elif os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE"):
+        lambda_megabytes = int(os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE"))
+        megabytes = lambda_megabytes * DEDUP_LAMBDA_MEMORY_SHARE
+    else:
+        megabytes = 64
+    return int(megabytes * 1024 * 1024)
+
+
+# Memory for the exact keys and the Bloom filter together
+DEDUP_MEMORY_BUDGET = _default_memory_budget()
+
+
+def _digest(key):
+    return hashlib.blake2b(key, digest_size=16).digest()
+
+
+class BloomFilter:
+    def __init__(self, size_bytes, hashes=BLOOM_HASHES):
+        self.bits = bytearray(size_bytes)
+        self.size = size_bytes * 8
+        self.hashes = hashes
+        self.count = 0
+
+    def add(self, digest):
+        """
+        Adds a 16 byte digest, returns True when it was (probably) added before.
+        """
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        present = True
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.size
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not self.bits[byte] & mask:
+                present = False
+                self.bits[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+
+class GraphRecordDeduplicator:
+    """
+    Drops graph records repeated within a run. Nodes are keyed on label and
+    identity key (identity_keys per label, "id" otherwise), a copy is dropped when
+    its properties equal the last copy's, so the last copy still wins as with no
+    dedup. Relationships are keyed on their (start, type, end) triple. Keys are
+    kept exactly until they use memory_budget less the DEDUP_BLOOM_SHARE reserved
+    for a Bloom filter. Beyond that relationships go to the Bloom filter, whose
+    rare false positives drop a record that wasn't a repeat, and new nodes are no
+    longer tracked. Distinct relationship types between the same nodes (e.g.
+    works_on and worked_on_by) are all kept.
+    """
+
+    def __init__(self, memory_budget=DEDUP_MEMORY_BUDGET, identity_keys=None):
+        self.memory_budget = memory_budget
+        self.identity_keys = identity_keys or {}
+        self.bloom_bytes = max(int(memory_budget * DEDUP_BLOOM_SHARE), 1)
+        self.exact_budget = memory_budget - self.bloom_bytes
+        self.seen = set()
+        self.nodes = {}
+        self.bloom = None
+        self.records = 0
+        self.suppressed = {"node": 0, "relationship": 0}
+
+    def _identity(self, label, properties):
+        return properties.get(self.identity_keys.get(label, "id"))
+
+    def _relationship_key(self, obj):
+        start_node = obj.get("start_node", {})
+        end_node = obj.get("end_node", {})
+        return "r\x1f{}\x1f{}\x1f{}\x1f{}\x1f{}".format(
+            start_node.get("label"),
+            self._identity(start_node.get("label"), start_node),
+            obj.get("relationship"),
+            end_node.get("label"),
+            self._identity(end_node.get("label"), end_node),
+        ).encode()
+
+    def is_repeat_node(self, obj):
+        """
+        Returns True when a node record equals the last copy of its node.
+        """
+        label = obj.get("label")
+        properties = obj.get("properties") or {}
+        identity = self._identity(label, properties)
+        if identity is None:
+            return False
+        key = _digest(f"n\x1f{label}\x1f{identity}".encode())
+        digest = _digest(jsoncodec.dumps(properties))
+        last = self.nodes.get(key)
+        if last == digest:
+            return True
+        if last is not None or self.exact_bytes() < self.exact_budget:
+            self.nodes[key] = digest
+        return False
+
+    def exact_bytes(self):
+        """
+        Returns the estimated memory of the exactly kept keys.
+        """
+        return (len(self.nodes) + len(self.seen)) * DEDUP_ENTRY_BYTES
+
+    def is_repeat(self, digest):
+        if digest in self.seen:
+            return True
+        if self.exact_bytes() < self.exact_budget:
+            self.seen.add(digest)
+            return False
+        if self.bloom is None:
+            logger.info(
+                f"Dedup exact set full at {len(self.seen)} keys, using a "
+                f"{self.bloom_bytes} byte Bloom filter"
+            )
+            self.bloom = BloomFilter(self.bloom_bytes)
+        return self.bloom.add(digest)
+
+    def filter(self, records):
+        """
+        Returns generator of the records not seen before in this run.
+        """
+        for obj in records:
+            self.records += 1
+            kind = obj.get("type")
+            if kind == "node":
+                repeat = self.is_repeat_node(obj)
+            elif kind == "relationship":
+                repeat = self.is_repeat(_digest(self._relationship_key(obj)))
+            else:
+                repeat = False
+            if repeat:
+                self.suppressed[kind] += 1
+                continue
+            yield obj
+
+    def report(self):
+        for kind, count in self.suppressed.items():
+            if count:
+                metrics.incr("dedup", "suppressed", count, kind)
+        logger.info(
+            f"Dedup: suppressed {self.suppressed['node']} nodes and "
+            f"{self.suppressed['relationship']} relationships of {self.records} "
+            f"records{' (Bloom filter used)' if self.bloom else ''}"
+        )
@@ -1,73 +1,313 @@
-import json
+import argparse
 import logging
-import openai
-from neo4j import GraphDatabase
+import os
+
+try:
+    import tiktoken
+except ImportError:  # optional, token counts are estimated without it
+    tiktoken = None
+
+from knowledge_graph.driver import get_driver
+from knowledge_graph.embedding_cache import cache_key, get_embedding_cache
+from knowledge_graph.embedding_client import EmbeddingClient
+from knowledge_graph.embedding_text import NODE_EMBEDDING_PROPERTIES, node_text
+from neo4j.exceptions import DriverError, Neo4jError
+
+from etl.metrics import metrics
 
 # Initialize the logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Length of the vectors of EMBEDDING_MODEL, stored as one vector per node
+EMBEDDING_DIMENSIONS = 1536
+
+# Limits of one multi-input embedding request, OpenAI allows 2048 inputs
+EMBEDDING_BATCH_TOKENS = int(os.getenv("ETL_EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_BATCH_INPUTS = 2048
+
+# Vectors written per UNWIND ... SET
+EMBEDDING_WRITE_BATCH_SIZE = 500
+
+# Nodes compacted per transaction by repair_embeddings
+EMBEDDING_REPAIR_BATCH_SIZE = 1000
+
+# Inputs longer than the model's context are truncated
+EMBEDDING_MAX_INPUT_TOKENS = 8191
+
+_encoding = None
+
+
+def count_tokens(text):
+    global _encoding
+    if tiktoken is None:
+        # About 4 characters per token for English text
+        return len(text) // 4 + 1
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def truncate_text(text, tokens, max_tokens=EMBEDDING_MAX_INPUT_TOKENS):
+    if tokens <= max_tokens:
+        return text, tokens
+    if tiktoken is None:
+        return text[: max_tokens * 3], max_tokens
+    return _encoding.decode(
+        _encoding.encode(text, disallowed_special=())[:max_tokens]
+    ), max_tokens
+
 
 class Neo4jEmbeddingManager:
-    def __init__(self, url, username, password):
+    def __init__(self, url, username, password, driver=None, cache=None, client=None):
         self.url = url
         self.username = username
         self.password = password
-        self.driver = GraphDatabase.driver(
-            self.url, auth=(self.username, self.password)
-        )
-        self.node_label_to_indexed_properties = {
-            "atlassian_user": ["id", "display_name"],
-            "jira_comment": ["text", "author_id", "issue_id"],
-            "jira_issue": ["description", "title", "issue_type", "status"],
-            "slack_user": ["id", "name"],
-            "slack_message": ["text", "user"],
-            "jira_project": [
-                "id",
-                "project_key",
-                "title",
-                "description",
-                "assignee_id",
-            ],
-        }
-
-    def _generate_embeddings_for_node(
-        self, node, properties, model="text-embedding-ada-002"
-    ):
-        text_data = json.dumps({k: node[k] for k in properties if k in node})
-        text_data = text_data.replace("\n", " ")
-        response = openai.Embedding.create(input=[text_data], model=model)
-        embedding = response["data"][0][
-            "embedding"
-        ]  # Properly access the embedding data
-        return embedding
+        # Shares the process wide driver with Neo4jUploader
+        self.driver = driver or get_driver(self.url, self.username, self.password)
+        # Embeddings by model and text, see knowledge_graph/embedding_cache.py
+        self.cache = cache if cache is not None else get_embedding_cache()
+        # Rate limited concurrent requests, see knowledge_graph/embedding_client.py
+        self.client = client or EmbeddingClient()
+        # Shared with the query engine, see knowledge_graph/embedding_text.py
+        self.node_label_to_indexed_properties = NODE_EMBEDDING_PROPERTIES
+
+    def node_text(self, node, properties):
+        return node_text(node, properties)
 
     def update_embeddings_for_neo4j(self, node_label, node_id):
-        indexed_properties = self.node_label_to_indexed_properties[node_label]
+        self.update_embeddings_bulk([(node_label, node_id, None)])
+
+    def _read_embedding_state(self, label, ids, missing):
+        """
+        Returns {id: (embedding_model, embedding_hash, dimensions, properties)} of
+        the stored nodes, properties (without the embedding) only for ids in missing.
+        """
         with self.driver.session() as session:
             result = session.run(
-                f"""MATCH (n:{node_label} {{id: $id}}) RETURN n""", id=node_id
+                f"UNWIND $ids AS id MATCH (n:{label} {{id: id}}) "
+                "RETURN id, n.embedding_model AS model, n.embedding_hash AS hash, "
+                "size(coalesce(n.embedding, [])) AS dimensions, "
+                "CASE WHEN id IN $missing THEN n {.*, embedding: null} END AS properties",
+                ids=ids,
+                missing=missing,
             )
-            record = result.single()
-            if record is None:
-                logger.error(f"No node found for label {node_label} with id {node_id}")
-                return
-            node = record["n"]
-            new_embedding = self._generate_embeddings_for_node(node, indexed_properties)
-
-            # Check if an existing embedding is present and append the new embedding
-            existing_embedding = node.get("embedding", [])
-            if existing_embedding:
-                combined_embedding = existing_embedding + new_embedding
-            else:
-                combined_embedding = new_embedding
-
-            session.run(
-                f"""
-                MATCH (n:{node_label} {{id: $id}})
-                SET n.embedding = $embedding
-            """,
-                id=node_id,
-                embedding=combined_embedding,
+            return {
+                record["id"]: (
+                    record["model"],
+                    record["hash"],
+                    record["dimensions"],
+                    record["properties"],
+                )
+                for record in result
+            }
+
+    def _embedding_batches(self, texts):
+        """
+        Returns generator of lists of indexes into texts, each list one embedding
+        request of at most EMBEDDING_BATCH_TOKENS and EMBEDDING_BATCH_INPUTS.
+        """
+        batch, batch_tokens = [], 0
+        for i, tokens in texts:
+            if batch and (
+                batch_tokens + tokens > EMBEDDING_BATCH_TOKENS
+                or len(batch) >= EMBEDDING_BATCH_INPUTS
+            ):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _embed_texts(self, label, texts, keys, model):
+        """
+        Returns {index: vector} for a list of (text, tokens) with their cache_key,
+        from the cache or multi-input embedding requests, sent concurrently by the
+        client. Texts of failed requests are left out.
+        """
+        vectors = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(keys)
+            vectors = {i: cached[key] for i, key in enumerate(keys) if key in cached}
+            metrics.incr("embedding_cache", "hits", len(vectors), label)
+            metrics.incr("embedding_cache", "misses", len(keys) - len(vectors), label)
+
+        pending = [
+            (i, tokens) for i, (text, tokens) in enumerate(texts) if i not in vectors
+        ]
+        batches = list(self._embedding_batches(pending))
+        requests = [
+            ([texts[i][0] for i in batch], sum(texts[i][1] for i in batch))
+            for batch in batches
+        ]
+        retries = self.client.retries
+        with metrics.timer("embedding_requests", label):
+            results = self.client.embed_many(requests, model)
+        metrics.incr("embedding", "retries", self.client.retries - retries, label)
+        for batch, (inputs, tokens), result in zip(batches, requests, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Error embedding {len(batch)} {label} nodes, error: {result}"
+                )
+                continue
+            metrics.incr("embedding", "requests", label=label)
+            metrics.incr("embedding", "tokens", tokens, label)
+            fresh = {}
+            for i, embedding in zip(batch, result):
+                if len(embedding) != EMBEDDING_DIMENSIONS:
+                    logger.error(
+                        f"Unexpected {len(embedding)} dimensional embedding "
+                        f"for a {label} node"
+                    )
+                    continue
+                fresh[i] = embedding
+            if self.cache is not None:
+                self.cache.put_many({keys[i]: vector for i, vector in fresh.items()})
+            vectors.update(fresh)
+        return vectors
+
+    @staticmethod
+    def _write_embeddings(tx, label, rows, model):
+        tx.run(
+            f"UNWIND $rows AS row "
+            f"MATCH (n:{label} {{id: row.id}}) "
+            "SET n.embedding = row.embedding, "
+            "n.embedding_model = $model, "
+            "n.embedding_hash = row.hash",
+            rows=rows,
+            model=model,
+        )
+
+    def update_embeddings_bulk(self, items, model=EMBEDDING_MODEL):
+        """
+        Updates the embeddings of an iterable of (label, id, properties), properties
+        None to read them from Neo4j. Nodes whose stored embedding_hash matches
+        their text are skipped. Texts not in the cache are sent in multi-input
+        requests sized by token count, and each label's vectors written in UNWIND
+        batches of EMBEDDING_WRITE_BATCH_SIZE, replacing the stored embedding along
+        with its embedding_model and embedding_hash. Returns the items that failed.
+        """
+        by_label = {}
+        for label, id, properties in items:
+            by_label.setdefault(label, []).append((id, properties))
+
+        failed = []
+        for label, nodes in by_label.items():
+            indexed_properties = self.node_label_to_indexed_properties.get(label)
+            if indexed_properties is None:
+                # Labels without indexed properties have no embeddings
+                metrics.incr("embedding", "skipped", len(nodes), label)
+                continue
+
+            missing = [id for id, properties in nodes if properties is None]
+            stored = self._read_embedding_state(
+                label, [id for id, properties in nodes], missing
             )
-            logger.info(f"Updated embedding for node: {node_label} with id: {node_id}")
+            ids, texts, keys = [], [], []
+            unchanged = 0
+            for id, properties in nodes:
+                if id not in stored:
+                    logger.error(f"No node found for label {label} with id {id}")
+                    continue
+                stored_model, stored_hash, dimensions, stored_properties = stored[id]
+                if properties is None:
+                    properties = stored_properties
+                text = self.node_text(properties, indexed_properties)
+                # Keyed on the whole text, as the query engine's backfill does
+                key = cache_key(model, text)
+                text, tokens = truncate_text(text, count_tokens(text))
+                if (
+                    stored_hash == key
+                    and stored_model == model
+                    and dimensions == EMBEDDING_DIMENSIONS
+                ):
+                    unchanged += 1
+                    continue
+                ids.append(id)
+                texts.append((text, tokens))
+                keys.append(key)
+            metrics.incr("embedding", "unchanged", unchanged, label)
+
+            vectors = self._embed_texts(label, texts, keys, model)
+            rows = [
+                {"id": ids[i], "embedding": vector, "hash": keys[i]}
+                for i, vector in sorted(vectors.items())
+            ]
+            failed.extend(
+                (label, ids[i], None) for i in range(len(ids)) if i not in vectors
+            )
+            for i in range(0, len(rows), EMBEDDING_WRITE_BATCH_SIZE):
+                batch = rows[i : i + EMBEDDING_WRITE_BATCH_SIZE]
+                try:
+                    with self.driver.session() as session:
+                        session.execute_write(
+                            self._write_embeddings, label, batch, model
+                        )
+                except (DriverError, Neo4jError) as e:
+                    logger.error(
+                        f"Error writing embeddings of {len(batch)} {label} nodes, error: {e}"
+                    )
+                    failed.extend((label, row["id"], None) for row in batch)
+                    continue
+                metrics.incr("embedding", "nodes", len(batch), label)
+        return failed
+
+    @staticmethod
+    def _compact_embeddings(tx, label, batch_size):
+        return tx.run(
+            f"MATCH (n:{label}) "
+            "WHERE size(n.embedding) > $dimensions "
+            "WITH n LIMIT $batch_size "
+            "SET n.embedding = "
+            "n.embedding[size(n.embedding) - $dimensions..], "
+            "n.embedding_hash = null "
+            "RETURN count(n) AS count",
+            dimensions=EMBEDDING_DIMENSIONS,
+            batch_size=batch_size,
+        ).single()["count"]
+
+    def repair_embeddings(self, labels=None, batch_size=EMBEDDING_REPAIR_BATCH_SIZE):
+        """
+        Compacts embeddings that earlier updates concatenated into one long list
+        down to their last (most recent) EMBEDDING_DIMENSIONS values, and clears
+        their embedding_hash so the next update re-checks them. Returns
+        {label: repaired count}.
+        """
+        repaired = {}
+        for label in labels or self.node_label_to_indexed_properties:
+            repaired[label] = 0
+            while True:
+                with self.driver.session() as session:
+                    count = session.execute_write(
+                        self._compact_embeddings, label, batch_size
+                    )
+                repaired[label] += count
+                if count < batch_size:
+                    break
+            logger.info(f"Repaired embeddings of {repaired[label]} {label} nodes")
+        return repaired
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compacts concatenated node embeddings to a single vector."
+    )
+    parser.add_argument("--uri", default=os.getenv("NEO4J_URI"))
+    parser.add_argument("--user", default=os.getenv("NEO4J_USER"))
+    parser.add_argument("--password", default=os.getenv("NEO4J_PASSWORD"))
+    parser.add_argument("--label", action="append", help="defaults to all labels")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_REPAIR_BATCH_SIZE)
+    args = parser.parse_args()
+
+    manager = Neo4jEmbeddingManager(args.uri, args.user, args.password)
+    try:
+        manager.repair_embeddings(args.label, args.batch_size)
+    finally:
+        manager.driver.close()
+
+
+if __name__ == "__main__":
+    main()
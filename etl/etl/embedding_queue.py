@@ -0,0 +1,172 @@
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+
+from neo4j.exceptions import DriverError, Neo4jError
+
+from etl.metrics import metrics
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Nodes handed to the embedding manager per drained batch
+EMBEDDING_BATCH_SIZE = 1000
+
+# SendMessageBatch and ReceiveMessage accept at most 10 messages per request
+SQS_MAX_BATCH = 10
+
+# Leaves room below the 256 KiB limit of a SendMessageBatch request
+SQS_MAX_MESSAGE_BYTES = 24 * 1024
+
+# Attempts at sending the failed entries of a batch before giving up
+SQS_SEND_MAX_ATTEMPTS = 5
+SQS_SEND_BACKOFF_SECONDS = 0.2
+
+
+class EmbeddingQueueError(Exception):
+    pass
+
+
+class EmbeddingQueue:
+    """
+    Queue of (label, id, properties) of upserted nodes whose embeddings need
+    updating, properties None when the consumer has to read them from Neo4j.
+    in_process queues are drained by EmbeddingWorker in the uploading process once
+    the upload committed, durable ones by a separate consumer (embedding_queue_handler).
+    """
+
+    in_process = False
+
+    def put_many(self, items):
+        """
+        Enqueues an iterable of (label, id, properties).
+        """
+        raise NotImplementedError
+
+    def put(self, label, id, properties=None):
+        self.put_many([(label, id, properties)])
+
+
+class InMemoryEmbeddingQueue(EmbeddingQueue):
+    in_process = True
+
+    def __init__(self):
+        # (label, id) -> properties, a node upserted twice is embedded once
+        self.items = OrderedDict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put_many(self, items):
+        for label, id, properties in items:
+            self.items.pop((label, id), None)
+            self.items[(label, id)] = properties
+
+    def get_batch(self, batch_size):
+        batch = []
+        while self.items and len(batch) < batch_size:
+            (label, id), properties = self.items.popitem(last=False)
+            batch.append((label, id, properties))
+        return batch
+
+
+class SQSEmbeddingQueue(EmbeddingQueue):
+    """
+    Durable queue on SQS, one {"label", "id", "properties"} JSON message per node.
+    Properties are left out of messages that would exceed the SQS size limit.
+    """
+
+    def __init__(self, queue_url, sqs=None):
+        if sqs is None:
+            import boto3
+
+            sqs = boto3.client("sqs")
+        self.sqs = sqs
+        self.queue_url = queue_url
+
+    def put_many(self, items):
+        batch = []
+        for label, id, properties in items:
+            item = {"label": label, "id": id, "properties": properties}
+            if len(json.dumps(item)) > SQS_MAX_MESSAGE_BYTES:
+                item["properties"] = None
+            batch.append(item)
+            if len(batch) == SQS_MAX_BATCH:
+                self._send_batch(batch)
+                batch = []
+        if batch:
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        entries = [
+            {"Id": str(i), "MessageBody": json.dumps(item)}
+            for i, item in enumerate(batch)
+        ]
+        for attempt in range(1, SQS_SEND_MAX_ATTEMPTS + 1):
+            response = self.sqs.send_message_batch(
+                QueueUrl=self.queue_url, Entries=entries
+            )
+            failures = {
+                failure["Id"]: failure for failure in response.get("Failed", [])
+            }
+            entries = [entry for entry in entries if entry["Id"] in failures]
+            if not entries:
+                return
+            # Sender faults (e.g. an invalid message) fail the same way every time
+            if attempt == SQS_SEND_MAX_ATTEMPTS or any(
+                failure.get("SenderFault") for failure in failures.values()
+            ):
+                break
+            delay = SQS_SEND_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            logger.warning(
+                f"Resending {len(entries)} embedding queue messages in {delay:.1f}s"
+            )
+            time.sleep(delay * random.uniform(1, 1.5))
+        raise EmbeddingQueueError(
+            f"Failed to send {len(entries)} embedding queue messages: "
+            f"{list(failures.values())[:3]}"
+        )
+
+
+class EmbeddingWorker:
+    """
+    Updates embeddings of queued nodes with neo4j_manager, outside of any upload
+    transaction.
+    """
+
+    def __init__(self, neo4j_manager, batch_size=EMBEDDING_BATCH_SIZE):
+        self.neo4j_manager = neo4j_manager
+        self.batch_size = batch_size
+
+    def process(self, items):
+        """
+        Updates the embeddings of a list of (label, id, properties) in bulk, returns
+        the items that failed.
+        """
+        try:
+            failed = self.neo4j_manager.update_embeddings_bulk(items)
+        except (DriverError, Neo4jError) as e:
+            logger.error(f"Error updating embeddings of {len(items)} nodes: {e}")
+            failed = list(items)
+        if failed:
+            metrics.incr("embedding", "failures", len(failed))
+        return failed
+
+    def drain(self, queue, minimum=1):
+        """
+        Processes batches of an in_process queue while it holds at least minimum
+        items, by default until it's empty. Returns the processed count.
+        """
+        count = 0
+        while len(queue) >= minimum:
+            batch = queue.get_batch(self.batch_size)
+            if not batch:
+                break
+            self.process(batch)
+            count += len(batch)
+        if count:
+            logger.info(f"Updated embeddings of {count} nodes")
+        return count
@@ -0,0 +1,69 @@
+import json
+import logging
+import os
+
+try:
+    import orjson
+except ImportError:  # optional, pip install etl[fast]
+    orjson = None
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class StdlibCodec:
+    name = "json"
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode("utf-8")
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj):
+        return orjson.dumps(obj)
+
+
+CODECS = {"json": StdlibCodec, "orjson": OrjsonCodec}
+
+
+def get_codec(name=None):
+    """
+    Returns the named codec, or the fastest installed one when name is None.
+    """
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson" and orjson is None:
+        raise ValueError("orjson codec requested but orjson is not installed")
+    return CODECS[name]()
+
+
+def set_codec(name=None):
+    """
+    Selects the codec used by loads, dumps and dumps_line of this module.
+    """
+    global codec, loads, dumps
+    codec = get_codec(name)
+    loads = codec.loads
+    dumps = codec.dumps
+    logger.info(f"Using {codec.name} JSON codec")
+
+
+def dumps_line(obj):
+    """
+    Serializes obj to a JSONL line as bytes.
+    """
+    return dumps(obj) + b"\n"
+
+
+# loads accepts bytes or str, dumps returns bytes. ETL_JSON_CODEC forces a backend.
+codec = loads = dumps = None
+set_codec(os.getenv("ETL_JSON_CODEC"))
@@ -0,0 +1,42 @@
+import json
+from urllib.parse import unquote_plus
+
+
+class ManifestEntry:
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        # airbyte/<source>/<data_type>/<file>.csv
+        self.mapkey = "/".join(key.split("/")[1:3])
+        self.source, _, self.data_type = self.mapkey.partition("/")
+
+    def to_dict(self):
+        return {"bucket": self.bucket, "key": self.key, "mapkey": self.mapkey}
+
+
+class InvocationManifest:
+    """
+    Objects and data types touched by a single ETL invocation. Generation and upload
+    are scoped to these, so work does not grow with what a warm container has seen.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = list(entries or [])
+
+    @classmethod
+    def from_s3_event(cls, event):
+        manifest = cls()
+        for record in event.get("Records", []):
+            manifest.add(
+                record["s3"]["bucket"]["name"],
+                unquote_plus(record["s3"]["object"]["key"]),
+            )
+        return manifest
+
+    def add(self, bucket, key):
+        entry = ManifestEntry(bucket, key)
+        self.entries.append(entry)
+        return entry
+
+    def to_json(self):
+        return json.dumps([entry.to_dict() for entry in self.entries])
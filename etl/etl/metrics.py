@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Seconds between metrics lines, a line is also emitted at the end of each file
+# upload (StreamingPipeline.run and Neo4jUploader.upload_file_to_neo4j)
+METRICS_EMIT_INTERVAL = float(os.getenv("ETL_METRICS_INTERVAL", "60"))
+
+# Fraction of records logged by log_sampled at debug level, e.g. 0.001
+LOG_SAMPLE_RATE = float(os.getenv("ETL_LOG_SAMPLE_RATE", "0"))
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def to_dict(self):
+        bounds = [f"le_{bound}" for bound in self.buckets] + ["inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "max": round(self.max, 3),
+            "buckets": {
+                bound: count for bound, count in zip(bounds, self.counts) if count
+            },
+        }
+
+
+class Metrics:
+    """
+    Counters and latency histograms per stage and label (e.g. upload/jira_issue),
+    emitted as a single JSON log line every interval seconds and on emit(), then
+    reset. Thread safe, the parallel upload workers share it.
+    """
+
+    def __init__(self, interval=METRICS_EMIT_INTERVAL, sample_rate=LOG_SAMPLE_RATE):
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.monotonic()
+
+    def incr(self, stage, name, value=1, label=None):
+        key = (stage, label or "all", name)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_emit()
+
+    def observe(self, stage, milliseconds, label=None):
+        key = (stage, label or "all")
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(milliseconds)
+
+    @contextmanager
+    def timer(self, stage, label=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000, label)
+
+    def maybe_emit(self):
+        if time.monotonic() - self.started >= self.interval:
+            self.emit()
+
+    def emit(self):
+        with self._lock:
+            counters, histograms = self.counters, self.histograms
+            elapsed = time.monotonic() - self.started
+            self._reset()
+        if not counters and not histograms:
+            return
+        line = {"metrics": "etl", "interval_seconds": round(elapsed, 3)}
+        for (stage, label, name), value in sorted(counters.items()):
+            line.setdefault(stage, {}).setdefault(label, {})[name] = value
+        for (stage, label), histogram in sorted(histograms.items()):
+            line.setdefault(stage, {}).setdefault(label, {})["latency_ms"] = (
+                histogram.to_dict()
+            )
+        logger.info(json.dumps(line, default=str))
+
+    def counted(self, iterable, stage, name, label=None, every=1000):
+        """
+        Returns generator of the items of iterable, counting them as name.
+        """
+        count = 0
+        for item in iterable:
+            count += 1
+            if count == every:
+                self.incr(stage, name, count, label)
+                count = 0
+            yield item
+        if count:
+            self.incr(stage, name, count, label)
+
+    def sampled(self):
+        """
+        True for sample_rate of the calls, for record level debug logging.
+        """
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+
+# Process wide metrics of the ETL
+metrics = Metrics()
+
+
+def log_sampled(message, *args):
+    # Record level logs, only for LOG_SAMPLE_RATE of the records
+    if metrics.sampled():
+        logger.debug(message, *args)
@@ -0,0 +1,315 @@
+"""
+Converts graph generator output (*_data.jsonl) to node and relationship CSVs for
+an offline `neo4j-admin database import full`, for initial loads of a workspace
+that would take hours through Neo4jUploader's transactional MERGEs. Embeddings
+aren't part of the import and are computed by a backfill afterwards.
+
+    $ python -m etl.neo4j.bulk_import graph_output/ import/
+    $ python -m etl.neo4j.bulk_import --validate import/
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+
+from etl import jsoncodec
+from etl.neo4j.upload import DEFAULT_IDENTITY_KEY
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# neo4j-admin's default --array-delimiter
+ARRAY_DELIMITER = ";"
+
+# <property name>:<type>, :ID(<group>), :START_ID(<group>), :LABEL, ...
+HEADER_FIELD_RE = re.compile(
+    r"^(?P<name>[^:()]*)"
+    r"(?::(?P<type>ID|START_ID|END_ID|LABEL|TYPE|IGNORE|int|long|float|double|"
+    r"boolean|byte|short|char|string|point|date|localtime|time|localdatetime|"
+    r"datetime|duration)(?P<array>\[\])?)?"
+    r"(?:\((?P<group>[^()]+)\))?$"
+)
+
+# Fields a header of each kind needs exactly once
+REQUIRED_FIELDS = {"node": ["ID"], "relationship": ["START_ID", "END_ID", "TYPE"]}
+
+
+def _value_type(value):
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "long"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, list):
+        types = {_value_type(item) for item in value if item is not None}
+        if len(types) == 1 and types <= {"boolean", "long", "double", "string"}:
+            return f"{types.pop()}[]"
+        return "json"
+    if isinstance(value, dict):
+        return "json"
+    return "string"
+
+
+def _merge_types(current, new):
+    if current is None or current == new:
+        return new
+    if {current, new} == {"long", "double"}:
+        return "double"
+    # Mixed types, exported as text
+    return "json" if "json" in (current, new) or "[]" in current + new else "string"
+
+
+def _format_value(value, value_type):
+    if value is None:
+        return ""
+    if value_type == "json":
+        return value if isinstance(value, str) else json.dumps(value)
+    if value_type.endswith("[]"):
+        return ARRAY_DELIMITER.join(_format_value(item, "") for item in value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _header_type(value_type):
+    # json columns hold serialized values
+    return "string" if value_type == "json" else value_type
+
+
+class BulkImportExporter:
+    """
+    Collects graph records and writes one CSV per node label (nodes_<label>.csv)
+    and per (start label, type, end label) (relationships_<...>.csv). Node ids are
+    deduplicated, later properties overriding earlier ones like the uploader's
+    SET n += ..., and relationships are deduplicated. Nodes only referenced by
+    relationships are written with their id alone, as MERGE would create them.
+    Ids are compared as strings, as neo4j-admin reads them, so e.g. a project id
+    given as 10 by one record and "10" by another is one node.
+    """
+
+    def __init__(self, identity_keys=None):
+        # Same per label overrides as Neo4jUploader.identity_keys
+        self.identity_keys = identity_keys or {}
+        self.nodes = {}
+        self.relationships = {}
+        self.duplicates = 0
+
+    def identity_key(self, label):
+        return self.identity_keys.get(label, DEFAULT_IDENTITY_KEY)
+
+    def add_records(self, records):
+        for obj in records:
+            if obj.get("type") == "node":
+                self._add_node(obj.get("label"), obj.get("properties") or {})
+            elif obj.get("type") == "relationship":
+                self._add_relationship(obj)
+
+    def add_file(self, filepath):
+        with open(filepath, "rb") as fh:
+            self.add_records(jsoncodec.loads(line) for line in fh)
+
+    def _add_node(self, label, properties):
+        key = properties.get(self.identity_key(label))
+        if not label or key is None:
+            return
+        key = str(key)
+        nodes = self.nodes.setdefault(label, {})
+        if key in nodes:
+            self.duplicates += 1
+            nodes[key].update(properties)
+        else:
+            nodes[key] = dict(properties)
+
+    def _add_relationship(self, obj):
+        start_node = obj.get("start_node", {})
+        end_node = obj.get("end_node", {})
+        label1, label2 = start_node.get("label"), end_node.get("label")
+        if not (label1 and label2 and obj.get("relationship")):
+            return
+        key1 = start_node.get(self.identity_key(label1))
+        key2 = end_node.get(self.identity_key(label2))
+        if key1 is None or key2 is None:
+            return
+        self.relationships.setdefault((label1, obj["relationship"], label2), set()).add(
+            (str(key1), str(key2))
+        )
+        # Endpoints without a node record are created with their id only
+        for label, key in ((label1, key1), (label2, key2)):
+            self.nodes.setdefault(label, {}).setdefault(
+                str(key), {self.identity_key(label): key}
+            )
+
+    def write(self, output_directory):
+        """
+        Writes the CSVs, returns {"nodes": [paths], "relationships": [paths]}.
+        """
+        os.makedirs(output_directory, exist_ok=True)
+        paths = {"nodes": [], "relationships": []}
+        for label, nodes in sorted(self.nodes.items()):
+            filepath = os.path.join(output_directory, f"nodes_{label}.csv")
+            self._write_nodes(filepath, label, nodes)
+            paths["nodes"].append(filepath)
+        for (label1, relationship, label2), pairs in sorted(self.relationships.items()):
+            filepath = os.path.join(
+                output_directory, f"relationships_{label1}_{relationship}_{label2}.csv"
+            )
+            with open(filepath, "w", newline="") as fh:
+                writer = csv.writer(fh)
+                writer.writerow([f":START_ID({label1})", f":END_ID({label2})", ":TYPE"])
+                for key1, key2 in sorted(pairs):
+                    writer.writerow([key1, key2, relationship])
+            paths["relationships"].append(filepath)
+        logger.info(
+            f"Wrote {len(paths['nodes'])} node and {len(paths['relationships'])} "
+            f"relationship files to {output_directory}, "
+            f"{self.duplicates} duplicate nodes merged"
+        )
+        return paths
+
+    def _write_nodes(self, filepath, label, nodes):
+        types = {}
+        for properties in nodes.values():
+            for name, value in properties.items():
+                if value is not None:
+                    types[name] = _merge_types(types.get(name), _value_type(value))
+        columns = sorted(types)
+        with open(filepath, "w", newline="") as fh:
+            writer = csv.writer(fh)
+            # Unnamed :ID column so the id property keeps its own type
+            writer.writerow(
+                [f":ID({label})"]
+                + [f"{name}:{_header_type(types[name])}" for name in columns]
+                + [":LABEL"]
+            )
+            for key, properties in nodes.items():
+                writer.writerow(
+                    [key]
+                    + [
+                        _format_value(properties.get(name), types[name])
+                        for name in columns
+                    ]
+                    + [label]
+                )
+
+    def import_command(self, paths, database="neo4j"):
+        arguments = [f"--nodes={path}" for path in paths["nodes"]]
+        arguments += [f"--relationships={path}" for path in paths["relationships"]]
+        return " ".join(
+            ["neo4j-admin database import full", "--multiline-fields=true"]
+            + arguments
+            + [database]
+        )
+
+
+def validate_header(header, kind):
+    """
+    Returns the list of problems of a node or relationship CSV header.
+    """
+    problems = []
+    counts = {}
+    for field in header:
+        match = HEADER_FIELD_RE.match(field)
+        if match is None:
+            problems.append(f"invalid field {field!r}")
+            continue
+        field_type = match.group("type")
+        if field_type in ("ID", "START_ID", "END_ID", "LABEL", "TYPE"):
+            counts[field_type] = counts.get(field_type, 0) + 1
+            if match.group("array"):
+                problems.append(f"{field!r} can't be an array")
+        elif match.group("group"):
+            problems.append(f"only id fields take an id group: {field!r}")
+        if not match.group("name") and field_type in (None, "IGNORE"):
+            problems.append(f"property field without a name: {field!r}")
+    for required in REQUIRED_FIELDS[kind]:
+        if counts.get(required, 0) != 1:
+            problems.append(f"expected one :{required} field")
+    return problems
+
+
+def validate_csv(filepath):
+    """
+    Validates the header of an exported CSV, kind from its file name, that every
+    row has as many columns and that node ids are unique, as neo4j-admin rejects
+    duplicate ids. Returns the list of problems.
+    """
+    kind = "node" if os.path.basename(filepath).startswith("nodes_") else "relationship"
+    with open(filepath, newline="") as fh:
+        reader = csv.reader(fh)
+        header = next(reader, [])
+        problems = validate_header(header, kind)
+        matches = [HEADER_FIELD_RE.match(field) for field in header]
+        id_columns = [
+            i
+            for i, match in enumerate(matches)
+            if match and match.group("type") == "ID"
+        ]
+        # id -> first row, for node files with one :ID field
+        ids = {} if kind == "node" and len(id_columns) == 1 else None
+        for line, row in enumerate(reader, start=2):
+            if len(row) != len(header):
+                problems.append(f"row {line} has {len(row)} of {len(header)} columns")
+                continue
+            if ids is not None:
+                id = row[id_columns[0]]
+                if id in ids:
+                    problems.append(f"row {line} duplicates id {id!r} of row {ids[id]}")
+                else:
+                    ids[id] = line
+    return [f"{filepath}: {problem}" for problem in problems]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "input", help="*_data.jsonl file or directory, or CSVs with --validate"
+    )
+    parser.add_argument("output_directory", nargs="?")
+    parser.add_argument("--validate", action="store_true")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        filepaths = sorted(
+            os.path.join(root, file)
+            for root, dirs, files in os.walk(args.input)
+            for file in files
+        )
+    else:
+        filepaths = [args.input]
+
+    if args.validate:
+        problems = [
+            problem
+            for filepath in filepaths
+            if filepath.endswith(".csv")
+            for problem in validate_csv(filepath)
+        ]
+        for problem in problems:
+            print(problem)
+        raise SystemExit(1 if problems else 0)
+
+    if not args.output_directory:
+        parser.error("output_directory is required unless --validate")
+    exporter = BulkImportExporter()
+    for filepath in filepaths:
+        if filepath.endswith(".jsonl"):
+            exporter.add_file(filepath)
+    paths = exporter.write(args.output_directory)
+    problems = [
+        problem
+        for filepath in paths["nodes"] + paths["relationships"]
+        for problem in validate_csv(filepath)
+    ]
+    for problem in problems:
+        print(problem)
+    print(exporter.import_command(paths))
+    raise SystemExit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
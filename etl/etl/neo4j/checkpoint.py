@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Records between checkpoints when uploading record by record
+UPLOAD_CHECKPOINT_INTERVAL = 1000
+
+# Type of the records marking input progress among graph records
+PROGRESS_RECORD_TYPE = "progress"
+
+
+def progress_record(rows):
+    """
+    Record placed after the graph records of the first rows input rows, the
+    uploader checkpoints the last one before each committed batch.
+    """
+    return {"type": PROGRESS_RECORD_TYPE, "rows": rows}
+
+
+def file_identity(filepath):
+    """
+    Identity of a local file, changes when the file is rewritten.
+    """
+    stat = os.stat(filepath)
+    return f"file://{os.path.abspath(filepath)}@{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def s3_object_identity(client, bucket, key):
+    """
+    Identity of an S3 object, changes with every new version of the object.
+    """
+    etag = client.head_object(Bucket=bucket, Key=key).get("ETag", "").strip('"')
+    return f"s3://{bucket}/{key}@{etag}"
+
+
+class CheckpointStore:
+    """
+    Upload progress per input identity, written by Neo4jUploader after each
+    committed batch as {"rows": <input rows whose records are uploaded>,
+    "records": <records uploaded>, ...} and deleted once the input is fully
+    uploaded. Subclasses implement get, put and delete.
+    """
+
+    def get(self, identity):
+        raise NotImplementedError
+
+    def put(self, identity, checkpoint):
+        raise NotImplementedError
+
+    def delete(self, identity):
+        raise NotImplementedError
+
+    def _name(self, identity):
+        return f"{hashlib.sha256(identity.encode('utf-8')).hexdigest()}.json"
+
+
+class LocalFileCheckpointStore(CheckpointStore):
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, identity):
+        return os.path.join(self.directory, self._name(identity))
+
+    def get(self, identity):
+        try:
+            with open(self._path(identity)) as fh:
+                return json.load(fh)["checkpoint"]
+        except FileNotFoundError:
+            return None
+
+    def put(self, identity, checkpoint):
+        path = self._path(identity)
+        # Write then rename, so a crash never leaves a partial checkpoint
+        with open(f"{path}.tmp", "w") as fh:
+            json.dump({"identity": identity, "checkpoint": checkpoint}, fh)
+        os.replace(f"{path}.tmp", path)
+
+    def delete(self, identity):
+        try:
+            os.remove(self._path(identity))
+        except FileNotFoundError:
+            pass
+
+
+class S3CheckpointStore(CheckpointStore):
+    """
+    Checkpoints as objects under prefix, shared by every Lambda container.
+    """
+
+    def __init__(self, bucket, prefix="etl/checkpoints/", s3=None):
+        if s3 is None:
+            import boto3
+
+            s3 = boto3.client("s3")
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, identity):
+        try:
+            response = self.s3.get_object(
+                Bucket=self.bucket, Key=f"{self.prefix}{self._name(identity)}"
+            )
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response["Body"].read())["checkpoint"]
+
+    def put(self, identity, checkpoint):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{self._name(identity)}",
+            Body=json.dumps({"identity": identity, "checkpoint": checkpoint}),
+        )
+
+    def delete(self, identity):
+        self.s3.delete_object(
+            Bucket=self.bucket, Key=f"{self.prefix}{self._name(identity)}"
+        )
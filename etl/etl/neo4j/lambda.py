@@ -2,8 +2,10 @@ import os
 import json
 import boto3
 import logging
+from knowledge_graph.driver import get_driver
 
 from etl.embedding import Neo4jEmbeddingManager
+from etl.s3_stream import open_airbyte_object
 from etl.transforms import (
     Airbyte2jsonlTransformer,
     ConfluenceGraphGenerator,
@@ -11,6 +13,26 @@ from etl.transforms import (
     JiraGraphGenerator,
 )
 from etl.neo4j.upload import Neo4jUploader
+from etl.neo4j.schema import Neo4jSchemaManager
+from etl.neo4j.checkpoint import (
+    LocalFileCheckpointStore,
+    S3CheckpointStore,
+    s3_object_identity,
+)
+from etl.pipeline import StreamingPipeline
+from etl.manifest import InvocationManifest
+from etl.embedding_queue import (
+    EmbeddingWorker,
+    InMemoryEmbeddingQueue,
+    SQSEmbeddingQueue,
+)
+from etl.state import (
+    ChangeDetector,
+    DynamoDBStateStore,
+    SQLiteStateStore,
+    StreamWatermark,
+    VersionGuard,
+)
 
 # Initialize the logger
 logger = logging.getLogger()
@@ -22,19 +44,101 @@ s3 = boto3.client("s3")
 # Initialize the Transformer class
 airbyte2jsonl_transformer = Airbyte2jsonlTransformer()
 
+# One Neo4j driver per container, reused by warm invocations
+driver = get_driver(
+    os.getenv("NEO4J_URI"), os.getenv("NEO4J_USER"), os.getenv("NEO4J_PASSWORD")
+)
+
 # Initialize Neo4jEmbeddingManager
 neo4j_manager = Neo4jEmbeddingManager(
     url=os.getenv("NEO4J_URI"),
     username=os.getenv("NEO4J_USER"),
     password=os.getenv("NEO4J_PASSWORD"),
+    driver=driver,
 )
 
+
+def get_embedding_queue():
+    # ETL_EMBEDDING_QUEUE_URL defers embeddings to embedding_queue_handler over SQS
+    if os.getenv("ETL_EMBEDDING_QUEUE_URL"):
+        return SQSEmbeddingQueue(os.getenv("ETL_EMBEDDING_QUEUE_URL"))
+    return InMemoryEmbeddingQueue()
+
+
+def get_checkpoint_store():
+    # ETL_CHECKPOINT_BUCKET (S3) or ETL_CHECKPOINT_DIR let retries resume uploads
+    if os.getenv("ETL_CHECKPOINT_BUCKET"):
+        return S3CheckpointStore(os.getenv("ETL_CHECKPOINT_BUCKET"), s3=s3)
+    if os.getenv("ETL_CHECKPOINT_DIR"):
+        return LocalFileCheckpointStore(os.getenv("ETL_CHECKPOINT_DIR"))
+    return None
+
+
 # Initialize Neo4jUploader
 uploader = Neo4jUploader(
     uri=os.getenv("NEO4J_URI"),
     user=os.getenv("NEO4J_USER"),
     password=os.getenv("NEO4J_PASSWORD"),
     neo4j_manager=neo4j_manager,
+    driver=driver,
+    batch_size=int(os.getenv("ETL_UPLOAD_BATCH_SIZE", "1000")),
+    embedding_queue=get_embedding_queue(),
+    # Parallel upload sessions, 1 writes batches one at a time. Labels without
+    # the schema's uniqueness constraints are always written one at a time
+    workers=int(os.getenv("ETL_UPLOAD_WORKERS", "1")),
+    checkpoint_store=get_checkpoint_store(),
+)
+
+# Worker processes used to transform large airbyte files, 1 transforms serially
+TRANSFORM_WORKERS = int(os.getenv("ETL_TRANSFORM_WORKERS", "1"))
+
+# Forces a full refresh for every invocation, see lambda_handler
+FULL_REFRESH = os.getenv("ETL_FULL_REFRESH", "").lower() in ("1", "true", "yes")
+
+
+# Create missing constraints and indexes until a bootstrap in the container succeeds
+SCHEMA_BOOTSTRAP = os.getenv("ETL_SCHEMA_BOOTSTRAP", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+schema_bootstrapped = False
+
+
+def bootstrap_schema():
+    global schema_bootstrapped
+    if not SCHEMA_BOOTSTRAP or schema_bootstrapped:
+        return
+    failed = Neo4jSchemaManager(uploader.driver, uploader.identity_keys).bootstrap()
+    if failed:
+        # Retried by the next invocation, constraints over existing duplicate
+        # nodes need python -m etl.neo4j.schema --merge-duplicates first
+        logger.error(f"Schema bootstrap incomplete, {failed} statements failed")
+        return
+    schema_bootstrapped = True
+
+
+def get_state_store():
+    # ETL_STATE_TABLE (DynamoDB) or ETL_STATE_DB (SQLite path) enable state tracking
+    if os.getenv("ETL_STATE_TABLE"):
+        return DynamoDBStateStore(os.getenv("ETL_STATE_TABLE"))
+    if os.getenv("ETL_STATE_DB"):
+        return SQLiteStateStore(os.getenv("ETL_STATE_DB"))
+    return None
+
+
+state_store = get_state_store()
+
+# Initialize the streaming pipeline, ETL_DEBUG_OUTPUT_DIR keeps graph record files
+pipeline = StreamingPipeline(
+    airbyte2jsonl_transformer,
+    uploader,
+    debug_directory=os.getenv("ETL_DEBUG_OUTPUT_DIR"),
+    change_detector=ChangeDetector(state_store) if state_store else None,
+    version_guard=VersionGuard(state_store) if state_store else None,
+    watermark=StreamWatermark(state_store) if state_store else None,
+    # Drop graph records repeated within a file, ETL_DEDUP=false disables it
+    deduplicate=os.getenv("ETL_DEDUP", "true").lower() in ("1", "true", "yes"),
 )
 
 GRAPH_GENERATOR_MAP = {
@@ -48,57 +152,62 @@ def lambda_handler(event, context):
     try:
         logger.info(f"Received event: {json.dumps(event)}")
 
-        bucket_name = event["Records"][0]["s3"]["bucket"]["name"]
-        object_key = event["Records"][0]["s3"]["object"]["key"]
-
-        logger.info(f"Bucket: {bucket_name}, Object: {object_key}")
-
-        download_path = f'/tmp/{object_key.replace("/", "_")}'
-        s3.download_file(bucket_name, object_key, download_path)
-
-        # mapkey = '/'.join(object_key.split('/')[1:-1])
-        mapkey = "/".join(object_key.split("/")[1:3])
-        logger.info(f"Mapkey: {mapkey}")
+        bootstrap_schema()
+        # Warm containers keep the uploader, the graph may have changed since
+        uploader.start_run()
 
-        if not airbyte2jsonl_transformer.can_transform(mapkey):
-            logger.info(f"Skipping {object_key} as it does not match FIELD_MAP keys.")
-            return {"statusCode": 200, "body": json.dumps(f"Skipped file {object_key}")}
+        manifest = InvocationManifest.from_s3_event(event)
+        logger.info(f"Manifest: {manifest.to_json()}")
 
-        jsonl_output_path = (
-            f'/tmp/transformed/{"/".join(object_key.split("/")[2:-1])}.jsonl'
-        )
-        os.makedirs(os.path.dirname(jsonl_output_path), exist_ok=True)
+        # Reprocess everything regardless of watermarks and stored hashes, which
+        # are rewritten from this run
+        full_refresh = event.get("full_refresh", FULL_REFRESH)
 
-        airbyte2jsonl_transformer.transform_airbyte2jsonl_format(
-            download_path, jsonl_output_path, mapkey
-        )
-
-        logger.info(f"File transformed and saved to: {jsonl_output_path}")
-
-        graph_output_directory = "/tmp/graph_output"
-        os.makedirs(graph_output_directory, exist_ok=True)
-
-        def get_generator(object_key):
-            for key in GRAPH_GENERATOR_MAP.keys():
-                if key in object_key:
-                    logger.info(
-                        f"Selected {key} graph generator for object_key: {object_key}"
-                    )
-                    return GRAPH_GENERATOR_MAP[key]()
-            logger.info(f"No graph generator matched for object_key: {object_key}")
+        def get_generator(source):
+            if source in GRAPH_GENERATOR_MAP:
+                logger.info(f"Selected {source} graph generator")
+                return GRAPH_GENERATOR_MAP[source]()
+            logger.info(f"No graph generator matched for source: {source}")
             return None
 
-        graph_generator = get_generator(object_key)
-        if graph_generator:
-            logger.info(f"Starting graph generation for {object_key}")
-            graph_generator.generate_graph_schema_format_data_files(
-                os.path.dirname(jsonl_output_path), graph_output_directory
-            )
-            logger.info(f"Graph generation completed for {object_key}")
-        else:
-            logger.info(f"No graph generator found for {object_key}")
-
-        uploader.upload_files_to_neo4j(graph_output_directory)
+        processed = 0
+        for entry in manifest.entries:
+            logger.info(f"Bucket: {entry.bucket}, Object: {entry.key}")
+            logger.info(f"Mapkey: {entry.mapkey}")
+
+            if not airbyte2jsonl_transformer.can_transform(entry.mapkey):
+                logger.info(
+                    f"Skipping {entry.key} as it does not match FIELD_MAP keys."
+                )
+                continue
+
+            graph_generator = get_generator(entry.source)
+            if not graph_generator or entry.data_type not in graph_generator.PROCESSORS:
+                logger.info(f"No graph generator found for {entry.key}")
+                continue
+
+            logger.info(f"Starting graph generation and upload for {entry.key}")
+            identity = None
+            if uploader.checkpoint_store:
+                identity = s3_object_identity(s3, entry.bucket, entry.key)
+            # Stream the object from S3 through transform and graph generation to Neo4j
+            with open_airbyte_object(s3, entry.bucket, entry.key) as csv_file:
+                pipeline.run(
+                    csv_file,
+                    entry.mapkey,
+                    graph_generator,
+                    workers=TRANSFORM_WORKERS,
+                    full_refresh=full_refresh,
+                    identity=identity,
+                )
+            logger.info(f"Graph generation and upload completed for {entry.key}")
+            processed += 1
+
+        if not processed:
+            return {
+                "statusCode": 200,
+                "body": json.dumps(f"Skipped files {manifest.to_json()}"),
+            }
 
         return {
             "statusCode": 200,
@@ -113,3 +222,26 @@ def lambda_handler(event, context):
             "statusCode": 500,
             "body": json.dumps(f"Error processing file: {str(e)}"),
         }
+
+
+def embedding_queue_handler(event, context):
+    """
+    Consumes SQSEmbeddingQueue messages, reporting the failed ones back to SQS
+    (ReportBatchItemFailures) so only those are retried.
+    """
+    worker = EmbeddingWorker(neo4j_manager)
+    message_ids = {}
+    items = []
+    for record in event.get("Records", []):
+        item = json.loads(record["body"])
+        message_ids[(item["label"], item["id"])] = record["messageId"]
+        items.append((item["label"], item["id"], item.get("properties")))
+    failures = [
+        {"itemIdentifier": message_ids[(label, id)]}
+        for label, id, properties in worker.process(items)
+    ]
+    logger.info(
+        f"Processed {len(event.get('Records', []))} embedding messages, "
+        f"{len(failures)} failed"
+    )
+    return {"batchItemFailures": failures}
@@ -0,0 +1,160 @@
+"""
+Idempotent Neo4j schema bootstrap: a uniqueness constraint on the identity key of
+every node label the graph generators emit, and indexes on their join properties.
+A constraint can't be created while its label has duplicate nodes, e.g. from
+uploads before it existed; --merge-duplicates merges them first (needs APOC).
+
+    $ python -m etl.neo4j.schema --dry-run
+    $ NEO4J_URI=... NEO4J_USER=... NEO4J_PASSWORD=... python -m etl.neo4j.schema
+    $ NEO4J_URI=... python -m etl.neo4j.schema --merge-duplicates
+"""
+
+import argparse
+import logging
+import os
+
+from knowledge_graph.driver import get_driver
+from neo4j.exceptions import ClientError
+
+from etl.neo4j.upload import DEFAULT_IDENTITY_KEY
+from etl.transforms import (
+    ConfluenceGraphGenerator,
+    JiraGraphGenerator,
+    SlackGraphGenerator,
+)
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+GRAPH_GENERATORS = (JiraGraphGenerator, SlackGraphGenerator, ConfluenceGraphGenerator)
+
+# Groups of duplicate nodes merged per transaction
+DUPLICATE_MERGE_BATCH_SIZE = 1000
+
+
+class Neo4jSchemaManager:
+    def __init__(self, driver, identity_keys=None, generators=GRAPH_GENERATORS):
+        self.driver = driver
+        # Same per label overrides as Neo4jUploader.identity_keys
+        self.identity_keys = identity_keys or {}
+        self.generators = generators
+
+    def labels(self):
+        """
+        Returns {label: [indexed properties]} for the node labels of the generators.
+        """
+        labels = {}
+        for generator in self.generators:
+            for label in generator.NODE_LABELS.values():
+                labels.setdefault(label, [])
+            for label, properties in generator.INDEXED_PROPERTIES.items():
+                labels.setdefault(label, []).extend(
+                    p for p in properties if p not in labels[label]
+                )
+        return labels
+
+    def statements(self):
+        statements = []
+        for label, properties in sorted(self.labels().items()):
+            key = self.identity_keys.get(label, DEFAULT_IDENTITY_KEY)
+            statements.append(
+                f"CREATE CONSTRAINT {label}_{key}_unique IF NOT EXISTS "
+                f"FOR (n:{label}) REQUIRE n.{key} IS UNIQUE"
+            )
+            for prop in properties:
+                statements.append(
+                    f"CREATE INDEX {label}_{prop}_index IF NOT EXISTS "
+                    f"FOR (n:{label}) ON (n.{prop})"
+                )
+        return statements
+
+    def bootstrap(self):
+        """
+        Creates the missing constraints and indexes, returns the number of
+        statements that failed. A failing statement (e.g. a constraint over
+        existing duplicate nodes) is logged and doesn't stop the others.
+        """
+        failed = 0
+        with self.driver.session() as session:
+            for statement in self.statements():
+                try:
+                    session.run(statement).consume()
+                except ClientError as e:
+                    failed += 1
+                    logger.error(f"Schema statement failed: {statement}, error: {e}")
+        logger.info(f"Schema bootstrap completed, {failed} statements failed")
+        return failed
+
+    @staticmethod
+    def _merge_duplicate_batch(tx, label, key, batch_size):
+        # Relationships move onto the merged node, later nodes' properties win
+        result = tx.run(
+            f"MATCH (n:{label}) WHERE n.{key} IS NOT NULL "
+            f"WITH n.{key} AS key, collect(n) AS nodes "
+            "WHERE size(nodes) > 1 "
+            "WITH nodes LIMIT $batch_size "
+            "CALL apoc.refactor.mergeNodes("
+            "nodes, {properties: 'overwrite', mergeRels: true}) YIELD node "
+            "RETURN count(node) AS merged",
+            batch_size=batch_size,
+        )
+        return result.single()["merged"]
+
+    def merge_duplicates(self, batch_size=DUPLICATE_MERGE_BATCH_SIZE):
+        """
+        Merges the nodes of each label that share an identity key into one, with
+        apoc.refactor.mergeNodes, so the uniqueness constraints can be created.
+        Returns {label: number of identity keys whose nodes were merged}.
+        """
+        merged = {}
+        with self.driver.session() as session:
+            for label in sorted(self.labels()):
+                key = self.identity_keys.get(label, DEFAULT_IDENTITY_KEY)
+                total = 0
+                while True:
+                    count = session.execute_write(
+                        self._merge_duplicate_batch, label, key, batch_size
+                    )
+                    total += count
+                    if count < batch_size:
+                        break
+                if total:
+                    merged[label] = total
+                    logger.info(f"Merged duplicate {label} nodes of {total} keys")
+        return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--uri", default=os.getenv("NEO4J_URI"))
+    parser.add_argument("--user", default=os.getenv("NEO4J_USER"))
+    parser.add_argument("--password", default=os.getenv("NEO4J_PASSWORD"))
+    parser.add_argument(
+        "--dry-run", action="store_true", help="print the statements only"
+    )
+    parser.add_argument(
+        "--merge-duplicates",
+        action="store_true",
+        help="merge nodes sharing an identity key before the bootstrap",
+    )
+    args = parser.parse_args()
+
+    if args.dry_run:
+        for statement in Neo4jSchemaManager(None).statements():
+            print(statement)
+        return
+
+    driver = get_driver(args.uri, args.user, args.password)
+    try:
+        manager = Neo4jSchemaManager(driver)
+        if args.merge_duplicates:
+            manager.merge_duplicates()
+        failed = manager.bootstrap()
+    finally:
+        driver.close()
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
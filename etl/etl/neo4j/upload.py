@@ -1,105 +1,570 @@
 import os
-import json
+import time
+import random
 import logging
-from neo4j import GraphDatabase
+from concurrent.futures import ThreadPoolExecutor, wait
+from neo4j.exceptions import (
+    ClientError,
+    ServiceUnavailable,
+    SessionExpired,
+    TransientError,
+)
+from knowledge_graph.driver import get_driver
+
+from etl import jsoncodec
+from etl.metrics import log_sampled, metrics
+from etl.embedding_queue import EmbeddingWorker, InMemoryEmbeddingQueue
+from etl.neo4j.checkpoint import (
+    PROGRESS_RECORD_TYPE,
+    UPLOAD_CHECKPOINT_INTERVAL,
+    file_identity,
+    progress_record,
+)
 
 # Initialize the logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Attempts per batch on transient errors in batched mode
+UPLOAD_MAX_RETRIES = 3
+UPLOAD_RETRY_BACKOFF_SECONDS = 0.5
+
+RETRYABLE_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
+
+# Concurrent partitions can still deadlock on shared end nodes, retried longer
+PARALLEL_UPLOAD_MAX_RETRIES = 6
+
+# SHOW CONSTRAINTS types that make a node property unique, across Neo4j versions
+UNIQUE_CONSTRAINT_TYPES = ("UNIQUENESS", "NODE_PROPERTY_UNIQUENESS", "NODE_KEY")
+
+DEFAULT_IDENTITY_KEY = "id"
+
+# Node keys remembered as merged in a run, relationships between remembered
+# nodes MATCH their endpoints instead of MERGEing them
+MERGED_NODE_KEYS_LIMIT = int(os.getenv("ETL_MERGED_NODE_KEYS_LIMIT", "1000000"))
+
 
 class Neo4jUploader:
-    def __init__(self, uri, user, password, neo4j_manager):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(
+        self,
+        uri,
+        user,
+        password,
+        neo4j_manager,
+        driver=None,
+        batch_size=None,
+        identity_keys=None,
+        embedding_queue=None,
+        workers=None,
+        checkpoint_store=None,
+    ):
+        # driver can be passed in to use a fake in benchmarks
+        self.driver = driver or get_driver(uri, user, password)
         self.neo4j_manager = neo4j_manager
+        # With batch_size records are sent in UNWIND batches instead of one by one
+        self.batch_size = batch_size
+        # Property nodes are merged on per label, DEFAULT_IDENTITY_KEY otherwise
+        self.identity_keys = identity_keys or {}
+        # Upserted nodes are queued for embedding, see drain_embeddings
+        self.embedding_queue = embedding_queue or InMemoryEmbeddingQueue()
+        self.embedding_worker = EmbeddingWorker(neo4j_manager)
+        # With workers > 1 batches are written by partitioned parallel sessions
+        self.workers = workers or 1
+        # Progress per input is checkpointed here so retries resume, see upload_records
+        self.checkpoint_store = checkpoint_store
+        self._queries = {}
+        # (label, key) of the nodes merged since start_run
+        self._merged_nodes = set()
+        # Labels with a uniqueness constraint on their identity key, read once a run
+        self._constrained_labels = None
+        self._unconstrained_warned = set()
+
+    def identity_key(self, label):
+        return self.identity_keys.get(label, DEFAULT_IDENTITY_KEY)
 
     def merge_node(self, tx, label, properties):
-        key_value_string = ", ".join(
-            [f"{key}: ${key}" for key in properties.keys() if properties[key]]
-        )
-        query = f"MERGE (n:{label} {{{key_value_string}}})"
-        tx.run(query, **properties)
-        print(f"Uploaded node: {label} with properties: {properties}")
-        # Update embeddings for the newly created/updated node
-        try:
-            self.neo4j_manager.update_embeddings_for_neo4j(label, properties["id"])
-        except Exception as e:
-            logger.error(
-                f"Error updating embedding for node: {label} with id: {properties['id']}, error: {str(e)}"
-            )
+        key = self.identity_key(label)
+        query = f"MERGE (n:{label} {{{key}: $key}}) SET n += $properties"
+        tx.run(query, key=properties[key], properties=properties)
+        log_sampled("Uploaded node: %s with properties: %s", label, properties)
 
     def merge_relationship(
         self, tx, label1, properties1, relationship, label2, properties2
     ):
-        key_value_string1 = ", ".join(
-            [
-                f"{key}: ${key}1"
-                for key in properties1.keys()
-                if properties1[key] and key not in ["label"]
-            ]
-        )
-        key_value_string2 = ", ".join(
-            [
-                f"{key}: ${key}2"
-                for key in properties2.keys()
-                if properties2[key] and key not in ["label"]
-            ]
-        )
+        key1 = self.identity_key(label1)
+        key2 = self.identity_key(label2)
         query = (
-            f"MERGE (a:{label1} {{{key_value_string1}}}) "
-            f"MERGE (b:{label2} {{{key_value_string2}}}) "
+            f"MERGE (a:{label1} {{{key1}: $key1}}) "
+            f"MERGE (b:{label2} {{{key2}: $key2}}) "
             f"MERGE (a)-[r:{relationship}]->(b)"
         )
-        params = {
-            **{f"{key}1": value for key, value in properties1.items()},
-            **{f"{key}2": value for key, value in properties2.items()},
-        }
-        tx.run(query, **params)
-        print(f"Uploaded relationship: {relationship} between {label1} and {label2}")
+        tx.run(query, key1=properties1[key1], key2=properties2[key2])
+        log_sampled(
+            "Uploaded relationship: %s between %s and %s", relationship, label1, label2
+        )
 
-    def upload_file_to_neo4j(self, filepath):
+    def _read_lines(self, filepath, skip=0, progress=False):
+        # With progress each line is followed by its progress record
+        size = 0
+        with open(filepath, "rb") as file:
+            for number, line in enumerate(file, 1):
+                if number <= skip:
+                    continue
+                size += len(line)
+                yield jsoncodec.loads(line)
+                if progress:
+                    yield progress_record(number)
+        metrics.incr("read", "bytes", size)
+
+    def upload_record(self, session, obj):
+        key, row = self._group_record(obj)
+        if key is None:
+            return
+        if key[0] == "node":
+            label = key[1]
+            with metrics.timer("upload", label):
+                session.execute_write(self.merge_node, label, obj["properties"])
+            self._queue_embeddings(label, [row])
+        else:
+            _, label1, relationship, label2 = key
+            with metrics.timer("upload", relationship):
+                session.execute_write(
+                    self.merge_relationship,
+                    label1,
+                    obj["start_node"],
+                    relationship,
+                    label2,
+                    obj["end_node"],
+                )
+        metrics.incr("upload", "records", label=self._metric_label(key))
+
+    def get_checkpoint(self, identity):
+        """
+        Returns the checkpoint of an interrupted upload of identity, or None.
+        """
+        if not (identity and self.checkpoint_store):
+            return None
+        checkpoint = self.checkpoint_store.get(identity)
+        if checkpoint and "rows" not in checkpoint:
+            # Counted records after the state filters, which can't be resumed
+            logger.warning(f"Ignoring checkpoint of {identity} without input rows")
+            return None
+        return checkpoint
+
+    def upload_records(
+        self, records, batch_size=None, workers=None, identity=None, checkpoint=None
+    ):
+        """
+        Uploads an iterable of graph records (as generated by the graph generators),
+        in UNWIND batches of batch_size (defaults to self.batch_size) when set.
+        With workers > 1 (defaults to self.workers) batches are written in parallel
+        once their labels have uniqueness constraints, see _flush_groups_parallel.
+        With identity (e.g. file_identity) and a
+        checkpoint_store, the "rows" of the last progress record (see
+        progress_record) before each committed batch are checkpointed. A retry of
+        an interrupted upload passes the checkpoint from get_checkpoint and the
+        records of the input rows after checkpoint["rows"].
+        Returns the number of records, including resumed ones.
+        """
+        on_commit = None
+        rows = 0
+        resumed = 0
+        if checkpoint:
+            rows = checkpoint["rows"]
+            resumed = checkpoint["records"]
+            # Embeddings queued in process before the interruption were lost
+            self.embedding_queue.put_many(
+                (label, id, None) for label, id in checkpoint.get("embeddings", [])
+            )
+            logger.info(f"Resuming upload of {identity} after {rows} input rows")
+
+        def without_progress(records):
+            nonlocal rows
+            for obj in records:
+                if obj.get("type") == PROGRESS_RECORD_TYPE:
+                    rows = obj["rows"]
+                else:
+                    yield obj
+
+        if identity and self.checkpoint_store:
+
+            def on_commit(count):
+                # rows is read lazily, so it's at most the last record's input row
+                self._checkpoint(identity, rows, resumed + count)
+
+        count = self._upload_records(
+            without_progress(records), batch_size, workers, on_commit
+        )
+        if on_commit:
+            self.checkpoint_store.delete(identity)
+        return resumed + count
+
+    def _upload_records(self, records, batch_size, workers, on_commit):
+        batch_size = batch_size or self.batch_size
+        workers = workers or self.workers
+        if batch_size and workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return self._upload_records_batched(
+                    records, batch_size, workers, executor, on_commit
+                )
+        if batch_size:
+            return self._upload_records_batched(
+                records, batch_size, on_commit=on_commit
+            )
+
+        count = 0
         with self.driver.session() as session:
-            with open(filepath, "r") as file:
-                for line in file:
-                    obj = json.loads(line.strip())
-                    if obj["type"] == "node":
-                        label = obj.get("label")
-                        properties = obj.get("properties", {})
-                        if label and properties:
-                            session.execute_write(self.merge_node, label, properties)
-                            print(
-                                f"Uploaded node: {label} with properties: {properties}"
-                            )
-                    elif obj["type"] == "relationship":
-                        start_node = obj.get("start_node", {})
-                        end_node = obj.get("end_node", {})
-                        relationship = obj.get("relationship")
-                        label1 = start_node.get("label")
-                        properties1 = start_node
-                        label2 = end_node.get("label")
-                        properties2 = end_node
-                        if (
-                            label1
-                            and properties1
-                            and label2
-                            and properties2
-                            and relationship
-                        ):
-                            session.execute_write(
-                                self.merge_relationship,
-                                label1,
-                                properties1,
-                                relationship,
-                                label2,
-                                properties2,
-                            )
-                            print(
-                                f"Uploaded relationship: {relationship} between {label1} and {label2}"
+            for obj in records:
+                self.upload_record(session, obj)
+                count += 1
+                self._drain_full_batches()
+                if on_commit and count % UPLOAD_CHECKPOINT_INTERVAL == 0:
+                    on_commit(count)
+        return count
+
+    def _checkpoint(self, identity, rows, records):
+        checkpoint = {"rows": rows, "records": records}
+        # Drained in full batches after every flush, so only a partial batch
+        if self.embedding_queue.in_process:
+            checkpoint["embeddings"] = list(self.embedding_queue.items)
+        self.checkpoint_store.put(identity, checkpoint)
+
+    def _node_batch_query(self, label):
+        cache_key = ("node", label)
+        if cache_key not in self._queries:
+            key = self.identity_key(label)
+            self._queries[cache_key] = (
+                "UNWIND $rows AS row "
+                f"MERGE (n:{label} {{{key}: row.key}}) SET n += row.properties"
+            )
+        return self._queries[cache_key]
+
+    def _relationship_batch_query(self, label1, relationship, label2):
+        cache_key = ("relationship", label1, relationship, label2)
+        if cache_key not in self._queries:
+            key1 = self.identity_key(label1)
+            key2 = self.identity_key(label2)
+            self._queries[cache_key] = (
+                "UNWIND $rows AS row "
+                f"MERGE (a:{label1} {{{key1}: row.a}}) "
+                f"MERGE (b:{label2} {{{key2}: row.b}}) "
+                f"MERGE (a)-[r:{relationship}]->(b)"
+            )
+        return self._queries[cache_key]
+
+    def _relationship_match_query(self, label1, relationship, label2):
+        # Both endpoints were merged in this run, MATCH creates no nodes
+        cache_key = ("match", label1, relationship, label2)
+        if cache_key not in self._queries:
+            key1 = self.identity_key(label1)
+            key2 = self.identity_key(label2)
+            self._queries[cache_key] = (
+                "UNWIND $rows AS row "
+                f"MATCH (a:{label1} {{{key1}: row.a}}) "
+                f"MATCH (b:{label2} {{{key2}: row.b}}) "
+                f"MERGE (a)-[r:{relationship}]->(b)"
+            )
+        return self._queries[cache_key]
+
+    def _group_record(self, obj):
+        """
+        Returns (group key, row) for a graph record, records of a group share one
+        parameterized UNWIND query. Nodes are merged on their identity key and their
+        properties SET, relationships are merged on the endpoints' identity keys.
+        Records missing an identity value are skipped, returning (None, None).
+        """
+        if obj["type"] == "node":
+            label = obj.get("label")
+            properties = obj.get("properties", {})
+            if not (label and properties):
+                return None, None
+            key = properties.get(self.identity_key(label))
+            if key is None:
+                logger.warning(f"Skipping {label} node without identity: {properties}")
+                return None, None
+            return ("node", label), {"key": key, "properties": properties}
+        if obj["type"] == "relationship":
+            start_node = obj.get("start_node", {})
+            end_node = obj.get("end_node", {})
+            relationship = obj.get("relationship")
+            label1 = start_node.get("label")
+            label2 = end_node.get("label")
+            if not (label1 and label2 and relationship):
+                return None, None
+            key1 = start_node.get(self.identity_key(label1))
+            key2 = end_node.get(self.identity_key(label2))
+            if key1 is None or key2 is None:
+                return None, None
+            return ("relationship", label1, relationship, label2), {
+                "a": key1,
+                "b": key2,
+            }
+        return None, None
+
+    def _upload_records_batched(
+        self, records, batch_size, workers=1, executor=None, on_commit=None
+    ):
+        count = 0
+        buffered = 0
+        groups = {}
+        # A parallel flush writes about one batch per worker
+        window = batch_size * workers
+        with self.driver.session() as session:
+            for obj in records:
+                count += 1
+                key, row = self._group_record(obj)
+                if key is None:
+                    continue
+                if key[0] == "node":
+                    # Copies of a node in a batch are merged as SET n += would
+                    # apply them, the last copy wins
+                    rows = groups.setdefault(key, {})
+                    previous = rows.get(row["key"])
+                    if previous is not None:
+                        row["properties"] = {
+                            **previous["properties"],
+                            **row["properties"],
+                        }
+                        metrics.incr("upload", "merged_copies", label=key[1])
+                    else:
+                        buffered += 1
+                    rows[row["key"]] = row
+                else:
+                    groups.setdefault(key, []).append(row)
+                    buffered += 1
+                if buffered >= window:
+                    self._flush(session, groups, batch_size, workers, executor)
+                    groups = {}
+                    buffered = 0
+                    self._drain_full_batches()
+                    if on_commit:
+                        on_commit(count)
+            self._flush(session, groups, batch_size, workers, executor)
+        return count
+
+    def _metric_label(self, key):
+        # Node label, or relationship type
+        return key[1] if key[0] == "node" else key[2]
+
+    def _record_batch(self, key, rows):
+        label = self._metric_label(key)
+        metrics.incr("upload", "records", len(rows), label)
+        metrics.incr("upload", "batches", label=label)
+
+    def _flush(self, session, groups, batch_size, workers, executor):
+        groups = {
+            key: list(rows.values()) if key[0] == "node" else rows
+            for key, rows in groups.items()
+        }
+        if executor is None or not self._parallel_safe(groups):
+            self._flush_groups(session, groups, batch_size)
+        else:
+            self._flush_groups_parallel(groups, workers, executor)
+
+    def start_run(self):
+        """
+        Starts a new run, e.g. per invocation: relationships only MATCH endpoints
+        merged after this, and constraints are read again before parallel writes.
+        """
+        self._merged_nodes = set()
+        self._constrained_labels = None
+
+    def constrained_labels(self):
+        """
+        Returns the labels with a uniqueness constraint on their identity key, from
+        SHOW CONSTRAINTS. Empty when they can't be listed.
+        """
+        if self._constrained_labels is None:
+            constrained = set()
+            try:
+                with self.driver.session() as session:
+                    for record in session.run("SHOW CONSTRAINTS"):
+                        if record["type"] not in UNIQUE_CONSTRAINT_TYPES:
+                            continue
+                        for label in record["labelsOrTypes"] or []:
+                            if record["properties"] == [self.identity_key(label)]:
+                                constrained.add(label)
+            except ClientError as e:
+                logger.warning(f"Could not list constraints: {e}")
+            self._constrained_labels = constrained
+        return self._constrained_labels
+
+    def _parallel_safe(self, groups):
+        # Concurrent MERGEs of the same key only serialize on a uniqueness
+        # constraint, without one each partition can create its own copy
+        labels = set()
+        for key in groups:
+            labels.update((key[1],) if key[0] == "node" else (key[1], key[3]))
+        missing = labels - self.constrained_labels()
+        if missing - self._unconstrained_warned:
+            logger.warning(
+                f"No uniqueness constraint on {sorted(missing)}, writing their "
+                f"batches serially, see etl.neo4j.schema"
+            )
+            self._unconstrained_warned.update(missing)
+        return not missing
+
+    def _remember_merged(self, label, rows):
+        if len(self._merged_nodes) < MERGED_NODE_KEYS_LIMIT:
+            self._merged_nodes.update((label, row["key"]) for row in rows)
+
+    def _relationship_writes(self, key, rows):
+        """
+        Returns [(query, rows)] of a relationship group, rows between nodes merged
+        in this run MATCH their endpoints, the others MERGE them.
+        """
+        _, label1, relationship, label2 = key
+        merged_nodes = self._merged_nodes
+        matched, merged = [], []
+        for row in rows:
+            start, end = (label1, row["a"]), (label2, row["b"])
+            if start in merged_nodes and end in merged_nodes:
+                matched.append(row)
+            else:
+                merged.append(row)
+        writes = []
+        if matched:
+            query = self._relationship_match_query(label1, relationship, label2)
+            writes.append((query, matched))
+        if merged:
+            query = self._relationship_batch_query(label1, relationship, label2)
+            writes.append((query, merged))
+        return writes
+
+    def _flush_groups(self, session, groups, batch_size):
+        # Nodes first, so relationships find the nodes of the same batch. Groups
+        # of a parallel window (batch_size * workers) written serially are split
+        # back into batches of batch_size
+        for key in sorted(groups, key=lambda key: key[0] != "node"):
+            rows = groups[key]
+            for i in range(0, len(rows), batch_size):
+                batch = rows[i : i + batch_size]
+                if key[0] == "node":
+                    label = key[1]
+                    query = self._node_batch_query(label)
+                    self._write_batch(session, query, batch, label)
+                    self._remember_merged(label, batch)
+                    self._queue_embeddings(label, batch)
+                else:
+                    for query, partition in self._relationship_writes(key, batch):
+                        self._write_batch(session, query, partition, key[2])
+                self._record_batch(key, batch)
+
+    def _flush_groups_parallel(self, groups, workers, executor):
+        """
+        Writes all node groups, then all relationship groups, each group split in
+        workers partitions by a hash of the node key (relationships: start node key)
+        so concurrent transactions rarely lock the same nodes. Every partition is
+        written on its own session from the driver pool. Only used when every
+        label written has a uniqueness constraint (constrained_labels), which
+        makes concurrent MERGEs of a shared end node create it once.
+        """
+        for phase in ("node", "relationship"):
+            futures = {}
+            for key, rows in groups.items():
+                if key[0] != phase:
+                    continue
+                if phase == "node":
+                    writes = [(self._node_batch_query(key[1]), rows)]
+                    field = "key"
+                else:
+                    writes = self._relationship_writes(key, rows)
+                    field = "a"
+                for query, write_rows in writes:
+                    partitions = [[] for _ in range(workers)]
+                    for row in write_rows:
+                        partitions[hash(row[field]) % workers].append(row)
+                    for partition in partitions:
+                        if partition:
+                            future = executor.submit(
+                                self._write_partition,
+                                query,
+                                partition,
+                                self._metric_label(key),
                             )
+                            futures[future] = key
+            done, _ = wait(futures)
+            for future in done:
+                # Raises the error of a partition that ran out of retries
+                future.result()
+            for key, rows in groups.items():
+                if key[0] != phase:
+                    continue
+                if phase == "node":
+                    self._remember_merged(key[1], rows)
+                    self._queue_embeddings(key[1], rows)
+                self._record_batch(key, rows)
+
+    def _write_partition(self, query, rows, label):
+        with self.driver.session() as session:
+            self._write_batch(session, query, rows, label, PARALLEL_UPLOAD_MAX_RETRIES)
+
+    @staticmethod
+    def _run_write(tx, query, rows):
+        tx.run(query, rows=rows)
+
+    def _write_batch(
+        self, session, query, rows, label=None, max_retries=UPLOAD_MAX_RETRIES
+    ):
+        for attempt in range(1, max_retries + 1):
+            try:
+                with metrics.timer("upload", label):
+                    session.execute_write(self._run_write, query, rows)
+                return
+            except RETRYABLE_ERRORS as e:
+                metrics.incr("upload", "retries", label=label)
+                if attempt == max_retries:
+                    raise
+                delay = UPLOAD_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Retrying batch of {len(rows)} in {delay:.1f}s "
+                    f"(attempt {attempt}): {e}"
+                )
+                time.sleep(delay * random.uniform(1, 1.5))
 
-    def upload_files_to_neo4j(self, jsonl_files_directory):
-        for root, dirs, files in os.walk(jsonl_files_directory):
-            for file in files:
-                filepath = os.path.join(root, file)
-                self.upload_file_to_neo4j(filepath)
-        self.driver.close()
+    def _queue_embeddings(self, label, rows):
+        # Called once the rows are committed, embeddings are computed later
+        self.embedding_queue.put_many(
+            (label, row["properties"]["id"], row["properties"])
+            for row in rows
+            if row["properties"].get("id") is not None
+        )
+
+    def drain_embeddings(self, minimum=1):
+        """
+        Updates the embeddings of the nodes queued by the uploads so far, when the
+        queue is in process, while it holds at least minimum nodes. Durable queues
+        are drained by their own consumer.
+        """
+        if self.embedding_queue.in_process:
+            return self.embedding_worker.drain(self.embedding_queue, minimum)
+        return 0
+
+    def _drain_full_batches(self):
+        # Keeps the in process queue, which holds node properties, to about one
+        # embedding batch while a large input uploads
+        self.drain_embeddings(self.embedding_worker.batch_size)
+
+    def upload_file_to_neo4j(self, filepath):
+        identity = file_identity(filepath) if self.checkpoint_store else None
+        checkpoint = self.get_checkpoint(identity)
+        lines = self._read_lines(
+            filepath, checkpoint["rows"] if checkpoint else 0, identity is not None
+        )
+        self.upload_records(lines, identity=identity, checkpoint=checkpoint)
+        self.drain_embeddings()
+        metrics.emit()
+
+    def upload_files_to_neo4j(self, jsonl_files_directory, filepaths=None):
+        """
+        Uploads every file under jsonl_files_directory, or only filepaths when given
+        (e.g. the files generated for the invocation manifest).
+        """
+        if filepaths is None:
+            filepaths = [
+                os.path.join(root, file)
+                for root, dirs, files in os.walk(jsonl_files_directory)
+                for file in files
+            ]
+        for filepath in filepaths:
+            self.upload_file_to_neo4j(filepath)
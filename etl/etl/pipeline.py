@@ -0,0 +1,306 @@
+import logging
+import os
+import queue
+import threading
+from collections import deque
+
+from etl import jsoncodec
+from etl.dedup import DEDUP_MEMORY_BUDGET, GraphRecordDeduplicator
+from etl.metrics import metrics
+from etl.neo4j.checkpoint import PROGRESS_RECORD_TYPE, progress_record
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Graph records handed from the producer thread to the uploader at a time
+PIPELINE_CHUNK_SIZE = 500
+
+# Chunks buffered ahead of the uploader before the producer blocks
+PIPELINE_QUEUE_SIZE = 4
+
+_END = object()
+
+
+def bounded_prefetch(
+    iterable, chunk_size=PIPELINE_CHUNK_SIZE, maxsize=PIPELINE_QUEUE_SIZE
+):
+    """
+    Returns generator over iterable, consumed on a background thread into a queue of
+    at most maxsize chunks. Reading and transforming overlaps with the consumer while
+    memory stays bounded; the producer blocks whenever the consumer falls behind.
+    """
+    chunks = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        chunk = []
+        try:
+            for item in iterable:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            if chunk and not put(chunk):
+                return
+            put(_END)
+        except BaseException as e:  # noqa: BLE001, raised by the consumer
+            put(e)
+        finally:
+            close = getattr(iterable, "close", None)
+            if close:
+                close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _END:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield from chunk
+    finally:
+        stop.set()
+        producer.join()
+
+
+def tee_to_jsonl(records, output_filepath):
+    """
+    Returns generator passing records through while writing each one to a JSONL file.
+    """
+    os.makedirs(os.path.dirname(output_filepath), exist_ok=True)
+    with open(output_filepath, "wb") as fh:
+        for record in records:
+            if record.get("type") != PROGRESS_RECORD_TYPE:
+                fh.write(jsoncodec.dumps_line(record))
+            yield record
+    logger.info(f"Generated {output_filepath}")
+
+
+class RowProgress:
+    """
+    Follows the airbyte rows of an input to the graph generator, so progress
+    records (etl.neo4j.checkpoint.progress_record) can be placed among the graph
+    records once all records of a row precede them. The transform tells it the
+    row number of every transformed row (track); the graph generator processes
+    rows one at a time, so when it takes the next row (generator_input) every
+    earlier row is complete. The state filters report the rows they drop (drop),
+    so a run of dropped rows completes without reaching the generator. Only the
+    numbers of rows still inside the filters are held, not the rows.
+    """
+
+    def __init__(self, start=0):
+        self.completed = start
+        # [number, dropped] of the tracked rows in order, and by id of the row
+        self._tracked = deque()
+        self._entries = {}
+        self._last = start
+
+    def track(self, number, row):
+        self._last = number
+        entry = [number, False]
+        self._tracked.append(entry)
+        self._entries[id(row)] = entry
+
+    def drop(self, row):
+        entry = self._entries.pop(id(row), None)
+        if entry is None:
+            return
+        entry[1] = True
+        while self._tracked and self._tracked[0][1]:
+            self.completed = self._tracked.popleft()[0]
+
+    def generator_input(self, rows):
+        for row in rows:
+            entry = self._entries.pop(id(row))
+            # Earlier rows were dropped, by a filter that may not have reported it
+            while True:
+                tracked = self._tracked.popleft()
+                if tracked is entry:
+                    break
+            self.completed = entry[0] - 1
+            yield row
+        self.completed = max(self.completed, self._last)
+        self._tracked.clear()
+        self._entries.clear()
+
+    def records(self, records):
+        reported = self.completed
+        for record in records:
+            if self.completed > reported:
+                reported = self.completed
+                yield progress_record(reported)
+            yield record
+        if self.completed > reported:
+            yield progress_record(self.completed)
+
+
+class StreamingPipeline:
+    """
+    Fused airbyte row -> graph record -> Neo4j pipeline. Rows flow from the airbyte
+    CSV through the transformer and graph generator straight into the uploader,
+    without intermediate files. debug_directory optionally keeps a copy of the graph
+    records as <data_type>_data.jsonl, the same files the file based mode writes.
+    Optional state filters (etl.state) skip work: watermark drops airbyte rows
+    synced before, version_guard drops stale replays and change_detector drops rows
+    unchanged since the last upload. Their state is committed after the upload,
+    then the embeddings of the upserted nodes are updated. With deduplicate, graph
+    records repeated within a run are dropped before the upload. A run with an
+    identity is checkpointed by airbyte rows, so a retry skips the rows already
+    uploaded before any state filter sees them.
+    """
+
+    def __init__(
+        self,
+        transformer,
+        uploader,
+        chunk_size=PIPELINE_CHUNK_SIZE,
+        queue_size=PIPELINE_QUEUE_SIZE,
+        debug_directory=None,
+        change_detector=None,
+        version_guard=None,
+        watermark=None,
+        deduplicate=False,
+        dedup_memory_budget=DEDUP_MEMORY_BUDGET,
+    ):
+        self.transformer = transformer
+        self.uploader = uploader
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.debug_directory = debug_directory
+        self.change_detector = change_detector
+        self.version_guard = version_guard
+        self.watermark = watermark
+        self.deduplicate = deduplicate
+        self.dedup_memory_budget = dedup_memory_budget
+
+    def _state_filters(self):
+        return [
+            state_filter
+            for state_filter in (
+                self.watermark,
+                self.version_guard,
+                self.change_detector,
+            )
+            if state_filter is not None
+        ]
+
+    def graph_records(
+        self,
+        csv_file,
+        mapkey,
+        graph_generator,
+        workers=None,
+        full_refresh=False,
+        deduplicator=None,
+        skip_rows=0,
+        progress=None,
+    ):
+        """
+        Returns generator of graph records for an airbyte CSV file object. With
+        full_refresh the watermark and change detection drop no rows, but still
+        stage their state. skip_rows
+        leaves out the first airbyte rows, progress (a RowProgress started at
+        skip_rows) adds progress records.
+        """
+        data_type = mapkey.split("/")[-1]
+        label = graph_generator.NODE_LABELS.get(data_type)
+
+        row_filter = None
+        if self.watermark:
+
+            def row_filter(rows):
+                return self.watermark.filter_rows(rows, mapkey, full_refresh)
+
+        rows = self.transformer.transform_airbyte_rows(
+            csv_file,
+            mapkey,
+            workers=workers,
+            row_filter=row_filter,
+            skip_rows=skip_rows,
+            progress=progress,
+        )
+        rows = metrics.counted(rows, "transform", "rows", mapkey)
+        on_drop = progress.drop if progress is not None else None
+        if self.version_guard:
+            rows = self.version_guard.filter_rows(rows, label, on_drop)
+        if self.change_detector:
+            rows = self.change_detector.filter_rows(rows, label, full_refresh, on_drop)
+        if progress is not None:
+            rows = progress.generator_input(rows)
+        records = graph_generator.generate_graph_records(data_type, rows)
+        if progress is not None:
+            records = progress.records(records)
+        if deduplicator:
+            records = deduplicator.filter(records)
+        if self.debug_directory:
+            records = tee_to_jsonl(
+                records, f"{self.debug_directory}/{data_type}_data.jsonl"
+            )
+        return records
+
+    def run(
+        self,
+        csv_file,
+        mapkey,
+        graph_generator,
+        workers=None,
+        full_refresh=False,
+        identity=None,
+    ):
+        """
+        Runs the pipeline for an airbyte CSV file object, returns uploaded record count.
+        identity of the airbyte file, which must pin its content (e.g. an S3 ETag),
+        lets the uploader checkpoint the uploaded rows and a retry skip them.
+        """
+        deduplicator = None
+        if self.deduplicate:
+            deduplicator = GraphRecordDeduplicator(
+                self.dedup_memory_budget, self.uploader.identity_keys
+            )
+        checkpoint = self.uploader.get_checkpoint(identity)
+        skip_rows = checkpoint["rows"] if checkpoint else 0
+        progress = None
+        if identity and self.uploader.checkpoint_store:
+            progress = RowProgress(skip_rows)
+        records = self.graph_records(
+            csv_file,
+            mapkey,
+            graph_generator,
+            workers,
+            full_refresh,
+            deduplicator,
+            skip_rows,
+            progress,
+        )
+        try:
+            count = self.uploader.upload_records(
+                bounded_prefetch(records, self.chunk_size, self.queue_size),
+                identity=identity,
+                checkpoint=checkpoint,
+            )
+        except BaseException:
+            for state_filter in self._state_filters():
+                state_filter.reset()
+            raise
+        # Only remember state once the rows are in Neo4j
+        for state_filter in self._state_filters():
+            state_filter.commit()
+        logger.info(f"Uploaded {count} graph records for {mapkey}")
+        if deduplicator:
+            deduplicator.report()
+        self.uploader.drain_embeddings()
+        metrics.emit()
+        return count
@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+_STOP = None
+
+
+def _pipe_worker(connection, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        task = connection.recv()
+        if task is _STOP:
+            break
+        index, func, args = task
+        try:
+            result = (index, True, func(*args))
+        except Exception as e:  # noqa: BLE001, raised by imap in the parent
+            result = (index, False, e)
+        connection.send(result)
+    connection.close()
+
+
+class PipeProcessPool:
+    """
+    Pool of multiprocessing.Process workers, each connected by its own Pipe. Unlike
+    ProcessPoolExecutor and multiprocessing.Pool it needs no semaphores, which AWS
+    Lambda can't create (no /dev/shm). Each worker runs initializer(*initargs)
+    once, then the tasks sent to it by imap.
+    """
+
+    def __init__(self, workers, initializer=None, initargs=()):
+        self.workers = []
+        try:
+            for _ in range(workers):
+                parent, child = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_pipe_worker,
+                    args=(child, initializer, initargs),
+                    daemon=True,
+                )
+                process.start()
+                child.close()
+                self.workers.append((process, parent))
+        except BaseException:
+            self.terminate()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def imap(self, func, iterable, ordered=True, max_pending=None):
+        """
+        Returns generator of func(*args) for each args tuple of iterable, computed
+        by the workers. Results come in input order, or as they complete with
+        ordered=False. At most max_pending (default two per worker) results are
+        running or buffered for ordering, and iterable is consumed only as they
+        are yielded, so memory stays bounded. An exception raised by func is
+        raised here.
+        """
+        max_pending = max_pending or 2 * len(self.workers)
+        tasks = iter(iterable)
+        idle = deque(connection for process, connection in self.workers)
+        busy = set()
+        buffered = {}
+        submitted = 0
+        next_index = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and idle and submitted - next_index < max_pending:
+                    try:
+                        args = next(tasks)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    # One task per worker, so a worker is always receiving while
+                    # its task is sent and never blocks the parent on a result
+                    connection = idle.popleft()
+                    connection.send((submitted, func, args))
+                    busy.add(connection)
+                    submitted += 1
+                if not busy:
+                    return
+                for connection in wait(list(busy)):
+                    index, success, result = connection.recv()
+                    busy.remove(connection)
+                    idle.append(connection)
+                    if not success:
+                        raise result
+                    if ordered:
+                        buffered[index] = result
+                    else:
+                        next_index += 1
+                        yield result
+                while next_index in buffered:
+                    yield buffered.pop(next_index)
+                    next_index += 1
+        finally:
+            if busy:
+                # Abandoned or failed with tasks in flight, their results would
+                # block the workers' pipes
+                self.terminate()
+
+    def close(self):
+        for process, connection in self.workers:
+            try:
+                connection.send(_STOP)
+            except OSError:
+                pass
+        for process, connection in self.workers:
+            process.join()
+            connection.close()
+        self.workers = []
+
+    def terminate(self):
+        for process, connection in self.workers:
+            process.terminate()
+        for process, connection in self.workers:
+            process.join()
+            connection.close()
+        self.workers = []
+
+
+def create_process_pool(workers, initializer=None, initargs=()):
+    """
+    Returns a PipeProcessPool, or None where processes can't be started, so
+    callers can run serially.
+    """
+    try:
+        return PipeProcessPool(workers, initializer, initargs)
+    except (OSError, NotImplementedError) as e:
+        logger.warning(f"Process pool unavailable, running serially: {e}")
+        return None
@@ -0,0 +1,91 @@
+import gzip
+import io
+import logging
+import os
+
+from etl.metrics import metrics
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Bytes fetched from S3 per ranged GET request
+S3_READ_CHUNK_SIZE = 8 * 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Read-only file object over an S3 object body, fetched in ranged GET requests.
+    """
+
+    def __init__(self, client, bucket, key, chunk_size=S3_READ_CHUNK_SIZE):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.chunk_size = chunk_size
+        head = client.head_object(Bucket=bucket, Key=key)
+        self.size = head["ContentLength"]
+        self.etag = head.get("ETag")
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        end = min(self.position + min(len(buffer), self.chunk_size), self.size) - 1
+        params = {
+            "Bucket": self.bucket,
+            "Key": self.key,
+            "Range": f"bytes={self.position}-{end}",
+        }
+        if self.etag:
+            # Fail instead of mixing bytes of two versions if the object is replaced
+            params["IfMatch"] = self.etag
+        data = self.client.get_object(**params)["Body"].read()
+        buffer[: len(data)] = data
+        metrics.incr("s3", "bytes", len(data))
+        metrics.incr("s3", "requests")
+        self.position += len(data)
+        return len(data)
+
+
+def open_airbyte_object(client, bucket, key, chunk_size=S3_READ_CHUNK_SIZE):
+    """
+    Opens an airbyte CSV object for streaming as a text file object, suitable for
+    csv readers. Gzip compressed objects are decompressed transparently.
+    """
+    stream = io.BufferedReader(
+        S3ObjectReader(client, bucket, key, chunk_size), buffer_size=chunk_size
+    )
+    if stream.peek(len(GZIP_MAGIC))[: len(GZIP_MAGIC)] == GZIP_MAGIC:
+        logger.info(f"Decompressing gzip object: {key}")
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    return io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+
+class LocalS3Client:
+    """
+    Stand-in for the boto3 S3 client methods used by S3ObjectReader, serving
+    objects from <root_directory>/<bucket>/<key>. Useful for local runs and tests.
+    """
+
+    def __init__(self, root_directory):
+        self.root_directory = root_directory
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root_directory, bucket, key)
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": os.path.getsize(self._path(Bucket, Key))}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        with open(self._path(Bucket, Key), "rb") as fh:
+            if Range is None:
+                return {"Body": io.BytesIO(fh.read())}
+            start, end = Range[len("bytes=") :].split("-")
+            fh.seek(int(start))
+            return {"Body": io.BytesIO(fh.read(int(end) - int(start) + 1))}
@@ -0,0 +1,418 @@
+import hashlib
+import json
+import logging
+import sqlite3
+from datetime import datetime
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Rows looked up in the state store at a time
+CHANGE_DETECTION_BATCH_SIZE = 500
+
+# Rows emitted up to this long before the stream watermark are still processed, so
+# files of one airbyte sync handled out of order by concurrent invocations are kept
+WATERMARK_LOOKBACK_MS = 6 * 60 * 60 * 1000
+
+# Transformed field holding the source's last modified time, per node label
+VERSION_FIELDS = {"jira_issue": "updated"}
+
+
+def content_hash(properties):
+    """
+    Returns a stable hash of a transformed row, independent of key order.
+    """
+    canonical = json.dumps(
+        properties, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def parse_timestamp_ms(value):
+    """
+    Parses epoch milliseconds or an ISO 8601 timestamp (airbyte _airbyte_emitted_at,
+    Jira updated) to epoch milliseconds. Returns None when value can't be parsed.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    value = value.replace(" ", "T", 1)
+    if value.endswith("Z"):
+        value = f"{value[:-1]}+00:00"
+    sign = max(value.rfind("+"), value.rfind("-"))
+    if sign > value.find("T") > 0:
+        offset = value[sign + 1 :].replace(":", "")
+        if len(offset) in (2, 4):
+            # +00, +0000 -> +00:00 for fromisoformat on python 3.8
+            offset = offset.ljust(4, "0")
+            value = f"{value[: sign + 1]}{offset[:2]}:{offset[2:]}"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        # fromisoformat on python < 3.11 only takes 3 or 6 fraction digits
+        try:
+            parsed = datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        return None
+    return int(parsed.timestamp() * 1000)
+
+
+class StateStore:
+    """
+    Persistent ETL state. Holds, per (label, id), the content hash last uploaded
+    ("hash") and the source version last uploaded ("version"), and per airbyte
+    stream a watermark of _airbyte_emitted_at. Subclasses implement get_values,
+    put_values, get_watermark and put_watermark.
+    """
+
+    def get_values(self, kind, keys):
+        """
+        Returns {(label, id): value} for the keys that have a stored value of kind.
+        """
+        raise NotImplementedError
+
+    def put_values(self, kind, items):
+        """
+        Stores an iterable of (label, id, value) of kind.
+        """
+        raise NotImplementedError
+
+    def get_watermark(self, stream):
+        raise NotImplementedError
+
+    def put_watermark(self, stream, value):
+        """
+        Raises the watermark of stream to value, never lowers it.
+        """
+        raise NotImplementedError
+
+    def get_hashes(self, keys):
+        return self.get_values("hash", keys)
+
+    def put_hashes(self, items):
+        self.put_values("hash", items)
+
+
+class SQLiteStateStore(StateStore):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS record_state (
+                kind TEXT NOT NULL,
+                label TEXT NOT NULL,
+                id TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (kind, label, id)
+            );
+            CREATE TABLE IF NOT EXISTS watermarks (
+                stream TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            """
+        )
+        self.connection.commit()
+
+    def get_values(self, kind, keys):
+        values = {}
+        keys = list(keys)
+        # Stay below the default SQLite host parameter limit
+        for i in range(0, len(keys), 400):
+            batch = keys[i : i + 400]
+            rows = ", ".join(["(?, ?)"] * len(batch))
+            params = [kind] + [v for label, id in batch for v in (label, str(id))]
+            for label, id, value in self.connection.execute(
+                "SELECT label, id, value FROM record_state "
+                f"WHERE kind = ? AND (label, id) IN (VALUES {rows})",
+                params,
+            ):
+                values[(label, id)] = value
+        return {
+            (label, id): values[(label, str(id))]
+            for label, id in keys
+            if (label, str(id)) in values
+        }
+
+    def put_values(self, kind, items):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO record_state (kind, label, id, value) "
+                "VALUES (?, ?, ?, ?)",
+                [(kind, label, str(id), str(value)) for label, id, value in items],
+            )
+
+    def get_watermark(self, stream):
+        row = self.connection.execute(
+            "SELECT value FROM watermarks WHERE stream = ?", (stream,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put_watermark(self, stream, value):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO watermarks (stream, value) VALUES (?, ?) "
+                "ON CONFLICT (stream) DO UPDATE SET value = MAX(value, excluded.value)",
+                (stream, value),
+            )
+
+
+class DynamoDBStateStore(StateStore):
+    """
+    State store shared across Lambda containers, on a DynamoDB table with string
+    partition key "pk".
+    """
+
+    def __init__(self, table_name, dynamodb=None):
+        if dynamodb is None:
+            import boto3
+
+            dynamodb = boto3.resource("dynamodb")
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.table = dynamodb.Table(table_name)
+
+    def _pk(self, kind, label, id):
+        return f"{kind}#{label}#{id}"
+
+    def get_values(self, kind, keys):
+        keys = list(keys)
+        by_pk = {self._pk(kind, label, id): (label, id) for label, id in keys}
+        pks = list(by_pk)
+        values = {}
+        # BatchGetItem accepts at most 100 keys per request
+        for i in range(0, len(pks), 100):
+            request = {
+                self.table_name: {"Keys": [{"pk": pk} for pk in pks[i : i + 100]]}
+            }
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    values[by_pk[item["pk"]]] = item["value"]
+                request = response.get("UnprocessedKeys")
+        return values
+
+    def put_values(self, kind, items):
+        with self.table.batch_writer(overwrite_by_pkeys=["pk"]) as batch:
+            for label, id, value in items:
+                batch.put_item(
+                    Item={"pk": self._pk(kind, label, id), "value": str(value)}
+                )
+
+    def get_watermark(self, stream):
+        item = self.table.get_item(Key={"pk": f"watermark#{stream}"}).get("Item")
+        return int(item["value"]) if item else None
+
+    def put_watermark(self, stream, value):
+        try:
+            self.table.update_item(
+                Key={"pk": f"watermark#{stream}"},
+                UpdateExpression="SET #value = :value",
+                ConditionExpression="attribute_not_exists(#value) OR #value < :value",
+                ExpressionAttributeNames={"#value": "value"},
+                ExpressionAttributeValues={":value": value},
+            )
+        except self.dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+            pass  # Another invocation already stored a later watermark
+
+
+class ChangeDetector:
+    """
+    Drops transformed rows whose content hash matches the one stored for their
+    (label, id). New hashes are staged and only written to the store on commit,
+    after the rows have been uploaded.
+    """
+
+    def __init__(self, store, batch_size=CHANGE_DETECTION_BATCH_SIZE):
+        self.store = store
+        self.batch_size = batch_size
+        self.pending = {}
+        self.seen = 0
+        self.skipped = 0
+
+    def filter_rows(self, rows, label, full_refresh=False, on_drop=None):
+        """
+        Returns generator of the rows that changed. Rows are passed through when
+        label is None (data types without a node) or they have no id. With
+        full_refresh all rows are passed through, their hashes are still staged.
+        on_drop, e.g. etl.pipeline.RowProgress.drop, is called with each dropped row.
+        """
+        if label is None:
+            yield from rows
+            return
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield from self._filter_batch(batch, label, full_refresh, on_drop)
+                batch = []
+        if batch:
+            yield from self._filter_batch(batch, label, full_refresh, on_drop)
+
+    def _filter_batch(self, batch, label, full_refresh=False, on_drop=None):
+        stored = {}
+        if not full_refresh:
+            keys = [
+                (label, row.get("id")) for row in batch if row.get("id") is not None
+            ]
+            stored = self.store.get_hashes(keys)
+        for row in batch:
+            self.seen += 1
+            id = row.get("id")
+            if id is None:
+                yield row
+                continue
+            key = (label, id)
+            digest = content_hash(row)
+            if not full_refresh and self.pending.get(key, stored.get(key)) == digest:
+                self.skipped += 1
+                if on_drop:
+                    on_drop(row)
+                continue
+            self.pending[key] = digest
+            yield row
+
+    def commit(self):
+        """
+        Persists the hashes of the rows yielded since the last commit.
+        """
+        self.store.put_hashes(
+            (label, id, digest) for (label, id), digest in self.pending.items()
+        )
+        logger.info(
+            f"Change detection: {self.skipped} of {self.seen} rows unchanged, "
+            f"{len(self.pending)} hashes stored"
+        )
+        self.reset()
+
+    def reset(self):
+        self.pending = {}
+        self.seen = 0
+        self.skipped = 0
+
+
+class VersionGuard:
+    """
+    Drops transformed rows older than the version already uploaded for their
+    (label, id), e.g. a replayed jira issue whose updated is before the stored one,
+    so stale replays can't overwrite newer graph data. Labels without a field in
+    version_fields pass through. Versions are stored on commit.
+    """
+
+    def __init__(
+        self, store, version_fields=None, batch_size=CHANGE_DETECTION_BATCH_SIZE
+    ):
+        self.store = store
+        self.version_fields = (
+            VERSION_FIELDS if version_fields is None else version_fields
+        )
+        self.batch_size = batch_size
+        self.pending = {}
+        self.skipped = 0
+
+    def filter_rows(self, rows, label, on_drop=None):
+        """
+        Returns generator of the rows not older than their stored version, on_drop
+        is called with each dropped row.
+        """
+        field = self.version_fields.get(label)
+        if field is None:
+            yield from rows
+            return
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield from self._filter_batch(batch, label, field, on_drop)
+                batch = []
+        if batch:
+            yield from self._filter_batch(batch, label, field, on_drop)
+
+    def _filter_batch(self, batch, label, field, on_drop=None):
+        keys = [(label, row.get("id")) for row in batch if row.get("id") is not None]
+        stored = self.store.get_values("version", keys)
+        for row in batch:
+            version = parse_timestamp_ms(row.get(field))
+            if row.get("id") is None or version is None:
+                yield row
+                continue
+            key = (label, row["id"])
+            latest = self.pending.get(key)
+            if latest is None and key in stored:
+                latest = int(stored[key])
+            if latest is not None and version < latest:
+                self.skipped += 1
+                if on_drop:
+                    on_drop(row)
+                continue
+            self.pending[key] = version
+            yield row
+
+    def commit(self):
+        self.store.put_values(
+            "version",
+            ((label, id, version) for (label, id), version in self.pending.items()),
+        )
+        if self.skipped:
+            logger.info(f"Version guard: skipped {self.skipped} stale rows")
+        self.reset()
+
+    def reset(self):
+        self.pending = {}
+        self.skipped = 0
+
+
+class StreamWatermark:
+    """
+    Per stream high-water mark of _airbyte_emitted_at. filter_rows drops airbyte
+    rows emitted before the stored watermark (less lookback_ms) and tracks the
+    latest emitted_at seen, which commit stores as the new watermark.
+    """
+
+    def __init__(self, store, lookback_ms=WATERMARK_LOOKBACK_MS):
+        self.store = store
+        self.lookback_ms = lookback_ms
+        self.pending = {}
+        self.skipped = 0
+
+    def filter_rows(self, rows, stream, full_refresh=False):
+        """
+        Returns generator of the raw airbyte rows of stream to process. With
+        full_refresh all rows are processed, the watermark is still advanced.
+        """
+        watermark = None if full_refresh else self.store.get_watermark(stream)
+        if watermark is not None:
+            logger.info(f"Watermark for {stream}: {watermark}")
+        cutoff = None if watermark is None else watermark - self.lookback_ms
+        latest = self.pending.get(stream)
+        for row in rows:
+            emitted_at = parse_timestamp_ms(row.get("_airbyte_emitted_at"))
+            if emitted_at is not None:
+                if cutoff is not None and emitted_at < cutoff:
+                    self.skipped += 1
+                    continue
+                if latest is None or emitted_at > latest:
+                    latest = emitted_at
+                    self.pending[stream] = latest
+            yield row
+
+    def commit(self):
+        for stream, value in self.pending.items():
+            self.store.put_watermark(stream, value)
+            logger.info(f"Stored watermark for {stream}: {value}")
+        if self.skipped:
+            logger.info(f"Watermark: skipped {self.skipped} previously synced rows")
+        self.reset()
+
+    def reset(self):
+        self.pending = {}
+        self.skipped = 0
@@ -1,13 +1,165 @@
 import os
+import re
 import csv
-import json
+import shutil
 import logging
+import itertools
+from typing import ClassVar
+from collections import deque
+
+from etl import jsoncodec
+from etl.process_pool import create_process_pool
 
 
 # Initialize the logger
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Matches plain nested lookups such as data['fields']['assignee']['accountId']
+_FIELD_PATH_RE = re.compile(r"^data((?:\[(?:'[^']*'|\"[^\"]*\"|\d+)\])+)$")
+_FIELD_PATH_KEY_RE = re.compile(r"\[(?:'([^']*)'|\"([^\"]*)\"|(\d+))\]")
+
+# Field map expressions that are not plain lookups, keyed by expression string
+FIELD_EXPRESSION_HANDLERS = {}
+
+
+def register_field_expression(expression):
+    """
+    Registers a callable taking the airbyte data dict as the extractor for expression.
+    """
+
+    def decorator(func):
+        FIELD_EXPRESSION_HANDLERS[expression] = func
+        return func
+
+    return decorator
+
+
+@register_field_expression(
+    "','.join([', '.join([x['text'] for x in ic['content']]) for ic in data['body'].get('content', [])])"
+)
+def _flatten_comment_text(data):
+    return ",".join(
+        [
+            ", ".join([x["text"] for x in ic["content"]])
+            for ic in data["body"].get("content", [])
+        ]
+    )
+
+
+def _compile_field_path(keys):
+    def extract(data):
+        for key in keys:
+            try:
+                data = data[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return data
+
+    return extract
+
+
+def _compile_field_handler(handler):
+    def extract(data):
+        try:
+            return handler(data)
+        except KeyError:
+            return None
+
+    return extract
+
+
+def compile_field_expression(expression):
+    """
+    Compiles a s3_files_field_map expression into a callable taking the airbyte
+    data dict. Missing keys evaluate to None, and so do plain lookups through a
+    null or non-dict value (e.g. an unassigned issue's assignee), which raised
+    TypeError under eval.
+    """
+    match = _FIELD_PATH_RE.match(expression)
+    if match:
+        keys = tuple(
+            int(index) if index else single or double
+            for single, double, index in _FIELD_PATH_KEY_RE.findall(match.group(1))
+        )
+        return _compile_field_path(keys)
+
+    if expression in FIELD_EXPRESSION_HANDLERS:
+        return _compile_field_handler(FIELD_EXPRESSION_HANDLERS[expression])
+
+    # Anything else is compiled once and evaluated per row
+    code = compile(expression, "<s3_files_field_map>", "eval")
+    return _compile_field_handler(lambda data: eval(code, {"data": data}))
+
+
+AIRBYTE_CSV_FIELDNAMES = ["_airbyte_ab_id", "_airbyte_emitted_at", "_airbyte_data"]
+
+# Position of a raw row in its CSV file, set when the transform tracks progress
+AIRBYTE_ROW_NUMBER = "_airbyte_row_number"
+
+# Rows handed to a worker process at a time in parallel transform mode
+TRANSFORM_CHUNK_SIZE = 5000
+
+
+def read_airbyte_rows(csv_file):
+    """
+    Returns generator over the rows of an airbyte CSV file object, skipping the header.
+    """
+    reader = csv.DictReader(csv_file, fieldnames=AIRBYTE_CSV_FIELDNAMES)
+    if next(reader, None) is None:
+        return
+    yield from reader
+
+
+def _number_airbyte_rows(rows, start):
+    for number, row in enumerate(rows, start + 1):
+        row[AIRBYTE_ROW_NUMBER] = number
+        yield row
+
+
+def _chunk_airbyte_data(rows, chunk_size, numbers=None):
+    # numbers, when given, receives the row numbers of each chunk yielded
+    chunk = []
+    chunk_numbers = []
+    for row in rows:
+        chunk.append(row["_airbyte_data"])
+        if numbers is not None:
+            chunk_numbers.append(row[AIRBYTE_ROW_NUMBER])
+        if len(chunk) >= chunk_size:
+            if numbers is not None:
+                numbers.append(chunk_numbers)
+                chunk_numbers = []
+            yield chunk
+            chunk = []
+    if chunk:
+        if numbers is not None:
+            numbers.append(chunk_numbers)
+        yield chunk
+
+
+def _transform_chunk(chunk, extractors):
+    transformed = []
+    for raw in chunk:
+        data = jsoncodec.loads(raw)
+        transformed.append({key: extract(data) for key, extract in extractors})
+    return transformed
+
+
+# Extractors of the mapkey being transformed, set in each worker process
+_worker_extractors = None
+
+
+def _init_transform_worker(field_map):
+    global _worker_extractors
+    _worker_extractors = [
+        (key, compile_field_expression(expression))
+        for key, expression in field_map.items()
+    ]
+
+
+def _transform_worker_chunk(chunk):
+    return _transform_chunk(chunk, _worker_extractors)
+
 
 class Airbyte2jsonlTransformer(object):
     def __init__(self):
@@ -103,93 +255,288 @@ class Airbyte2jsonlTransformer(object):
                 "is_admin": "data['is_admin']",
             },
         }
+        self.compile_field_map()
 
-    def transform_airbyte_row(self, data, mapkey):
+    def compile_field_map(self):
         """
-        Evaluates expressions from fieldmap using the provided data dict for eval.
+        Compiles s3_files_field_map into extractors, call again after changing the map.
         """
-        evaluated_values = {}
-        for key, path in self.s3_files_field_map[mapkey].items():
-            try:
-                evaluated_values[key] = eval(path, {"data": data})
-            except KeyError:
-                evaluated_values[key] = None
-        return evaluated_values
+        self._field_extractors = {
+            mapkey: [
+                (key, compile_field_expression(expression))
+                for key, expression in field_map.items()
+            ]
+            for mapkey, field_map in self.s3_files_field_map.items()
+        }
 
-    def transform_airbyte2jsonl_format(self, source_file, output_file, mapkey):
+    def transform_airbyte_row(self, data, mapkey):
+        """
+        Extracts fields from the provided data dict using the compiled fieldmap.
+        """
+        return {key: extract(data) for key, extract in self._field_extractors[mapkey]}
+
+    def transform_airbyte2jsonl_format(
+        self,
+        source_file,
+        output_file,
+        mapkey,
+        workers=None,
+        chunk_size=TRANSFORM_CHUNK_SIZE,
+        ordered=True,
+    ):
         """
         Only fields defined in s3_files_field_map are transformed.
+        With workers > 1, chunks of chunk_size rows are transformed on a process pool;
+        ordered=False yields chunks as they complete instead of in input order.
         """
-        with open(output_file, "w") as fh:
+        with open(output_file, "wb") as fh:
             with open(source_file, "r", newline="") as csv_file:
-                reader = csv.DictReader(
-                    csv_file,
-                    fieldnames=[
-                        "_airbyte_ab_id",
-                        "_airbyte_emitted_at",
-                        "_airbyte_data",
-                    ],
-                )
-                next(reader)
-                for row in reader:
-                    data = self.transform_airbyte_row(
-                        json.loads(row["_airbyte_data"]), mapkey
-                    )
-                    fh.write(f"{json.dumps(data)}\n")
+                for data in self.transform_airbyte_rows(
+                    csv_file, mapkey, workers, chunk_size, ordered
+                ):
+                    fh.write(jsoncodec.dumps_line(data))
         logger.info(f"Generated {output_file}")
 
+    def transform_airbyte_rows(
+        self,
+        csv_file,
+        mapkey,
+        workers=None,
+        chunk_size=TRANSFORM_CHUNK_SIZE,
+        ordered=True,
+        row_filter=None,
+        skip_rows=0,
+        progress=None,
+    ):
+        """
+        Returns generator of transformed rows read from an airbyte CSV file object.
+        skip_rows leaves out the first rows of the file, e.g. those uploaded before
+        an interruption. row_filter optionally takes and returns an iterator of the
+        raw airbyte rows (_airbyte_ab_id, _airbyte_emitted_at, _airbyte_data),
+        before they are parsed. progress (etl.pipeline.RowProgress) is told the
+        row number of every transformed row, results are then always in order.
+        """
+        rows = read_airbyte_rows(csv_file)
+        if skip_rows:
+            rows = itertools.islice(rows, skip_rows, None)
+        if progress is not None:
+            rows = _number_airbyte_rows(rows, skip_rows)
+            ordered = True
+        if row_filter is not None:
+            rows = row_filter(rows)
+        if workers and workers > 1:
+            yield from self._transform_rows_parallel(
+                rows, mapkey, workers, chunk_size, ordered, progress
+            )
+            return
+
+        for row in rows:
+            transformed = self.transform_airbyte_row(
+                jsoncodec.loads(row["_airbyte_data"]), mapkey
+            )
+            if progress is not None:
+                progress.track(row[AIRBYTE_ROW_NUMBER], transformed)
+            yield transformed
+
+    def _transform_rows_parallel(
+        self, rows, mapkey, workers, chunk_size, ordered, progress=None
+    ):
+        numbers = deque() if progress is not None else None
+        chunks = _chunk_airbyte_data(rows, chunk_size, numbers)
+        pool = create_process_pool(
+            workers,
+            initializer=_init_transform_worker,
+            initargs=(self.s3_files_field_map[mapkey],),
+        )
+        if pool is None:
+            transformed_chunks = (
+                _transform_chunk(chunk, self._field_extractors[mapkey])
+                for chunk in chunks
+            )
+        else:
+            # A bounded number of chunks is in flight so memory stays flat
+            transformed_chunks = pool.imap(
+                _transform_worker_chunk, ((chunk,) for chunk in chunks), ordered
+            )
+        try:
+            for transformed in transformed_chunks:
+                if progress is not None:
+                    for number, row in zip(numbers.popleft(), transformed):
+                        progress.track(number, row)
+                yield from transformed
+        finally:
+            # Stops the workers of unfinished tasks before the pool is closed
+            transformed_chunks.close()
+            if pool is not None:
+                pool.close()
+
     def can_transform(self, mapkey):
         return mapkey in self.s3_files_field_map
 
 
+# Input bytes per shard when graph generation runs on a process pool
+GRAPH_SHARD_SIZE = 64 * 1024 * 1024
+
+
+def _line_aligned_ranges(filepath, shard_size):
+    """
+    Splits a JSONL file into (start, end) byte ranges of about shard_size that
+    start and end on line boundaries.
+    """
+    size = os.path.getsize(filepath)
+    ranges = []
+    start = 0
+    with open(filepath, "rb") as fh:
+        while start < size:
+            fh.seek(min(start + shard_size, size))
+            fh.readline()
+            end = fh.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges or [(0, size)]
+
+
+def _generate_graph_shard(
+    generator_class, data_type, input_filepath, start, end, output_filepath
+):
+    generator = generator_class()
+    rows = generator._read_lines(input_filepath, start, end)
+    generator.write_graph_records(
+        generator.PROCESSORS[data_type](rows), output_filepath
+    )
+
+
 class GraphGeneratorBase:
+    NODE_LABELS: ClassVar[dict] = {}  # Defined by derived classes
+    INDEXED_PROPERTIES: ClassVar[dict] = {}  # Defined by derived classes
+
     def __init__(self):
         self.PROCESSORS = None  # Defined by derived classes
 
-    def _read_lines(self, filepath):
-        # Returns generator to read the file line by line
-        with open(filepath, "r") as fh:
+    def _read_lines(self, filepath, start=0, end=None):
+        # Returns generator to read the file line by line, optionally a byte range
+        with open(filepath, "rb") as fh:
+            fh.seek(start)
             for line in fh:
-                yield (json.loads(line))
+                yield (jsoncodec.loads(line))
+                if end is not None and fh.tell() >= end:
+                    break
 
     def generate_graph_schema_format_data_files(
-        self, input_directory, output_directory
+        self,
+        input_directory,
+        output_directory,
+        data_types=None,
+        workers=None,
+        shard_size=GRAPH_SHARD_SIZE,
     ):
         """
         Generates JSONL files one per file_type, with labels and relationships.
         files_directory has jsonl's, one per file_type(users, issues, issue_comments etc)
+        data_types limits generation to those file_types, e.g. the ones in the
+        invocation manifest. With workers > 1 file_types, and shards of shard_size
+        bytes of large inputs, are processed on a process pool.
+        Returns the generated file paths.
         """
         if not os.path.exists(output_directory):
             os.makedirs(output_directory)
 
-        for data_type, processor in self.PROCESSORS.items():
+        jobs = []
+        for data_type in self.PROCESSORS:
+            if data_types is not None and data_type not in data_types:
+                continue
             input_filepath = f"{input_directory}/{data_type}.jsonl"
             if not os.path.exists(input_filepath):
                 logger.warning(
                     f"Input file not found: {input_filepath}, skipping {data_type}"
                 )
                 continue
-
             output_filepath = f"{output_directory}/{data_type}_data.jsonl"
-            with open(output_filepath, "w") as fh:
-                for line in processor(input_directory):
-                    fh.write(f"{json.dumps(line)}\n")
-            logger.info(f"Generated {output_filepath}")
+            jobs.append((data_type, input_filepath, output_filepath))
+
+        pool = None
+        if workers and workers > 1:
+            pool = create_process_pool(workers)
+        if pool is None:
+            for data_type, input_filepath, output_filepath in jobs:
+                self.write_graph_records(
+                    self.PROCESSORS[data_type](self._read_lines(input_filepath)),
+                    output_filepath,
+                )
+        else:
+            with pool:
+                self._generate_data_files_parallel(pool, jobs, shard_size)
+        return [output_filepath for _, _, output_filepath in jobs]
+
+    def _generate_data_files_parallel(self, pool, jobs, shard_size):
+        shards = []
+        outputs = []
+        for data_type, input_filepath, output_filepath in jobs:
+            ranges = _line_aligned_ranges(input_filepath, shard_size)
+            if len(ranges) == 1:
+                part_filepaths = [output_filepath]
+            else:
+                part_filepaths = [
+                    f"{output_filepath}.part{index:04d}" for index in range(len(ranges))
+                ]
+            shards.extend(
+                (type(self), data_type, input_filepath, start, end, part_filepath)
+                for (start, end), part_filepath in zip(ranges, part_filepaths)
+            )
+            outputs.append((output_filepath, part_filepaths))
+
+        for _ in pool.imap(_generate_graph_shard, shards, ordered=False):
+            pass
+
+        for output_filepath, part_filepaths in outputs:
+            if part_filepaths == [output_filepath]:
+                continue
+            # Stitch shards back together in input order
+            with open(output_filepath, "wb") as fh:
+                for part_filepath in part_filepaths:
+                    with open(part_filepath, "rb") as part:
+                        shutil.copyfileobj(part, fh)
+                    os.remove(part_filepath)
+            logger.info(
+                f"Generated {output_filepath} from {len(part_filepaths)} shards"
+            )
+
+    def generate_graph_records(self, data_type, rows):
+        """
+        Returns generator of graph records (nodes and relationships) for an iterable
+        of transformed rows of data_type.
+        """
+        return self.PROCESSORS[data_type](rows)
+
+    def write_graph_records(self, records, output_filepath):
+        with open(output_filepath, "wb") as fh:
+            fh.writelines(jsoncodec.dumps_line(line) for line in records)
+        logger.info(f"Generated {output_filepath}")
 
 
 class ConfluenceGraphGenerator(GraphGeneratorBase):
+    # Node label generated per data type
+    NODE_LABELS: ClassVar[dict] = {
+        "space": "confluence_space",
+        "pages": "confluence_page",
+    }
+    # Join properties indexed per node label, see etl/neo4j/schema.py
+    INDEXED_PROPERTIES: ClassVar[dict] = {
+        "confluence_page": ["author_id", "space_id", "parent_id"]
+    }
+
     def __init__(self):
         self.PROCESSORS = {
             "space": self._generate_space_node_and_relationships,
             "pages": self._generate_pages_node_and_relationships,
         }
 
-    def _generate_space_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/space.jsonl"):
+    def _generate_space_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "confluence_space", "properties": row}
 
-    def _generate_pages_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/pages.jsonl"):
+    def _generate_pages_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "confluence_page", "properties": row}
             yield {
                 "type": "relationship",
@@ -225,6 +572,18 @@ class ConfluenceGraphGenerator(GraphGeneratorBase):
 
 
 class SlackGraphGenerator(GraphGeneratorBase):
+    # Node label generated per data type
+    NODE_LABELS: ClassVar[dict] = {
+        "users": "slack_user",
+        "channels": "slack_channel",
+        "channel_messages": "slack_message",
+    }
+    # Join properties indexed per node label, see etl/neo4j/schema.py
+    INDEXED_PROPERTIES: ClassVar[dict] = {
+        "slack_channel": ["creator"],
+        "slack_message": ["channel_id", "user"],
+    }
+
     def __init__(self):
         self.PROCESSORS = {
             "users": self._generate_users_node_and_relationships,
@@ -232,12 +591,12 @@ class SlackGraphGenerator(GraphGeneratorBase):
             "channel_messages": self._generate_channel_messages_node_and_relationships,
         }
 
-    def _generate_users_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/users.jsonl"):
+    def _generate_users_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "slack_user", "properties": row}
 
-    def _generate_channels_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/channels.jsonl"):
+    def _generate_channels_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "slack_channel", "properties": row}
             yield {
                 "type": "relationship",
@@ -246,8 +605,8 @@ class SlackGraphGenerator(GraphGeneratorBase):
                 "relationship": "creates",
             }
 
-    def _generate_channel_messages_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/channel_messages.jsonl"):
+    def _generate_channel_messages_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "slack_message", "properties": row}
             yield {
                 "type": "relationship",
@@ -264,6 +623,24 @@ class SlackGraphGenerator(GraphGeneratorBase):
 
 
 class JiraGraphGenerator(GraphGeneratorBase):
+    # Node label generated per data type, sprint_issues only has relationships
+    NODE_LABELS: ClassVar[dict] = {
+        "boards": "jira_board",
+        "issues": "jira_issue",
+        "issue_comments": "jira_comment",
+        "projects": "jira_project",
+        "sprints": "jira_sprint",
+        "users": "atlassian_user",
+    }
+    # Join properties indexed per node label, see etl/neo4j/schema.py
+    INDEXED_PROPERTIES: ClassVar[dict] = {
+        "jira_board": ["project_id"],
+        "jira_comment": ["author_id", "issue_id"],
+        "jira_issue": ["assignee_id", "creator_id", "project_id"],
+        "jira_project": ["assignee_id"],
+        "jira_sprint": ["board_id"],
+    }
+
     def __init__(self):
         self.PROCESSORS = {
             "boards": self._generate_boards_node_and_relationships,
@@ -275,12 +652,12 @@ class JiraGraphGenerator(GraphGeneratorBase):
             "users": self._generate_users_node_and_relationships,
         }
 
-    def _generate_users_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/users.jsonl"):
+    def _generate_users_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "atlassian_user", "properties": row}
 
-    def _generate_projects_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/projects.jsonl"):
+    def _generate_projects_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "jira_project", "properties": row}
             yield {
                 "type": "relationship",
@@ -289,16 +666,13 @@ class JiraGraphGenerator(GraphGeneratorBase):
                 "relationship": "owns",
             }
 
-    def _generate_issues_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/issues.jsonl"):
+    def _generate_issues_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "jira_issue", "properties": row}
             if row["creator_id"]:
                 yield {
                     "type": "relationship",
-                    "start_node": {
-                        "label": "atlassian_user",
-                        "account_id": row["creator_id"],
-                    },
+                    "start_node": {"label": "atlassian_user", "id": row["creator_id"]},
                     "end_node": {"label": "jira_issue", "id": row["id"]},
                     "relationship": "creates",
                 }
@@ -316,8 +690,8 @@ class JiraGraphGenerator(GraphGeneratorBase):
                     "relationship": "worked_on_by",
                 }
 
-    def _generate_issue_comments_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/issue_comments.jsonl"):
+    def _generate_issue_comments_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "jira_comment", "properties": row}
             yield {
                 "type": "relationship",
@@ -332,8 +706,8 @@ class JiraGraphGenerator(GraphGeneratorBase):
                 "relationship": "contains",
             }
 
-    def _generate_boards_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/boards.jsonl"):
+    def _generate_boards_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "jira_board", "properties": row}
             yield {
                 "type": "relationship",
@@ -342,8 +716,8 @@ class JiraGraphGenerator(GraphGeneratorBase):
                 "relationship": "contains",
             }
 
-    def _generate_sprints_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/sprints.jsonl"):
+    def _generate_sprints_node_and_relationships(self, rows):
+        for row in rows:
             yield {"type": "node", "label": "jira_sprint", "properties": row}
             yield {
                 "type": "relationship",
@@ -352,8 +726,8 @@ class JiraGraphGenerator(GraphGeneratorBase):
                 "relationship": "contains",
             }
 
-    def _generate_sprint_issues_node_and_relationships(self, file_dir):
-        for row in self._read_lines(f"{file_dir}/sprint_issues.jsonl"):
+    def _generate_sprint_issues_node_and_relationships(self, rows):
+        for row in rows:
             yield {
                 "type": "relationship",
                 "start_node": {"label": "jira_sprint", "id": row["sprint_id"]},
@@ -5,11 +5,15 @@ setup(
     version="1.0",
     packages=find_packages(),
     install_requires=[
-        "openai==0.28",
+        "knowledge_graph",
         "neo4j",
         "boto3",
         # "botocore",
         "langchain",
         "langchain-community",
     ],
+    extras_require={
+        # Faster JSON codec for the ETL hot paths, see etl/jsoncodec.py
+        "fast": ["orjson"],
+    },
 )
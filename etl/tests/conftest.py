@@ -0,0 +1,113 @@
+import re
+
+import pytest
+from benchmarks.bench_etl import NullEmbeddingManager
+from etl.neo4j.upload import Neo4jUploader
+
+NODE_MERGE_RE = re.compile(
+    r"MERGE \(n:(\w+) \{\w+: row\.key\}\) SET n \+= row\.properties"
+)
+RELATIONSHIP_RE = re.compile(r"\(a:(\w+) .*\(b:(\w+) .*\[r:(\w+)\]")
+
+
+class Crash(Exception):
+    pass
+
+
+class GraphTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, parameters=None, **kwargs):
+        self.driver.pending.append((query, kwargs.get("rows") or []))
+        return []
+
+
+class GraphSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **kwargs):
+        return []
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        driver = self.driver
+        if driver.fail_after is not None and driver.transactions >= driver.fail_after:
+            raise Crash()
+        driver.pending = []
+        result = transaction_function(GraphTransaction(driver), *args, **kwargs)
+        driver.commit()
+        driver.transactions += 1
+        return result
+
+    execute_read = execute_write
+
+
+class GraphDriver:
+    """
+    Neo4j driver fake applying the uploader's batched node and relationship
+    queries to dicts. With fail_after, transactions after that many raise Crash.
+    """
+
+    Crash = Crash
+
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.transactions = 0
+        self.pending = []
+        self.nodes = {}
+        self.relationships = set()
+
+    def session(self, **kwargs):
+        return GraphSession(self)
+
+    def close(self):
+        pass
+
+    def commit(self):
+        for query, rows in self.pending:
+            match = NODE_MERGE_RE.search(query)
+            if match:
+                for row in rows:
+                    key = (match.group(1), row["key"])
+                    self.nodes.setdefault(key, {}).update(row["properties"])
+                continue
+            match = RELATIONSHIP_RE.search(query)
+            if match:
+                label1, label2, relationship = match.groups()
+                for row in rows:
+                    self.relationships.add(
+                        (label1, row["a"], relationship, label2, row["b"])
+                    )
+
+    def ids(self, label):
+        return {key for node_label, key in self.nodes if node_label == label}
+
+
+@pytest.fixture
+def graph_driver():
+    return GraphDriver
+
+
+@pytest.fixture
+def make_uploader():
+    """
+    Returns a function building a batched Neo4jUploader over a GraphDriver.
+    """
+
+    def make(driver, **options):
+        options.setdefault("batch_size", 100)
+        return Neo4jUploader(
+            None, None, None, NullEmbeddingManager(), driver=driver, **options
+        )
+
+    return make
@@ -0,0 +1,119 @@
+import csv
+
+from etl.neo4j.bulk_import import BulkImportExporter, validate_csv, validate_header
+
+
+def export(tmp_path, records, identity_keys=None):
+    exporter = BulkImportExporter(identity_keys)
+    exporter.add_records(records)
+    return exporter, exporter.write(str(tmp_path))
+
+
+def read_csv(path):
+    with open(path, newline="") as fh:
+        return list(csv.reader(fh))
+
+
+RECORDS = [
+    {"type": "node", "label": "jira_issue", "properties": {"id": "1", "title": "a"}},
+    {
+        "type": "node",
+        "label": "jira_issue",
+        "properties": {"id": "1", "points": 3, "labels": ["x", "y"]},
+    },
+    {"type": "node", "label": "jira_issue", "properties": {"id": "2", "points": 1.5}},
+    {
+        "type": "relationship",
+        "start_node": {"label": "jira_issue", "id": "1"},
+        "end_node": {"label": "atlassian_user", "id": "u1"},
+        "relationship": "assigned_to",
+    },
+]
+
+
+def test_exported_csvs_validate(tmp_path):
+    exporter, paths = export(tmp_path, RECORDS + RECORDS[-1:])
+    assert len(paths["nodes"]) == 2
+    assert len(paths["relationships"]) == 1
+    for path in paths["nodes"] + paths["relationships"]:
+        assert validate_csv(path) == []
+    assert exporter.duplicates == 1
+    (relationships,) = paths["relationships"]
+    assert len(read_csv(relationships)) == 2
+    assert "neo4j-admin database import full" in exporter.import_command(paths)
+
+
+def test_later_properties_override_earlier_ones(tmp_path):
+    _, paths = export(tmp_path, RECORDS)
+    (issues,) = [path for path in paths["nodes"] if "jira_issue" in path]
+    header, *rows = read_csv(issues)
+    issue = dict(zip(header, rows[0]))
+    assert issue["title:string"] == "a"
+    assert issue["labels:string[]"] == "x;y"
+    assert issue["points:double"] == "3"
+    # Mixed long and double values are exported as double
+    assert "points:double" in header
+
+
+def test_relationship_endpoints_without_nodes_are_exported(tmp_path):
+    _, paths = export(tmp_path, RECORDS)
+    (users,) = [path for path in paths["nodes"] if "atlassian_user" in path]
+    assert validate_csv(users) == []
+    assert len(read_csv(users)) == 2
+
+
+def test_validate_header_reports_problems():
+    assert validate_header(["id:ID(jira_issue)", "title", ":LABEL"], "node") == []
+    assert validate_header(["title"], "node") == ["expected one :ID field"]
+    assert validate_header(["id:ID", "id2:ID"], "node") == ["expected one :ID field"]
+    assert validate_header(["id:ID", "x:unknown"], "node") == [
+        "invalid field 'x:unknown'"
+    ]
+    assert validate_header(["id:ID", "title(group)"], "node") == [
+        "only id fields take an id group: 'title(group)'"
+    ]
+    assert validate_header([":START_ID", ":END_ID"], "relationship") == [
+        "expected one :TYPE field"
+    ]
+
+
+def test_validate_csv_reports_short_rows(tmp_path):
+    path = tmp_path / "nodes_jira_issue.csv"
+    path.write_text("id:ID,title\n1,a\n2\n")
+    assert validate_csv(str(path)) == [f"{path}: row 3 has 1 of 2 columns"]
+
+
+def test_numeric_and_string_ids_are_one_node(tmp_path):
+    records = [
+        {"type": "node", "label": "jira_project", "properties": {"id": "10"}},
+        {
+            "type": "node",
+            "label": "jira_project",
+            "properties": {"id": 10, "title": "p"},
+        },
+        {
+            "type": "relationship",
+            "start_node": {"label": "jira_board", "id": 1},
+            "end_node": {"label": "jira_project", "id": 10},
+            "relationship": "board_of",
+        },
+        {
+            "type": "relationship",
+            "start_node": {"label": "jira_board", "id": "1"},
+            "end_node": {"label": "jira_project", "id": "10"},
+            "relationship": "board_of",
+        },
+    ]
+    _, paths = export(tmp_path, records)
+    for path in paths["nodes"] + paths["relationships"]:
+        assert validate_csv(path) == []
+    (projects,) = [path for path in paths["nodes"] if "jira_project" in path]
+    assert [row[0] for row in read_csv(projects)[1:]] == ["10"]
+    (relationships,) = paths["relationships"]
+    assert read_csv(relationships)[1:] == [["1", "10", "board_of"]]
+
+
+def test_validate_csv_reports_duplicate_ids(tmp_path):
+    path = tmp_path / "nodes_jira_project.csv"
+    path.write_text(":ID(jira_project),:LABEL\n10,jira_project\n10,jira_project\n")
+    assert validate_csv(str(path)) == [f"{path}: row 3 duplicates id '10' of row 2"]
@@ -0,0 +1,130 @@
+import io
+
+import pytest
+from benchmarks.synthetic import generate_dataset
+from etl.jsoncodec import dumps_line
+from etl.neo4j.checkpoint import LocalFileCheckpointStore, file_identity
+from etl.pipeline import RowProgress, StreamingPipeline
+from etl.state import ChangeDetector, SQLiteStateStore, VersionGuard
+from etl.transforms import Airbyte2jsonlTransformer, JiraGraphGenerator
+
+ROWS = 600
+
+
+@pytest.fixture
+def issues_csv(tmp_path):
+    filepath = generate_dataset(str(tmp_path), ROWS, mapkeys=["jira/issues"])
+    with open(filepath["jira/issues"], newline="") as fh:
+        return fh.read()
+
+
+def issue_ids(text):
+    rows = Airbyte2jsonlTransformer().transform_airbyte_rows(
+        io.StringIO(text), "jira/issues"
+    )
+    return {row["id"] for row in rows}
+
+
+@pytest.mark.parametrize("workers", [None, 2])
+def test_pipeline_resume_loses_no_rows(
+    tmp_path, issues_csv, graph_driver, make_uploader, workers
+):
+    checkpoints = LocalFileCheckpointStore(str(tmp_path / "checkpoints"))
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+
+    def pipeline(driver, checkpoint_store=checkpoints):
+        return StreamingPipeline(
+            Airbyte2jsonlTransformer(),
+            make_uploader(driver, checkpoint_store=checkpoint_store),
+            chunk_size=50,
+            change_detector=ChangeDetector(store),
+            version_guard=VersionGuard(store),
+        )
+
+    def run(driver, text, identity=None, checkpoint_store=checkpoints):
+        return pipeline(driver, checkpoint_store).run(
+            io.StringIO(text),
+            "jira/issues",
+            JiraGraphGenerator(),
+            workers=workers,
+            identity=identity,
+        )
+
+    crashed = graph_driver(fail_after=10)
+    with pytest.raises(graph_driver.Crash):
+        run(crashed, issues_csv, "issues@1")
+    checkpoint = checkpoints.get("issues@1")
+    assert 0 < checkpoint["rows"] < ROWS
+
+    # Another invocation stores the hashes of the rows after the checkpoint
+    lines = issues_csv.splitlines(True)
+    later = "".join(lines[:1] + lines[1 + checkpoint["rows"] :])
+    concurrent = graph_driver()
+    run(concurrent, later, checkpoint_store=None)
+
+    retried = graph_driver()
+    run(retried, issues_csv, "issues@1")
+    uploaded = (
+        crashed.ids("jira_issue")
+        | concurrent.ids("jira_issue")
+        | retried.ids("jira_issue")
+    )
+    assert issue_ids(issues_csv) <= uploaded
+    # The retry starts at the checkpoint, not at the first row
+    checkpointed = "".join(lines[: 1 + checkpoint["rows"]])
+    assert not issue_ids(checkpointed) & retried.ids("jira_issue")
+    assert checkpoints.get("issues@1") is None
+
+
+def test_file_upload_resumes_from_checkpoint(
+    tmp_path, issues_csv, graph_driver, make_uploader
+):
+    rows = list(
+        Airbyte2jsonlTransformer().transform_airbyte_rows(
+            io.StringIO(issues_csv), "jira/issues"
+        )
+    )
+    filepath = str(tmp_path / "issues_data.jsonl")
+    with open(filepath, "wb") as fh:
+        records = JiraGraphGenerator().generate_graph_records("issues", rows)
+        fh.writelines(dumps_line(record) for record in records)
+    checkpoints = LocalFileCheckpointStore(str(tmp_path / "checkpoints"))
+
+    crashed = graph_driver(fail_after=5)
+    with pytest.raises(graph_driver.Crash):
+        make_uploader(crashed, checkpoint_store=checkpoints).upload_file_to_neo4j(
+            filepath
+        )
+    assert checkpoints.get(file_identity(filepath))["rows"] > 0
+
+    retried = graph_driver()
+    make_uploader(retried, checkpoint_store=checkpoints).upload_file_to_neo4j(filepath)
+    ids = {row["id"] for row in rows}
+    assert ids <= crashed.ids("jira_issue") | retried.ids("jira_issue")
+    assert len(retried.ids("jira_issue")) < len(ids)
+    assert checkpoints.get(file_identity(filepath)) is None
+
+
+def test_row_progress_advances_over_dropped_rows(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "state.db"))
+    rows = [{"id": str(i), "title": "a"} for i in range(1, 2001)]
+    detector = ChangeDetector(store, batch_size=100)
+    list(detector.filter_rows(rows, "jira_issue"))
+    detector.commit()
+
+    # A rerun of unchanged rows, none reaches the graph generator
+    progress = RowProgress()
+    held = []
+
+    def tracked(rows):
+        for number, row in enumerate(rows, 1):
+            progress.track(number, row)
+            held.append(len(progress._tracked))
+            yield row
+
+    rows = [dict(row) for row in rows]
+    filtered = detector.filter_rows(tracked(rows), "jira_issue", on_drop=progress.drop)
+    assert list(progress.generator_input(filtered)) == []
+    assert progress.completed == len(rows)
+    # Only the rows of the change detector's current batch are held
+    assert max(held) <= detector.batch_size
@@ -0,0 +1,121 @@
+import copy
+import random
+import tracemalloc
+
+from etl.dedup import DEDUP_ENTRY_BYTES, BloomFilter, GraphRecordDeduplicator, _digest
+
+from etl import dedup
+
+
+def node(id, **properties):
+    return {
+        "type": "node",
+        "label": "jira_issue",
+        "properties": {"id": id, **properties},
+    }
+
+
+def relationship(start, end, type="assigned_to"):
+    return {
+        "type": "relationship",
+        "start_node": {"label": "jira_issue", "id": start},
+        "end_node": {"label": "atlassian_user", "id": end},
+        "relationship": type,
+    }
+
+
+def test_drops_repeated_copies():
+    records = [
+        node("1", title="a"),
+        node("1", title="a"),
+        relationship("1", "u1"),
+        relationship("1", "u1"),
+        relationship("1", "u1", "created_by"),
+        {"type": "other"},
+    ]
+    deduplicator = GraphRecordDeduplicator()
+    assert list(deduplicator.filter(records)) == [
+        records[0],
+        records[2],
+        records[4],
+        records[5],
+    ]
+    assert deduplicator.suppressed == {"node": 1, "relationship": 1}
+
+
+def test_keeps_changed_copies_so_the_last_copy_wins():
+    records = [node("1", title="a"), node("1", title="b"), node("1", title="a")]
+    assert list(GraphRecordDeduplicator().filter(records)) == records
+
+
+def test_keys_nodes_on_identity_keys():
+    records = [
+        {"type": "node", "label": "jira_project", "properties": {"key": "P", "id": 1}},
+        {"type": "node", "label": "jira_project", "properties": {"key": "P", "id": 1}},
+        {"type": "node", "label": "jira_project", "properties": {"key": "Q", "id": 1}},
+    ]
+    deduplicator = GraphRecordDeduplicator(identity_keys={"jira_project": "key"})
+    assert list(deduplicator.filter(records)) == [records[0], records[2]]
+
+
+def test_uploads_the_same_graph_as_without_dedup(graph_driver, make_uploader):
+    rng = random.Random(1)
+    records = []
+    for _ in range(2000):
+        id = str(rng.randrange(100))
+        records.append(
+            node(id, status=rng.choice(["open", "done"]), rank=rng.randrange(2))
+        )
+        records.append(relationship(id, f"u{rng.randrange(5)}"))
+
+    expected = graph_driver()
+    make_uploader(expected).upload_records(copy.deepcopy(records))
+    deduplicated = graph_driver()
+    deduplicator = GraphRecordDeduplicator()
+    make_uploader(deduplicated).upload_records(
+        deduplicator.filter(copy.deepcopy(records))
+    )
+    assert deduplicated.nodes == expected.nodes
+    assert deduplicated.relationships == expected.relationships
+    assert deduplicator.suppressed["relationship"] > 0
+
+
+def test_falls_back_to_a_bloom_filter_within_the_budget():
+    deduplicator = GraphRecordDeduplicator(memory_budget=4096)
+    records = [relationship(str(i), "u") for i in range(200)]
+    assert len(list(deduplicator.filter(records + records))) == 200
+    assert deduplicator.bloom is not None
+    assert len(deduplicator.bloom.bits) == 1024
+    assert deduplicator.exact_bytes() <= 3072 + DEDUP_ENTRY_BYTES
+
+
+def test_entry_bytes_cover_the_measured_memory():
+    deduplicator = GraphRecordDeduplicator(memory_budget=1 << 40)
+    tracemalloc.start()
+    try:
+        for i in range(20000):
+            deduplicator.is_repeat_node(node(str(i), title="a"))
+        nodes, _ = tracemalloc.get_traced_memory()
+        for i in range(20000):
+            deduplicator.is_repeat(_digest(str(i).encode()))
+        total, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert nodes <= 20000 * DEDUP_ENTRY_BYTES
+    assert total - nodes <= 20000 * DEDUP_ENTRY_BYTES
+
+
+def test_default_budget_is_a_share_of_the_lambda_memory(monkeypatch):
+    monkeypatch.delenv("ETL_DEDUP_MEMORY_MB", raising=False)
+    monkeypatch.setenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "128")
+    assert dedup._default_memory_budget() == 16 * 1024 * 1024
+    monkeypatch.setenv("ETL_DEDUP_MEMORY_MB", "8")
+    assert dedup._default_memory_budget() == 8 * 1024 * 1024
+
+
+def test_bloom_filter_reports_added_digests():
+    bloom = BloomFilter(1024)
+    digests = [_digest(str(i).encode()) for i in range(100)]
+    assert not any(bloom.add(digest) for digest in digests)
+    assert all(bloom.add(digest) for digest in digests)
+    assert bloom.count == 100
@@ -0,0 +1,147 @@
+import pytest
+from etl.embedding import EMBEDDING_DIMENSIONS, EMBEDDING_MODEL, Neo4jEmbeddingManager
+from knowledge_graph.embedding_cache import cache_key
+from knowledge_graph.embedding_text import node_text
+from neo4j.exceptions import ServiceUnavailable
+
+from etl import embedding
+
+PROPERTIES = ["text", "author_id", "issue_id"]
+
+
+class EmbeddingTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, **parameters):
+        if self.driver.fail_writes:
+            raise ServiceUnavailable("write failed")
+        self.driver.writes.append(parameters["rows"])
+
+
+class EmbeddingSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, ids, missing):
+        # Reads the embedding state of the stored nodes
+        return [
+            {
+                "id": id,
+                "model": self.driver.hashes.get(id) and EMBEDDING_MODEL,
+                "hash": self.driver.hashes.get(id),
+                "dimensions": EMBEDDING_DIMENSIONS if id in self.driver.hashes else 0,
+                "properties": self.driver.nodes[id] if id in missing else None,
+            }
+            for id in ids
+            if id in self.driver.nodes
+        ]
+
+    def execute_write(self, transaction_function, *args):
+        return transaction_function(EmbeddingTransaction(self.driver), *args)
+
+
+class EmbeddingDriver:
+    def __init__(self, nodes, hashes=None, fail_writes=False):
+        self.nodes = nodes
+        self.hashes = hashes or {}
+        self.fail_writes = fail_writes
+        self.writes = []
+
+    def session(self, **kwargs):
+        return EmbeddingSession(self)
+
+
+class EmbeddingClient:
+    def __init__(self, fail=()):
+        # Indexes of the requests that fail
+        self.fail = set(fail)
+        self.requests = []
+        self.retries = 0
+
+    def embed_many(self, batches, model):
+        results = []
+        for inputs, tokens in batches:
+            if len(self.requests) in self.fail:
+                results.append(RuntimeError("request failed"))
+            else:
+                results.append([[0.1] * EMBEDDING_DIMENSIONS for _ in inputs])
+            self.requests.append(inputs)
+        return results
+
+
+def comments(count):
+    return {str(i): {"id": str(i), "text": f"comment {i}"} for i in range(count)}
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.delenv("EMBEDDING_CACHE_TABLE", raising=False)
+    monkeypatch.delenv("EMBEDDING_CACHE_PATH", raising=False)
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(embedding, "EMBEDDING_BATCH_INPUTS", 2)
+    monkeypatch.setattr(embedding, "EMBEDDING_WRITE_BATCH_SIZE", 2)
+
+
+def manager(driver, client):
+    return Neo4jEmbeddingManager(None, None, None, driver, client=client)
+
+
+def test_bulk_update_batches_requests_and_writes(small_batches):
+    nodes = comments(5)
+    driver = EmbeddingDriver(nodes)
+    client = EmbeddingClient()
+    items = [("jira_comment", id, None) for id in nodes]
+
+    assert manager(driver, client).update_embeddings_bulk(items) == []
+    assert [len(inputs) for inputs in client.requests] == [2, 2, 1]
+    assert [len(rows) for rows in driver.writes] == [2, 2, 1]
+    (row, *_) = driver.writes[0]
+    assert row["hash"] == cache_key(EMBEDDING_MODEL, node_text(nodes["0"], PROPERTIES))
+
+
+def test_bulk_update_batches_requests_by_tokens(monkeypatch):
+    monkeypatch.setattr(embedding, "EMBEDDING_BATCH_TOKENS", 10)
+    monkeypatch.setattr(embedding, "count_tokens", lambda text: 6)
+    nodes = comments(3)
+    client = EmbeddingClient()
+    items = [("jira_comment", id, properties) for id, properties in nodes.items()]
+
+    manager(EmbeddingDriver(nodes), client).update_embeddings_bulk(items)
+    assert [len(inputs) for inputs in client.requests] == [1, 1, 1]
+
+
+def test_bulk_update_skips_unchanged_nodes():
+    nodes = comments(2)
+    hashes = {"0": cache_key(EMBEDDING_MODEL, node_text(nodes["0"], PROPERTIES))}
+    driver = EmbeddingDriver(nodes, hashes)
+    client = EmbeddingClient()
+    items = [("jira_comment", id, None) for id in nodes]
+
+    manager(driver, client).update_embeddings_bulk(items)
+    assert client.requests == [[node_text(nodes["1"], PROPERTIES)]]
+    assert [[row["id"] for row in rows] for rows in driver.writes] == [["1"]]
+
+
+def test_bulk_update_returns_failed_items(small_batches):
+    nodes = comments(4)
+    items = [("jira_comment", id, None) for id in nodes]
+
+    failed = manager(
+        EmbeddingDriver(nodes), EmbeddingClient(fail=[1])
+    ).update_embeddings_bulk(items)
+    assert failed == [("jira_comment", "2", None), ("jira_comment", "3", None)]
+
+    failed = manager(
+        EmbeddingDriver(nodes, fail_writes=True), EmbeddingClient()
+    ).update_embeddings_bulk(items)
+    assert sorted(failed) == sorted(items)
@@ -0,0 +1,55 @@
+from knowledge_graph.embedding_cache import (
+    SQLiteEmbeddingCache,
+    cache_key,
+    get_embedding_cache,
+)
+
+# A 4 dimensional float32 vector is stored in 16 bytes
+VECTOR = [0.5, 0.25, 0.125, 1.0]
+
+
+def test_cache_key_ignores_unicode_and_whitespace_variations():
+    assert cache_key("model", "café  menu\n") == cache_key("model", "café menu")
+    assert cache_key("model", "a") != cache_key("other", "a")
+
+
+def test_sqlite_cache_round_trip_counts_hits(tmp_path):
+    path = str(tmp_path / "cache.db")
+    SQLiteEmbeddingCache(path).put_many({"a": VECTOR})
+    cache = SQLiteEmbeddingCache(path)
+    assert cache.size == 16
+    assert cache.get_many(["a", "b", "a"]) == {"a": VECTOR}
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_sqlite_cache_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache = SQLiteEmbeddingCache(str(tmp_path / "cache.db"), max_bytes=60)
+    times = iter(range(100))
+    monkeypatch.setattr(
+        "knowledge_graph.embedding_cache.time.time", lambda: next(times)
+    )
+    cache.put_many({"a": VECTOR})
+    cache.put_many({"b": VECTOR})
+    cache.put_many({"c": VECTOR})
+    # Reading a makes b the least recently used
+    cache.get("a")
+    cache.put_many({"d": VECTOR})
+
+    assert set(cache.get_many(["a", "b", "c", "d"])) == {"a", "c", "d"}
+    assert cache.size == 48
+
+
+def test_sqlite_cache_counts_replaced_vectors_once(tmp_path):
+    cache = SQLiteEmbeddingCache(str(tmp_path / "cache.db"), max_bytes=32)
+    for _ in range(3):
+        cache.put_many({"a": VECTOR})
+    cache.put_many({"b": VECTOR})
+    assert set(cache.get_many(["a", "b"])) == {"a", "b"}
+
+
+def test_cache_backend_from_environment(tmp_path, monkeypatch):
+    monkeypatch.delenv("EMBEDDING_CACHE_TABLE", raising=False)
+    monkeypatch.delenv("EMBEDDING_CACHE_PATH", raising=False)
+    assert get_embedding_cache() is None
+    monkeypatch.setenv("EMBEDDING_CACHE_PATH", str(tmp_path / "cache.db"))
+    assert isinstance(get_embedding_cache(), SQLiteEmbeddingCache)
@@ -0,0 +1,65 @@
+import pytest
+from benchmarks.fake_embedding_server import fake_embedding, start_server
+from knowledge_graph.embedding_client import (
+    EmbeddingClient,
+    EmbeddingRequestError,
+    RateLimiter,
+)
+
+MODEL = "text-embedding-ada-002"
+
+
+@pytest.fixture
+def server():
+    server = start_server(retry_after=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client_for(server, **options):
+    return EmbeddingClient(
+        api_key="fake",
+        base_url=server.base_url,
+        limiter=RateLimiter(60000, 10000000),
+        **options,
+    )
+
+
+def test_embeds_texts_in_input_order(server):
+    texts = [f"text {i}" for i in range(5)]
+    assert client_for(server).embed(texts, MODEL) == [
+        fake_embedding(text) for text in texts
+    ]
+
+
+def test_retries_throttled_requests_after_retry_after(server):
+    throttled = []
+    should_throttle = server.should_throttle
+
+    def throttle_twice():
+        if len(throttled) < 2:
+            throttled.append(True)
+            return True
+        return should_throttle()
+
+    server.should_throttle = throttle_twice
+    client = client_for(server)
+    assert client.embed(["a"], MODEL) == [fake_embedding("a")]
+    assert client.stats()["throttled"] == 2
+    assert client.stats()["retries"] == 2
+
+
+def test_embed_many_returns_the_error_of_failed_batches(server):
+    server.throttle_rate = 1.0
+    client = client_for(server, max_retries=1, concurrency=2)
+    results = client.embed_many([(["a"], None), (["b"], None)], MODEL)
+    assert all(isinstance(result, EmbeddingRequestError) for result in results)
+    assert {result.status for result in results} == {429}
+
+
+def test_embed_many_runs_batches_concurrently(server):
+    server.latency = 0.05
+    batches = [([f"text {i}"], None) for i in range(8)]
+    results = client_for(server, concurrency=4).embed_many(batches, MODEL)
+    assert results == [[fake_embedding(inputs[0])] for inputs, tokens in batches]
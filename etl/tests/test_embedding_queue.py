@@ -0,0 +1,126 @@
+import json
+
+import pytest
+from etl.embedding_queue import (
+    EmbeddingQueueError,
+    EmbeddingWorker,
+    InMemoryEmbeddingQueue,
+    SQSEmbeddingQueue,
+)
+from neo4j.exceptions import ServiceUnavailable
+
+from etl import embedding_queue
+
+
+class RecordingManager:
+    def __init__(self, failing=(), error=None):
+        self.failing = set(failing)
+        self.error = error
+        self.batches = []
+
+    def update_embeddings_bulk(self, items):
+        if self.error:
+            raise self.error
+        self.batches.append(list(items))
+        return [item for item in items if item[1] in self.failing]
+
+
+class FakeSQS:
+    def __init__(self, failures=()):
+        # One {entry Id: SenderFault} per call, then every entry succeeds
+        self.failures = list(failures)
+        self.calls = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.calls.append([json.loads(entry["MessageBody"]) for entry in Entries])
+        failed = self.failures.pop(0) if self.failures else {}
+        return {
+            "Failed": [
+                {"Id": entry["Id"], "SenderFault": failed[entry["Id"]]}
+                for entry in Entries
+                if entry["Id"] in failed
+            ]
+        }
+
+
+def test_in_memory_queue_embeds_a_node_upserted_twice_once():
+    queue = InMemoryEmbeddingQueue()
+    queue.put("jira_issue", "1", {"title": "a"})
+    queue.put_many([("jira_issue", "2", None), ("jira_issue", "1", {"title": "b"})])
+
+    assert len(queue) == 2
+    assert queue.get_batch(1) == [("jira_issue", "2", None)]
+    assert queue.get_batch(10) == [("jira_issue", "1", {"title": "b"})]
+    assert queue.get_batch(10) == []
+
+
+def test_sqs_queue_sends_batches_and_drops_oversized_properties(monkeypatch):
+    monkeypatch.setattr(embedding_queue, "SQS_MAX_MESSAGE_BYTES", 100)
+    sqs = FakeSQS()
+    items = [("slack_message", str(i), {"text": "hi"}) for i in range(12)]
+    items.append(("slack_message", "big", {"text": "x" * 100}))
+    SQSEmbeddingQueue("queue-url", sqs).put_many(items)
+
+    assert [len(call) for call in sqs.calls] == [10, 3]
+    assert sqs.calls[1][-1] == {
+        "label": "slack_message",
+        "id": "big",
+        "properties": None,
+    }
+    assert sqs.calls[0][0]["properties"] == {"text": "hi"}
+
+
+def test_sqs_queue_resends_failed_entries(monkeypatch):
+    monkeypatch.setattr(embedding_queue, "SQS_SEND_BACKOFF_SECONDS", 0)
+    sqs = FakeSQS(failures=[{"1": False}])
+    SQSEmbeddingQueue("queue-url", sqs).put_many(
+        [("jira_issue", "a", None), ("jira_issue", "b", None)]
+    )
+    assert [[item["id"] for item in call] for call in sqs.calls] == [["a", "b"], ["b"]]
+
+
+def test_sqs_queue_raises_on_sender_faults():
+    sqs = FakeSQS(failures=[{"0": True}])
+    with pytest.raises(EmbeddingQueueError):
+        SQSEmbeddingQueue("queue-url", sqs).put("jira_issue", "a")
+    assert len(sqs.calls) == 1
+
+
+def test_worker_drains_queue_in_batches():
+    manager = RecordingManager()
+    queue = InMemoryEmbeddingQueue()
+    queue.put_many(("jira_issue", str(i), None) for i in range(5))
+
+    worker = EmbeddingWorker(manager, batch_size=2)
+    assert worker.drain(queue, minimum=2) == 4
+    assert len(queue) == 1
+    assert worker.drain(queue) == 1
+    assert [len(batch) for batch in manager.batches] == [2, 2, 1]
+
+
+def test_worker_returns_failed_items():
+    worker = EmbeddingWorker(RecordingManager(failing=["2"]))
+    items = [("jira_issue", "1", None), ("jira_issue", "2", None)]
+    assert worker.process(items) == [items[1]]
+
+    worker = EmbeddingWorker(RecordingManager(error=ServiceUnavailable("down")))
+    assert worker.process(items) == items
+
+
+def test_upload_queues_embeddings_after_commit(graph_driver, make_uploader):
+    manager = RecordingManager()
+    uploader = make_uploader(graph_driver())
+    uploader.embedding_worker = EmbeddingWorker(manager)
+    uploader.upload_records(
+        [
+            {"type": "node", "label": "jira_issue", "properties": {"id": "1"}},
+            {"type": "node", "label": "jira_issue", "properties": {"id": "2"}},
+        ]
+    )
+    assert manager.batches == []
+    assert len(uploader.embedding_queue) == 2
+
+    assert uploader.drain_embeddings() == 2
+    assert manager.batches == [
+        [("jira_issue", "1", {"id": "1"}), ("jira_issue", "2", {"id": "2"})]
+    ]
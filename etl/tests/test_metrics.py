@@ -0,0 +1,50 @@
+import json
+import logging
+
+from etl.metrics import Metrics, log_sampled, metrics
+
+from etl import metrics as metrics_module
+
+
+def metrics_lines(caplog):
+    return [
+        json.loads(record.getMessage())
+        for record in caplog.records
+        if record.getMessage().startswith('{"metrics"')
+    ]
+
+
+def test_emit_groups_counters_and_latency_by_stage_and_label(caplog):
+    caplog.set_level(logging.INFO)
+    recorder = Metrics(interval=3600)
+    recorder.incr("upload", "records", 3, "jira_issue")
+    recorder.observe("upload", 12.0, "jira_issue")
+    recorder.emit()
+    recorder.emit()
+
+    (line,) = metrics_lines(caplog)
+    assert line["upload"]["jira_issue"]["records"] == 3
+    assert line["upload"]["jira_issue"]["latency_ms"]["count"] == 1
+
+
+def test_log_sampled_logs_at_debug(monkeypatch, caplog):
+    monkeypatch.setattr(metrics_module.metrics, "sample_rate", 1.0)
+    caplog.set_level(logging.DEBUG)
+    log_sampled("Uploaded node: %s", "jira_issue")
+    assert [(r.levelno, r.getMessage()) for r in caplog.records] == [
+        (logging.DEBUG, "Uploaded node: jira_issue")
+    ]
+
+
+def test_file_upload_emits_metrics(tmp_path, caplog, graph_driver, make_uploader):
+    filepath = tmp_path / "issues_data.jsonl"
+    filepath.write_text(
+        '{"type": "node", "label": "jira_issue", "properties": {"id": "1"}}\n'
+    )
+    caplog.set_level(logging.INFO)
+    metrics.emit()
+    caplog.clear()
+    make_uploader(graph_driver()).upload_file_to_neo4j(str(filepath))
+
+    (line,) = metrics_lines(caplog)
+    assert line["upload"]["jira_issue"]["records"] == 1
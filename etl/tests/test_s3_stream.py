@@ -0,0 +1,41 @@
+import csv
+import gzip
+
+import pytest
+from etl.s3_stream import LocalS3Client, S3ObjectReader, open_airbyte_object
+
+CSV_TEXT = "".join(
+    f'{i},"line {i}\nwith ünïcode and, commas",{i * 7}\n' for i in range(500)
+)
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / "bucket").mkdir()
+    (tmp_path / "bucket" / "plain.csv").write_bytes(CSV_TEXT.encode("utf-8"))
+    (tmp_path / "bucket" / "compressed.csv").write_bytes(
+        gzip.compress(CSV_TEXT.encode("utf-8"))
+    )
+    return LocalS3Client(str(tmp_path))
+
+
+def test_local_client_serves_ranges(client):
+    assert client.head_object(Bucket="bucket", Key="plain.csv") == {
+        "ContentLength": len(CSV_TEXT.encode("utf-8"))
+    }
+    body = client.get_object(Bucket="bucket", Key="plain.csv", Range="bytes=2-5")
+    assert body["Body"].read() == CSV_TEXT.encode("utf-8")[2:6]
+
+
+def test_reader_fetches_the_object_in_ranged_requests(client):
+    reader = S3ObjectReader(client, "bucket", "plain.csv", chunk_size=100)
+    assert reader.readall() == CSV_TEXT.encode("utf-8")
+
+
+@pytest.mark.parametrize("key", ["plain.csv", "compressed.csv"])
+@pytest.mark.parametrize("chunk_size", [64, 1024 * 1024])
+def test_open_airbyte_object_streams_text(client, key, chunk_size):
+    with open_airbyte_object(client, "bucket", key, chunk_size=chunk_size) as fh:
+        rows = list(csv.reader(fh))
+    assert rows == list(csv.reader(CSV_TEXT.splitlines(True)))
+    assert rows[1][1] == "line 1\nwith ünïcode and, commas"
@@ -0,0 +1,94 @@
+from typing import ClassVar
+
+from etl.neo4j.schema import Neo4jSchemaManager
+from neo4j.exceptions import ClientError
+
+
+class Result:
+    def consume(self):
+        pass
+
+
+class SchemaSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, statement):
+        self.driver.statements.append(statement)
+        if statement in self.driver.failing:
+            raise ClientError("existing duplicates")
+        return Result()
+
+
+class SchemaDriver:
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.statements = []
+
+    def session(self, **kwargs):
+        return SchemaSession(self)
+
+
+class IssueGenerator:
+    NODE_LABELS: ClassVar[dict] = {"issues": "jira_issue", "projects": "jira_project"}
+    INDEXED_PROPERTIES: ClassVar[dict] = {"jira_issue": ["assignee_id", "project_id"]}
+
+
+class CommentGenerator:
+    NODE_LABELS: ClassVar[dict] = {"comments": "jira_comment"}
+    INDEXED_PROPERTIES: ClassVar[dict] = {"jira_issue": ["project_id", "parent_key"]}
+
+
+def test_labels_come_from_the_generators():
+    manager = Neo4jSchemaManager(None, generators=(IssueGenerator, CommentGenerator))
+    assert manager.labels() == {
+        "jira_issue": ["assignee_id", "project_id", "parent_key"],
+        "jira_project": [],
+        "jira_comment": [],
+    }
+
+
+def test_statements_create_constraints_on_identity_keys_and_indexes():
+    manager = Neo4jSchemaManager(
+        None, identity_keys={"jira_project": "key"}, generators=(IssueGenerator,)
+    )
+    assert manager.statements() == [
+        (
+            "CREATE CONSTRAINT jira_issue_id_unique IF NOT EXISTS "
+            "FOR (n:jira_issue) REQUIRE n.id IS UNIQUE"
+        ),
+        (
+            "CREATE INDEX jira_issue_assignee_id_index IF NOT EXISTS "
+            "FOR (n:jira_issue) ON (n.assignee_id)"
+        ),
+        (
+            "CREATE INDEX jira_issue_project_id_index IF NOT EXISTS "
+            "FOR (n:jira_issue) ON (n.project_id)"
+        ),
+        (
+            "CREATE CONSTRAINT jira_project_key_unique IF NOT EXISTS "
+            "FOR (n:jira_project) REQUIRE n.key IS UNIQUE"
+        ),
+    ]
+
+
+def test_every_generated_label_gets_a_constraint():
+    manager = Neo4jSchemaManager(None)
+    constraints = [s for s in manager.statements() if "CONSTRAINT" in s]
+    assert len(constraints) == len(manager.labels())
+    assert all("IF NOT EXISTS" in s for s in manager.statements())
+
+
+def test_bootstrap_runs_every_statement_and_counts_failures():
+    manager = Neo4jSchemaManager(None, generators=(IssueGenerator,))
+    statements = manager.statements()
+    manager.driver = SchemaDriver(failing=[statements[0]])
+
+    assert manager.bootstrap() == 1
+    assert manager.driver.statements == statements
@@ -0,0 +1,59 @@
+import pytest
+from etl.state import ChangeDetector, SQLiteStateStore, content_hash
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStateStore(str(tmp_path / "state.db"))
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"id": "1", "title": "a"}) == content_hash(
+        {"title": "a", "id": "1"}
+    )
+    assert content_hash({"id": "1", "title": "a"}) != content_hash(
+        {"id": "1", "title": "b"}
+    )
+
+
+def test_sqlite_store_round_trip(tmp_path):
+    path = str(tmp_path / "state.db")
+    SQLiteStateStore(path).put_hashes([("jira_issue", "1", "abc")])
+    store = SQLiteStateStore(path)
+    assert store.get_hashes([("jira_issue", "1"), ("jira_issue", "2")]) == {
+        ("jira_issue", "1"): "abc"
+    }
+
+
+def test_change_detector_skips_unchanged_rows_after_commit(store):
+    rows = [{"id": "1", "title": "a"}, {"id": "2", "title": "b"}, {"title": "no id"}]
+    detector = ChangeDetector(store, batch_size=2)
+    assert list(detector.filter_rows(rows, "jira_issue")) == rows
+    # Hashes are only stored on commit
+    assert list(detector.filter_rows(rows, "jira_issue")) == [rows[2]]
+    detector.reset()
+    assert list(detector.filter_rows(rows, "jira_issue")) == rows
+
+    detector.commit()
+    changed = [{"id": "1", "title": "a"}, {"id": "2", "title": "changed"}]
+    assert list(ChangeDetector(store).filter_rows(changed, "jira_issue")) == [
+        changed[1]
+    ]
+
+
+def test_change_detector_passes_rows_without_label(store):
+    rows = [{"id": "1"}]
+    detector = ChangeDetector(store)
+    list(detector.filter_rows(rows, "jira_issue"))
+    detector.commit()
+    assert list(detector.filter_rows(rows, None)) == rows
+
+
+def test_change_detector_full_refresh_passes_rows_and_stages_hashes(store):
+    rows = [{"id": "1", "title": "a"}]
+    detector = ChangeDetector(store)
+    list(detector.filter_rows(rows, "jira_issue"))
+    detector.commit()
+
+    assert list(detector.filter_rows(rows, "jira_issue", full_refresh=True)) == rows
+    assert detector.pending == {("jira_issue", "1"): content_hash(rows[0])}
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+
+import pytest
+from etl.transforms import (
+    AIRBYTE_CSV_FIELDNAMES,
+    Airbyte2jsonlTransformer,
+    compile_field_expression,
+)
+
+ISSUE = {
+    "id": "10001",
+    "key": "PLAT-1",
+    "fields": {
+        "assignee": None,
+        "creator": {"accountId": "u1"},
+        "parent": {"key": "PLAT-0"},
+        "labels": ["etl", "graph"],
+    },
+}
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "data['id']",
+        "data['fields']['creator']['accountId']",
+        "data['fields']['parent']['key']",
+        "data['fields']['labels'][1]",
+        'data["key"]',
+    ],
+)
+def test_plain_lookups_match_eval(expression):
+    assert compile_field_expression(expression)(ISSUE) == eval(
+        expression, {"data": ISSUE}
+    )
+
+
+@pytest.mark.parametrize(
+    "expression",
+    [
+        "data['missing']",
+        "data['fields']['missing']['accountId']",
+        "data['fields']['labels'][5]",
+    ],
+)
+def test_missing_keys_evaluate_to_none(expression):
+    assert compile_field_expression(expression)(ISSUE) is None
+
+
+def test_lookups_through_null_evaluate_to_none():
+    expression = "data['fields']['assignee']['accountId']"
+    with pytest.raises(TypeError):
+        eval(expression, {"data": ISSUE})
+    assert compile_field_expression(expression)(ISSUE) is None
+
+
+def test_registered_handler_flattens_comment_text():
+    expression = Airbyte2jsonlTransformer().s3_files_field_map["jira/issue_comments"][
+        "text"
+    ]
+    comment = {
+        "body": {
+            "content": [
+                {"content": [{"text": "first"}, {"text": "second"}]},
+                {"content": [{"text": "third"}]},
+            ]
+        }
+    }
+    extract = compile_field_expression(expression)
+    assert extract(comment) == eval(expression, {"data": comment})
+    assert extract(comment) == "first, second,third"
+    assert extract({}) is None
+
+
+def test_other_expressions_are_evaluated():
+    extract = compile_field_expression("data['id'].upper() + '-' + data['key']")
+    assert extract({"id": "a", "key": "b"}) == "A-b"
+    assert extract({"id": "a"}) is None
+
+
+def airbyte_csv(rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(AIRBYTE_CSV_FIELDNAMES)
+    for i, data in enumerate(rows):
+        writer.writerow([i, 1700000000000, json.dumps(data)])
+    text.seek(0)
+    return text
+
+
+def test_transform_rows_uses_the_compiled_field_map():
+    transformer = Airbyte2jsonlTransformer()
+    rows = list(
+        transformer.transform_airbyte_rows(
+            airbyte_csv([{"id": "p1", "key": "P", "name": "Platform"}]),
+            "jira/projects",
+        )
+    )
+    assert rows == [
+        {
+            "id": "p1",
+            "project_key": "P",
+            "title": "Platform",
+            "description": None,
+            "assignee_id": None,
+        }
+    ]
+
+
+def test_compile_field_map_picks_up_map_changes():
+    transformer = Airbyte2jsonlTransformer()
+    transformer.s3_files_field_map["jira/projects"] = {"name": "data['name']"}
+    transformer.compile_field_map()
+    assert transformer.transform_airbyte_row({"name": "x"}, "jira/projects") == {
+        "name": "x"
+    }
@@ -0,0 +1,164 @@
+import pytest
+from etl.neo4j import upload
+from neo4j.exceptions import TransientError
+
+
+def node(label, **properties):
+    return {"type": "node", "label": label, "properties": properties}
+
+
+def relationship(label1, id1, relationship, label2, id2):
+    return {
+        "type": "relationship",
+        "start_node": {"label": label1, "id": id1},
+        "relationship": relationship,
+        "end_node": {"label": label2, "id": id2},
+    }
+
+
+class RecordingTransaction:
+    def __init__(self):
+        self.queries = []
+
+    def run(self, query, **parameters):
+        self.queries.append((query, parameters))
+
+
+def test_batched_upload_writes_one_transaction_per_group_batch(
+    graph_driver, make_uploader
+):
+    driver = graph_driver()
+    records = [node("jira_issue", id=str(i), title=f"issue {i}") for i in range(5)]
+    records += [node("jira_project", id="p", title="project")]
+    records += [
+        relationship("jira_issue", str(i), "IN_PROJECT", "jira_project", "p")
+        for i in range(5)
+    ]
+
+    count = make_uploader(driver, batch_size=4).upload_records(records)
+
+    assert count == 11
+    assert driver.ids("jira_issue") == {str(i) for i in range(5)}
+    assert driver.nodes[("jira_project", "p")] == {"id": "p", "title": "project"}
+    assert driver.relationships == {
+        ("jira_issue", str(i), "IN_PROJECT", "jira_project", "p") for i in range(5)
+    }
+    # Three windows of at most 4 records, one UNWIND per group in each
+    assert driver.transactions == 5
+
+
+def test_batched_upload_retries_transient_errors(
+    monkeypatch, graph_driver, make_uploader
+):
+    monkeypatch.setattr(upload, "UPLOAD_RETRY_BACKOFF_SECONDS", 0)
+    driver = graph_driver()
+    session_class = type(driver.session())
+    execute_write = session_class.execute_write
+    failures = [TransientError("deadlock")]
+
+    def flaky_execute_write(self, *args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return execute_write(self, *args, **kwargs)
+
+    monkeypatch.setattr(session_class, "execute_write", flaky_execute_write)
+    make_uploader(driver).upload_records([node("jira_issue", id="1")])
+    assert driver.ids("jira_issue") == {"1"}
+
+
+def test_batched_upload_raises_after_max_retries(
+    monkeypatch, graph_driver, make_uploader
+):
+    monkeypatch.setattr(upload, "UPLOAD_RETRY_BACKOFF_SECONDS", 0)
+    driver = graph_driver()
+    session_class = type(driver.session())
+    attempts = []
+
+    def failing_execute_write(self, *args, **kwargs):
+        attempts.append(1)
+        raise TransientError("deadlock")
+
+    monkeypatch.setattr(session_class, "execute_write", failing_execute_write)
+    with pytest.raises(TransientError):
+        make_uploader(driver).upload_records([node("jira_issue", id="1")])
+    assert len(attempts) == upload.UPLOAD_MAX_RETRIES
+
+
+def test_changed_node_is_updated_not_duplicated(graph_driver, make_uploader):
+    driver = graph_driver()
+    uploader = make_uploader(driver)
+    uploader.upload_records([node("jira_issue", id="1", status="open", title="a")])
+    uploader.upload_records([node("jira_issue", id="1", status="done")])
+
+    assert driver.nodes == {
+        ("jira_issue", "1"): {"id": "1", "status": "done", "title": "a"}
+    }
+
+
+def test_copies_of_a_node_in_a_batch_are_merged(graph_driver, make_uploader):
+    driver = graph_driver()
+    make_uploader(driver).upload_records(
+        [
+            node("jira_issue", id="1", status="open", title="a"),
+            node("jira_issue", id="1", status="done"),
+        ]
+    )
+    assert driver.nodes == {
+        ("jira_issue", "1"): {"id": "1", "status": "done", "title": "a"}
+    }
+
+
+def test_nodes_merge_on_configured_identity_key(graph_driver, make_uploader):
+    driver = graph_driver()
+    uploader = make_uploader(driver, identity_keys={"jira_issue": "key"})
+    uploader.upload_records(
+        [
+            node("jira_issue", id="1", key="HIV-1"),
+            node("jira_issue", id="2", key="HIV-1"),
+            node("jira_issue", id="3"),
+        ]
+    )
+    assert driver.nodes == {("jira_issue", "HIV-1"): {"id": "2", "key": "HIV-1"}}
+
+
+def test_merge_queries_match_on_identity_keys_only(make_uploader):
+    uploader = make_uploader(None, identity_keys={"jira_issue": "key"})
+    tx = RecordingTransaction()
+    properties = {"id": "1", "key": "HIV-1", "title": "a"}
+    uploader.merge_node(tx, "jira_issue", properties)
+    uploader.merge_relationship(
+        tx, "jira_issue", properties, "IN_PROJECT", "jira_project", {"id": "p"}
+    )
+
+    assert tx.queries == [
+        (
+            "MERGE (n:jira_issue {key: $key}) SET n += $properties",
+            {"key": "HIV-1", "properties": properties},
+        ),
+        (
+            (
+                "MERGE (a:jira_issue {key: $key1}) "
+                "MERGE (b:jira_project {id: $key2}) "
+                "MERGE (a)-[r:IN_PROJECT]->(b)"
+            ),
+            {"key1": "HIV-1", "key2": "p"},
+        ),
+    ]
+
+
+def test_serial_fallback_writes_batches_of_batch_size(graph_driver, make_uploader):
+    # The fake lists no constraints, so a parallel window is written serially
+    driver = graph_driver()
+    batches = []
+    commit = driver.commit
+
+    def recording_commit():
+        batches.extend(len(rows) for query, rows in driver.pending)
+        commit()
+
+    driver.commit = recording_commit
+    uploader = make_uploader(driver, batch_size=3, workers=2)
+    uploader.upload_records([node("jira_issue", id=str(i)) for i in range(7)])
+
+    assert driver.ids("jira_issue") == {str(i) for i in range(7)}
+    assert batches == [3, 3, 1]
@@ -0,0 +1,83 @@
+import pytest
+from etl.state import (
+    SQLiteStateStore,
+    StreamWatermark,
+    VersionGuard,
+    parse_timestamp_ms,
+)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStateStore(str(tmp_path / "state.db"))
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, None),
+        ("", None),
+        (1700000000123, 1700000000123),
+        ("1700000000123", 1700000000123),
+        ("2023-11-14T22:13:20Z", 1700000000000),
+        ("2023-11-14 22:13:20+00:00", 1700000000000),
+        ("2023-11-14T23:13:20.000+0100", 1700000000000),
+        ("2023-11-14T22:13:20.5+00", 1700000000500),
+        ("2023-11-14T22:13:20.123456+00:00", 1700000000123),
+        ("2023-11-14T22:13:20", None),
+        ("not a timestamp", None),
+    ],
+)
+def test_parse_timestamp_ms(value, expected):
+    assert parse_timestamp_ms(value) == expected
+
+
+def test_version_guard_drops_stale_rows(store):
+    guard = VersionGuard(store)
+    current = {"id": "1", "updated": "2024-01-02T00:00:00Z"}
+    assert list(guard.filter_rows([current], "jira_issue")) == [current]
+    guard.commit()
+
+    stale = {"id": "1", "updated": "2024-01-01T00:00:00Z"}
+    newer = {"id": "1", "updated": "2024-01-03T00:00:00Z"}
+    unversioned = {"id": "1"}
+    guard = VersionGuard(store)
+    assert list(guard.filter_rows([stale, newer, unversioned], "jira_issue")) == [
+        newer,
+        unversioned,
+    ]
+    assert guard.skipped == 1
+
+
+def test_version_guard_passes_labels_without_version_field(store):
+    rows = [{"id": "1", "updated": "2024-01-01T00:00:00Z"}]
+    guard = VersionGuard(store, version_fields={})
+    assert list(guard.filter_rows(rows, "jira_issue")) == rows
+
+
+def test_stream_watermark_skips_rows_before_lookback(store):
+    hour = 60 * 60 * 1000
+    watermark = StreamWatermark(store, lookback_ms=hour)
+    rows = [{"_airbyte_emitted_at": 10 * hour}, {"_airbyte_emitted_at": 12 * hour}]
+    assert list(watermark.filter_rows(rows, "jira/issues")) == rows
+    watermark.commit()
+    assert store.get_watermark("jira/issues") == 12 * hour
+
+    replayed = [
+        {"_airbyte_emitted_at": 10 * hour},
+        {"_airbyte_emitted_at": 11 * hour + 1},
+        {"_airbyte_emitted_at": None},
+    ]
+    watermark = StreamWatermark(store, lookback_ms=hour)
+    assert list(watermark.filter_rows(replayed, "jira/issues")) == replayed[1:]
+    assert watermark.skipped == 1
+    assert (
+        list(watermark.filter_rows(replayed, "jira/issues", full_refresh=True))
+        == replayed
+    )
+
+
+def test_stream_watermark_is_never_lowered(store):
+    store.put_watermark("jira/issues", 200)
+    store.put_watermark("jira/issues", 100)
+    assert store.get_watermark("jira/issues") == 200
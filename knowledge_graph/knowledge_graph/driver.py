@@ -0,0 +1,86 @@
+import atexit
+import logging
+import os
+import threading
+
+from neo4j import GraphDatabase
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Connection pool of a shared driver, sized for the ETL parallel upload workers
+NEO4J_MAX_CONNECTION_POOL_SIZE = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", "50"))
+NEO4J_CONNECTION_ACQUISITION_TIMEOUT = 60
+
+# Pooled connections idle longer than this are checked before use, e.g. after a
+# Lambda container was frozen between invocations
+NEO4J_LIVENESS_CHECK_TIMEOUT = 30
+
+# Connections are recycled before load balancers drop them
+NEO4J_MAX_CONNECTION_LIFETIME = 30 * 60
+
+
+class SharedDriver:
+    """
+    Process wide neo4j Driver, created on first use and again after close, so a
+    warm Lambda container keeps reusing its pooled TCP/TLS connections.
+    """
+
+    def __init__(self, uri, user, password, **config):
+        self.uri = uri
+        self.auth = (user, password)
+        self.config = {
+            "max_connection_pool_size": NEO4J_MAX_CONNECTION_POOL_SIZE,
+            "connection_acquisition_timeout": NEO4J_CONNECTION_ACQUISITION_TIMEOUT,
+            "liveness_check_timeout": NEO4J_LIVENESS_CHECK_TIMEOUT,
+            "max_connection_lifetime": NEO4J_MAX_CONNECTION_LIFETIME,
+            "keep_alive": True,
+        }
+        self.config.update(config)
+        self._driver = None
+        self._lock = threading.Lock()
+
+    @property
+    def driver(self):
+        with self._lock:
+            if self._driver is None:
+                logger.info(f"Connecting Neo4j driver to {self.uri}")
+                self._driver = GraphDatabase.driver(
+                    self.uri, auth=self.auth, **self.config
+                )
+            return self._driver
+
+    def session(self, **kwargs):
+        return self.driver.session(**kwargs)
+
+    def verify_connectivity(self):
+        self.driver.verify_connectivity()
+
+    def close(self):
+        with self._lock:
+            if self._driver is not None:
+                self._driver.close()
+                self._driver = None
+
+
+_shared_drivers = {}
+_shared_drivers_lock = threading.Lock()
+
+
+def get_driver(uri, user, password, **config):
+    """
+    Returns the SharedDriver of (uri, user), creating it on the first call.
+    """
+    with _shared_drivers_lock:
+        key = (uri, user)
+        if key not in _shared_drivers:
+            _shared_drivers[key] = SharedDriver(uri, user, password, **config)
+        return _shared_drivers[key]
+
+
+@atexit.register
+def close_drivers():
+    with _shared_drivers_lock:
+        for shared_driver in _shared_drivers.values():
+            shared_driver.close()
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Size of the SQLite cache, least recently used vectors are evicted beyond it
+EMBEDDING_CACHE_MAX_BYTES = (
+    int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512")) * 1024 * 1024
+)
+
+# Eviction frees space down to this fraction of the maximum size
+EMBEDDING_CACHE_EVICT_TO = 0.9
+
+
+def canonical_text(text):
+    # Unicode and whitespace variations don't change the embedding input
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model, text):
+    """
+    Content address of the embedding of text by model.
+    """
+    data = f"{model}\x00{canonical_text(text)}".encode()
+    return hashlib.sha256(data).hexdigest()
+
+
+def _pack(vector):
+    # float32, the precision embeddings are returned with
+    return array("f", vector).tobytes()
+
+
+def _unpack(data):
+    return array("f", bytes(data)).tolist()
+
+
+class EmbeddingCache:
+    """
+    Embeddings by cache_key(model, text). Subclasses implement get_many and
+    put_many. hits and misses count the lookups since creation.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        """
+        Returns {key: vector} for the cached keys.
+        """
+        raise NotImplementedError
+
+    def put_many(self, vectors):
+        """
+        Stores {key: vector}.
+        """
+        raise NotImplementedError
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put(self, key, vector):
+        self.put_many({key: vector})
+
+    def _count(self, requested, found):
+        self.hits += found
+        self.misses += requested - found
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+        }
+
+
+class SQLiteEmbeddingCache(EmbeddingCache):
+    """
+    Local cache in a SQLite file, evicting least recently used vectors once the
+    stored vectors exceed max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed);
+            """
+        )
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        vectors = {}
+        with self._lock, self.connection:
+            # Stay below the default SQLite host parameter limit
+            for i in range(0, len(keys), 500):
+                batch = keys[i : i + 500]
+                placeholders = ", ".join(["?"] * len(batch))
+                for key, vector in self.connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ):
+                    vectors[key] = _unpack(vector)
+                self.connection.execute(
+                    f"UPDATE embeddings SET accessed = ? WHERE key IN ({placeholders})",
+                    [time.time()] + batch,
+                )
+        self._count(len(keys), len(vectors))
+        return vectors
+
+    def put_many(self, vectors):
+        if not vectors:
+            return
+        now = time.time()
+        rows = [(key, _pack(vector), now) for key, vector in vectors.items()]
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, accessed) "
+                "VALUES (?, ?, ?)",
+                rows,
+            )
+            self.size += sum(len(vector) for key, vector, accessed in rows)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * EMBEDDING_CACHE_EVICT_TO
+        evicted = 0
+        # Replaced keys were counted twice by put_many
+        self.size = self.connection.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+        cursor = self.connection.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY accessed"
+        )
+        keys = []
+        for key, size in cursor:
+            if self.size <= target:
+                break
+            keys.append((key,))
+            self.size -= size
+            evicted += 1
+        cursor.close()
+        self.connection.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+        logger.info(f"Evicted {evicted} embeddings from {self.path}")
+
+
+class DynamoDBEmbeddingCache(EmbeddingCache):
+    """
+    Cache shared across Lambda containers and services, on a DynamoDB table with
+    string partition key "pk". Expiry is left to the table's TTL on "expires_at".
+    """
+
+    def __init__(self, table_name, dynamodb=None, ttl_seconds=90 * 24 * 60 * 60):
+        super().__init__()
+        if dynamodb is None:
+            import boto3
+
+            dynamodb = boto3.resource("dynamodb")
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.table = dynamodb.Table(table_name)
+        self.ttl_seconds = ttl_seconds
+
+    def get_many(self, keys):
+        keys = list(dict.fromkeys(keys))
+        vectors = {}
+        # BatchGetItem accepts at most 100 keys per request
+        for i in range(0, len(keys), 100):
+            request = {
+                self.table_name: {"Keys": [{"pk": key} for key in keys[i : i + 100]]}
+            }
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table_name, []):
+                    vectors[item["pk"]] = _unpack(item["vector"].value)
+                request = response.get("UnprocessedKeys")
+        self._count(len(keys), len(vectors))
+        return vectors
+
+    def put_many(self, vectors):
+        expires_at = int(time.time()) + self.ttl_seconds
+        with self.table.batch_writer(overwrite_by_pkeys=["pk"]) as batch:
+            for key, vector in vectors.items():
+                batch.put_item(
+                    Item={"pk": key, "vector": _pack(vector), "expires_at": expires_at}
+                )
+
+
+def get_embedding_cache():
+    # EMBEDDING_CACHE_TABLE (DynamoDB, shared) or EMBEDDING_CACHE_PATH (SQLite)
+    if os.getenv("EMBEDDING_CACHE_TABLE"):
+        return DynamoDBEmbeddingCache(os.getenv("EMBEDDING_CACHE_TABLE"))
+    if os.getenv("EMBEDDING_CACHE_PATH"):
+        return SQLiteEmbeddingCache(os.getenv("EMBEDDING_CACHE_PATH"))
+    return None
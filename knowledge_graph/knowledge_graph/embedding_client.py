@@ -0,0 +1,246 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# OpenAI compatible API, e.g. a local fake server in benchmarks. Replaces the
+# openai package's openai.api_base (OPENAI_API_BASE), see README.md
+EMBEDDING_API_BASE_URL = os.getenv(
+    "EMBEDDING_API_BASE_URL", "https://api.openai.com/v1"
+)
+
+# Sent as the OpenAI-Organization header, like openai.organization
+EMBEDDING_API_ORGANIZATION = os.getenv("OPENAI_ORGANIZATION")
+
+# Requests in flight at once
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+
+# Budgets of the account's rate limits, requests and input tokens per minute
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_RPM", "3000"))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TPM", "1000000"))
+
+EMBEDDING_MAX_RETRIES = 6
+EMBEDDING_RETRY_BASE_SECONDS = 1.0
+EMBEDDING_RETRY_MAX_SECONDS = 60.0
+EMBEDDING_REQUEST_TIMEOUT = 60
+
+# Throttling and server side errors, anything else fails the request at once
+RETRYABLE_STATUS = (408, 409, 429, 500, 502, 503, 504)
+
+
+def estimate_tokens(text):
+    # About 4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def _retry_after(headers):
+    # Seconds of a Retry-After header, HTTP dates fall back to the backoff
+    try:
+        return float(headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class EmbeddingRequestError(Exception):
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Refills rate_per_minute units per minute up to capacity (one minute's worth
+    by default). acquire blocks until the units are available.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.available = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.available = min(
+            self.capacity, self.available + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def acquire(self, amount=1):
+        # A request larger than the bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                if self.available >= amount:
+                    self.available -= amount
+                    return
+                wait = (amount - self.available) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Request and token per minute budgets shared by all workers of a client, plus
+    a common pause after a 429 so the workers don't keep hitting the limit.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+        tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self, tokens):
+        while True:
+            with self._lock:
+                wait = self.paused_until - time.monotonic()
+            if wait <= 0:
+                break
+            time.sleep(wait)
+        self.requests.acquire(1)
+        self.tokens.acquire(tokens)
+
+
+class EmbeddingClient:
+    """
+    Thread safe client of an OpenAI compatible /embeddings endpoint. Requests are
+    rate limited by a RateLimiter and retried on throttling and server errors,
+    after Retry-After when the server sends it, otherwise with jittered
+    exponential backoff. embed_many runs requests on concurrency threads.
+    """
+
+    def __init__(
+        self,
+        api_key=None,
+        base_url=EMBEDDING_API_BASE_URL,
+        organization=EMBEDDING_API_ORGANIZATION,
+        concurrency=EMBEDDING_CONCURRENCY,
+        limiter=None,
+        max_retries=EMBEDDING_MAX_RETRIES,
+        timeout=EMBEDDING_REQUEST_TIMEOUT,
+    ):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url.rstrip("/")
+        self.organization = organization
+        self.concurrency = concurrency
+        self.limiter = limiter or RateLimiter()
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def _post(self, inputs, model):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        if self.organization:
+            headers["OpenAI-Organization"] = self.organization
+        request = urllib.request.Request(
+            f"{self.base_url}/embeddings",
+            data=json.dumps({"input": inputs, "model": model}).encode("utf-8"),
+            headers=headers,
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise EmbeddingRequestError(
+                f"HTTP {e.code}: {e.read()[:200]!r}",
+                status=e.code,
+                retry_after=_retry_after(e.headers),
+            )
+        except (urllib.error.URLError, OSError) as e:
+            # Connection errors and timeouts, retried like a 503
+            raise EmbeddingRequestError(str(e), status=503)
+
+    def _backoff(self, attempt, error):
+        if error.retry_after is not None:
+            return error.retry_after
+        # Full jitter, spreads the retries of concurrent workers
+        return random.uniform(
+            0,
+            min(EMBEDDING_RETRY_MAX_SECONDS, EMBEDDING_RETRY_BASE_SECONDS * 2**attempt),
+        )
+
+    def embed(self, inputs, model, tokens=None):
+        """
+        Returns the embeddings of a list of texts from one request, in input order.
+        tokens is the input token count, estimated when None.
+        """
+        if tokens is None:
+            tokens = sum(estimate_tokens(text) for text in inputs)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                response = self._post(inputs, model)
+                with self._lock:
+                    self.requests += 1
+                data = sorted(response["data"], key=lambda d: d["index"])
+                return [d["embedding"] for d in data]
+            except EmbeddingRequestError as e:
+                if e.status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    raise
+                wait = self._backoff(attempt, e)
+                with self._lock:
+                    self.retries += 1
+                    if e.status == 429:
+                        self.throttled += 1
+                if e.status == 429:
+                    self.limiter.pause(wait)
+                logger.warning(
+                    f"Embedding request failed ({e}), retry {attempt + 1} in {wait:.1f}s"
+                )
+                time.sleep(wait)
+                attempt += 1
+
+    def embed_many(self, batches, model):
+        """
+        Runs one request per (inputs, tokens) of batches concurrently. Returns a
+        list in batch order of the embeddings, or of the exception of a failed
+        batch.
+        """
+
+        def run(batch):
+            inputs, tokens = batch
+            try:
+                return self.embed(inputs, model, tokens)
+            except (EmbeddingRequestError, KeyError, TypeError, ValueError) as e:
+                # Failed requests and malformed responses
+                return e
+
+        batches = list(batches)
+        if len(batches) <= 1 or self.concurrency <= 1:
+            return [run(batch) for batch in batches]
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(run, batches))
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.throttled,
+        }
@@ -0,0 +1,45 @@
+import json
+
+# Properties embedded for each node label, also the text_node_properties of the
+# query engine's vector indexes. Labels not listed have no embeddings
+NODE_EMBEDDING_PROPERTIES = {
+    "atlassian_user": ["id", "display_name", "email"],
+    "jira_comment": ["text", "author_id", "issue_id"],
+    "jira_issue": [
+        "description",
+        "title",
+        "issue_type",
+        "status",
+        "created",
+        "parent_key",
+        "project_id",
+        "key",
+        "creator_id",
+        "assignee_id",
+        "display_name",
+    ],
+    "jira_sprint": ["name", "state", "start_date", "end_date", "board_id"],
+    "jira_project": ["project_key", "id", "title"],
+    "confluence_space": ["name", "key"],
+    "confluence_page": ["title", "content", "author_name", "author_id", "created"],
+    "slack_user": ["id", "name", "last_name"],
+    "slack_channel": [
+        "id",
+        "name",
+        "purpose_value",
+        "creator",
+        "created",
+        "num_members",
+    ],
+    "slack_message": ["text", "user", "created", "team", "channel_id"],
+}
+
+
+def node_text(node, properties):
+    """
+    Returns the embedding input of a node, the JSON of its non-null properties.
+    Null and absent properties give the same text, as Neo4j stores no nulls, so
+    the ETL, the query engine and the backfill hash the same text for a node
+    whether it comes from a graph record or from Neo4j.
+    """
+    return json.dumps({k: node[k] for k in properties if node.get(k) is not None})
@@ -0,0 +1,11 @@
+from setuptools import find_packages, setup
+
+setup(
+    name="knowledge_graph",
+    version="1.0",
+    packages=find_packages(),
+    install_requires=[
+        "neo4j",
+        "boto3",
+    ],
+)
@@ -0,0 +1,218 @@
+"""
+Embedding backfill: pages through the nodes of each label by id, embeds only the
+nodes whose embedding_hash is missing or stale, and writes them in batches. Labels
+run concurrently, and a checkpoint file of per label id cursors lets an
+interrupted backfill resume where it stopped.
+
+    $ cd platform/query_engine
+    $ python -m query_engine.backfill --label slack_message --checkpoint backfill.json
+    $ python -m query_engine.backfill --checkpoint backfill.json --restart
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from knowledge_graph.embedding_cache import cache_key
+from knowledge_graph.embedding_text import NODE_EMBEDDING_PROPERTIES, node_text
+
+from query_engine.embeddings import EMBEDDING_MODEL, Neo4jEmbeddingManager
+
+# Initialize the logger
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Nodes read per page, only their id, hash and indexed properties
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "1000"))
+
+# Labels backfilled at once, they share the embedding client's rate limits
+BACKFILL_LABEL_WORKERS = int(os.getenv("BACKFILL_LABEL_WORKERS", "4"))
+
+
+class BackfillCheckpoint:
+    """
+    {label: {"cursor": last written id, "done": bool, "failed": nodes not embedded
+    so far}} in a JSON file, rewritten atomically after every page.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def get(self, label):
+        with self._lock:
+            return dict(self.state.get(label, {}))
+
+    def put(self, label, cursor, done=False, failed=0):
+        with self._lock:
+            self.state[label] = {"cursor": cursor, "done": done, "failed": failed}
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.state, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.state = {}
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class EmbeddingBackfill:
+    """
+    Backfills the embeddings of the labels of NODE_EMBEDDING_PROPERTIES. Each page
+    is read without the stored vectors, its stale nodes embedded through the
+    manager's cache and concurrent client, and written before the cursor moves on.
+    """
+
+    def __init__(
+        self, embedding_manager, page_size=BACKFILL_PAGE_SIZE, checkpoint=None
+    ):
+        self.manager = embedding_manager
+        self.page_size = page_size
+        self.checkpoint = checkpoint
+
+    def _read_page(self, label, properties, cursor):
+        # Ordered by the uniquely indexed id, each page is an index range scan
+        projection = ", ".join(f".{p}" for p in properties)
+        condition = "n.id IS NOT NULL" if cursor is None else "n.id > $cursor"
+        with self.manager.driver.session() as session:
+            result = session.run(
+                f"""
+            MATCH (n:{label})
+            WHERE {condition}
+            RETURN n.id AS id, n {{{projection}}} AS properties,
+                n.embedding_model AS model, n.embedding_hash AS hash
+            ORDER BY n.id
+            LIMIT $page_size
+            """,
+                cursor=cursor,
+                page_size=self.page_size,
+            )
+            return list(result)
+
+    def backfill_label(self, label, model=EMBEDDING_MODEL):
+        """
+        Returns {"scanned", "embedded", "failed"} counts of label.
+        """
+        properties = NODE_EMBEDDING_PROPERTIES[label]
+        stats = {"scanned": 0, "embedded": 0, "failed": 0}
+        cursor = None
+        if self.checkpoint is not None:
+            state = self.checkpoint.get(label)
+            if state.get("done"):
+                logger.info(f"Backfill of {label} already completed, skipping")
+                return stats
+            cursor = state.get("cursor")
+            # Failures of the interrupted run, so the label isn't marked done
+            stats["failed"] = state.get("failed", 0)
+            if cursor is not None:
+                logger.info(f"Resuming backfill of {label} after id {cursor}")
+
+        started = time.monotonic()
+        while True:
+            page = self._read_page(label, properties, cursor)
+            if not page:
+                break
+            ids, texts, keys = [], [], []
+            for record in page:
+                # The text and hash the ETL writes for the same node, nulls of
+                # the projection dropped like absent properties
+                text_data = node_text(record["properties"], properties)
+                text_hash = cache_key(model, text_data)
+                if record["hash"] == text_hash and record["model"] == model:
+                    continue
+                ids.append(record["id"])
+                texts.append(text_data)
+                keys.append(text_hash)
+
+            vectors = self.manager._embed_texts(texts, keys, model)
+            rows = [
+                {"id": ids[i], "embedding": vector, "hash": keys[i]}
+                for i, vector in sorted(vectors.items())
+            ]
+            self.manager.write_embeddings(label, rows, model)
+
+            cursor = page[-1]["id"]
+            stats["scanned"] += len(page)
+            stats["embedded"] += len(rows)
+            stats["failed"] += len(ids) - len(rows)
+            if self.checkpoint is not None:
+                self.checkpoint.put(label, cursor, failed=stats["failed"])
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Backfill {label}: scanned {stats['scanned']}, embedded "
+                f"{stats['embedded']}, failed {stats['failed']}, "
+                f"{stats['scanned'] / elapsed:.0f} nodes/s"
+            )
+            if len(page) < self.page_size:
+                break
+
+        if stats["failed"]:
+            # Still stale, the next backfill scans the label again from the start
+            # and only embeds them and nodes changed since
+            logger.warning(f"Backfill {label}: {stats['failed']} nodes not embedded")
+            if self.checkpoint is not None:
+                self.checkpoint.put(label, None)
+        elif self.checkpoint is not None:
+            self.checkpoint.put(label, cursor, done=True)
+        logger.info(f"Backfill of {label} completed: {stats}")
+        return stats
+
+    def run(self, labels=None, workers=BACKFILL_LABEL_WORKERS):
+        """
+        Backfills labels (all embedded labels by default) concurrently, returns
+        {label: stats}.
+        """
+        labels = labels or list(NODE_EMBEDDING_PROPERTIES)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = dict(zip(labels, executor.map(self.backfill_label, labels)))
+        logger.info(f"Embedding client: {self.manager.client.stats()}")
+        if self.manager.cache is not None:
+            logger.info(f"Embedding cache: {self.manager.cache.stats()}")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--uri", default=os.getenv("NEO4J_URI"))
+    parser.add_argument("--user", default=os.getenv("NEO4J_USER"))
+    parser.add_argument("--password", default=os.getenv("NEO4J_PASSWORD"))
+    parser.add_argument("--openai-key", default=os.getenv("OPENAI_API_KEY"))
+    parser.add_argument("--label", action="append", help="defaults to all labels")
+    parser.add_argument("--page-size", type=int, default=BACKFILL_PAGE_SIZE)
+    parser.add_argument("--workers", type=int, default=BACKFILL_LABEL_WORKERS)
+    parser.add_argument("--checkpoint", help="JSON file of per label cursors")
+    parser.add_argument(
+        "--restart", action="store_true", help="start over, including completed labels"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+    manager = Neo4jEmbeddingManager(args.uri, args.user, args.password, args.openai_key)
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = BackfillCheckpoint(args.checkpoint)
+        if args.restart:
+            checkpoint.clear()
+    try:
+        results = EmbeddingBackfill(manager, args.page_size, checkpoint).run(
+            args.label, args.workers
+        )
+    finally:
+        manager.driver.close()
+    raise SystemExit(1 if any(stats["failed"] for stats in results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,94 +1,107 @@
-import json
-from neo4j import GraphDatabase
 from langchain.embeddings.openai import OpenAIEmbeddings
-from openai import OpenAI
 from langchain.vectorstores import Neo4jVector
 
+from knowledge_graph.driver import get_driver
+from knowledge_graph.embedding_cache import get_embedding_cache
+from knowledge_graph.embedding_client import EmbeddingClient
+from knowledge_graph.embedding_text import NODE_EMBEDDING_PROPERTIES
+
+# Model of the stored embeddings, recorded on each node as embedding_model
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Texts per embedding request, and vectors per UNWIND ... SET
+EMBEDDING_REQUEST_INPUTS = 100
+EMBEDDING_WRITE_BATCH_SIZE = 500
+
 
 class Neo4jEmbeddingManager:
-    def __init__(self, neo4j_url, neo4j_user, neo4j_password, openai_key):
+    def __init__(self, neo4j_url, neo4j_user, neo4j_password, openai_key, cache=None):
         self.neo4j_url = neo4j_url
         self.neo4j_user = neo4j_user
         self.neo4j_password = neo4j_password
         self.openai_key = openai_key
+        # Embeddings by model and text, shared with the ETL through
+        # EMBEDDING_CACHE_TABLE
+        self.cache = cache if cache is not None else get_embedding_cache()
+        # Concurrent rate limited requests, EMBEDDING_CONCURRENCY, EMBEDDING_RPM
+        # and EMBEDDING_TPM configure it
+        self.client = EmbeddingClient(api_key=openai_key)
 
-        print("Neo4jEmbeddingManager >> before GraphDatabase.driver(")
-        self.driver = GraphDatabase.driver(neo4j_url, auth=(neo4j_user, neo4j_password))
-        print("Neo4jEmbeddingManager >> after GraphDatabase.driver(")
+        print("Neo4jEmbeddingManager >> before get_driver(")
+        # Process wide driver, reused across warm Lambda invocations
+        self.driver = get_driver(neo4j_url, neo4j_user, neo4j_password)
+        print("Neo4jEmbeddingManager >> after get_driver(")
         self.driver.verify_connectivity()
 
         print("Neo4jEmbeddingManager >> before OpenAIEmbeddings")
         self.embeddings_model = OpenAIEmbeddings(openai_api_key=openai_key)
         print("Neo4jEmbeddingManager >> after OpenAIEmbeddings")
 
-        self.node_label_to_indexed_properties = {
-            "atlassian_user": ["id", "display_name", "email"],
-            "jira_comment": ["text", "author_id", "issue_id"],
-            "jira_issue": [
-                "description",
-                "title",
-                "issue_type",
-                "status",
-                "created",
-                "parent_key",
-                "project_id",
-                "key",
-                "creator_id",
-                "assignee_id",
-                "display_name",
-            ],
-            "jira_sprint": ["name", "state", "start_date", "end_date", "board_id"],
-            "jira_project": ["project_key", "id", "title"],
-            "confluence_space": ["name", "key"],
-            "confluence_page": [
-                "title",
-                "content",
-                "author_name",
-                "author_id",
-                "created",
-            ],
-            "slack_user": ["id", "name", "last_name"],
-            "slack_channel": [
-                "id",
-                "name",
-                "purpose_value",
-                "creator",
-                "created",
-                "num_members",
-            ],
-            "slack_message": ["text", "user", "created", "team", "channel_id"],
-        }
+        # Shared with the ETL and the backfill, see knowledge_graph/embedding_text.py
+        self.node_label_to_indexed_properties = NODE_EMBEDDING_PROPERTIES
 
-    def _generate_embeddings_for_node(
-        self, node, properties, model="text-embedding-ada-002"
-    ):
-        text_data = json.dumps({k: node[k] for k in properties if k in node})
-        openai_client = OpenAI(api_key=self.openai_key)
-        return (
-            openai_client.embeddings.create(input=[text_data], model=model)
-            .data[0]
-            .embedding
+    def _embed_texts(self, texts, keys, model=EMBEDDING_MODEL):
+        """
+        Returns {index: vector} for a list of texts with their cache_key, from the
+        cache or EMBEDDING_REQUEST_INPUTS sized requests sent concurrently by the
+        client. Texts of failed requests are left out.
+        """
+        vectors = {}
+        if self.cache is not None:
+            cached = self.cache.get_many(keys)
+            vectors = {i: cached[key] for i, key in enumerate(keys) if key in cached}
+        pending = [i for i in range(len(texts)) if i not in vectors]
+        batches = [
+            pending[i : i + EMBEDDING_REQUEST_INPUTS]
+            for i in range(0, len(pending), EMBEDDING_REQUEST_INPUTS)
+        ]
+        results = self.client.embed_many(
+            [([texts[i] for i in batch], None) for batch in batches], model
         )
+        for batch, result in zip(batches, results):
+            if isinstance(result, Exception):
+                print(f"Error embedding {len(batch)} nodes: {result}")
+                continue
+            fresh = dict(zip(batch, result))
+            if self.cache is not None:
+                self.cache.put_many({keys[i]: vector for i, vector in fresh.items()})
+            vectors.update(fresh)
+        return vectors
 
-    def update_embeddings_for_neo4j(self, node_label):
-        indexed_properties = self.node_label_to_indexed_properties[node_label]
+    @staticmethod
+    def _write_embedding_rows(tx, node_label, rows, model):
+        tx.run(
+            f"""
+            UNWIND $rows AS row
+            MATCH (n:{node_label} {{id: row.id}})
+            SET n.embedding = row.embedding,
+                n.embedding_model = $model,
+                n.embedding_hash = row.hash
+            """,
+            rows=rows,
+            model=model,
+        ).consume()
+
+    def write_embeddings(self, node_label, rows, model=EMBEDDING_MODEL):
+        """
+        Sets embedding, embedding_model and embedding_hash from a list of
+        {"id", "embedding", "hash"} rows, EMBEDDING_WRITE_BATCH_SIZE per transaction.
+        """
         with self.driver.session() as session:
-            result = session.run(f"MATCH (n:{node_label}) RETURN n")
-            nodes_to_update = result.data()
-            for record in nodes_to_update:
-                node = record["n"]
-                if "id" not in node:
-                    continue
-                embedding = self._generate_embeddings_for_node(node, indexed_properties)
-                session.run(
-                    f"""
-                MATCH (n:{node_label} {{id: $id}})
-                SET n.embedding = $embedding
-                """,
-                    id=node["id"],
-                    embedding=embedding,
+            for i in range(0, len(rows), EMBEDDING_WRITE_BATCH_SIZE):
+                session.execute_write(
+                    self._write_embedding_rows,
+                    node_label,
+                    rows[i : i + EMBEDDING_WRITE_BATCH_SIZE],
+                    model,
                 )
 
+    def update_embeddings_for_neo4j(self, node_label):
+        # Imported here, the backfill module builds on this one
+        from query_engine.backfill import EmbeddingBackfill
+
+        return EmbeddingBackfill(self).backfill_label(node_label)
+
     def get_retriever(self, node_label):
         indexed_properties = self.node_label_to_indexed_properties[node_label]
         vector_index = Neo4jVector.from_existing_graph(
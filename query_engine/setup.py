@@ -5,8 +5,10 @@ setup(
     version="1.0",
     packages=find_packages(),
     install_requires=[
+        "knowledge_graph",
         "requests",
         "neo4j",
+        "boto3",
         "langchain",
         "openai",
         "python-dotenv",
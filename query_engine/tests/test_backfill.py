@@ -0,0 +1,152 @@
+import pytest
+from knowledge_graph.embedding_cache import cache_key
+from knowledge_graph.embedding_text import NODE_EMBEDDING_PROPERTIES, node_text
+from query_engine.backfill import BackfillCheckpoint, EmbeddingBackfill
+from query_engine.embeddings import EMBEDDING_MODEL
+
+LABEL = "slack_message"
+PROPERTIES = NODE_EMBEDDING_PROPERTIES[LABEL]
+
+
+class Interrupted(Exception):
+    pass
+
+
+class BackfillSession:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def run(self, query, cursor, page_size):
+        ids = sorted(id for id in self.nodes if cursor is None or id > cursor)
+        return [
+            {
+                "id": id,
+                "properties": {p: self.nodes[id].get(p) for p in PROPERTIES},
+                "model": self.nodes[id].get("embedding_model"),
+                "hash": self.nodes[id].get("embedding_hash"),
+            }
+            for id in ids[:page_size]
+        ]
+
+
+class BackfillDriver:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+    def session(self, **kwargs):
+        return BackfillSession(self.nodes)
+
+
+class BackfillManager:
+    """
+    Embedding manager stand-in, failing the texts of the ids in failing and
+    raising Interrupted after interrupt_after writes.
+    """
+
+    def __init__(self, nodes, failing=(), interrupt_after=None):
+        self.driver = BackfillDriver(nodes)
+        self.nodes = nodes
+        self.failing = {node_text(nodes[id], PROPERTIES) for id in failing}
+        self.interrupt_after = interrupt_after
+        self.embedded = []
+        self.cache = None
+
+    def _embed_texts(self, texts, keys, model=EMBEDDING_MODEL):
+        self.embedded.extend(texts)
+        return {i: [0.1] for i, text in enumerate(texts) if text not in self.failing}
+
+    def write_embeddings(self, node_label, rows, model=EMBEDDING_MODEL):
+        if self.interrupt_after is not None:
+            if self.interrupt_after == 0:
+                raise Interrupted()
+            self.interrupt_after -= 1
+        for row in rows:
+            self.nodes[row["id"]].update(
+                embedding=row["embedding"],
+                embedding_model=model,
+                embedding_hash=row["hash"],
+            )
+
+
+def messages(count):
+    return {
+        f"{i:03}": {"id": f"{i:03}", "text": f"message {i}", "channel_id": "c"}
+        for i in range(count)
+    }
+
+
+def embedded_ids(nodes):
+    return {
+        id
+        for id, node in nodes.items()
+        if node.get("embedding_hash")
+        == cache_key(EMBEDDING_MODEL, node_text(node, PROPERTIES))
+    }
+
+
+def test_backfill_embeds_only_stale_nodes():
+    nodes = messages(5)
+    EmbeddingBackfill(BackfillManager(nodes), page_size=2).backfill_label(LABEL)
+    assert embedded_ids(nodes) == set(nodes)
+
+    nodes["002"]["text"] = "edited"
+    manager = BackfillManager(nodes)
+    stats = EmbeddingBackfill(manager, page_size=2).backfill_label(LABEL)
+    assert stats == {"scanned": 5, "embedded": 1, "failed": 0}
+    assert manager.embedded == [node_text(nodes["002"], PROPERTIES)]
+
+
+def test_backfill_resumes_after_the_checkpointed_page(tmp_path):
+    nodes = messages(7)
+    checkpoint = BackfillCheckpoint(str(tmp_path / "backfill.json"))
+    interrupted = BackfillManager(nodes, interrupt_after=2)
+    with pytest.raises(Interrupted):
+        EmbeddingBackfill(interrupted, 2, checkpoint).backfill_label(LABEL)
+    assert checkpoint.get(LABEL)["cursor"] == "003"
+
+    # Reloaded from the file, as a new process would
+    checkpoint = BackfillCheckpoint(str(tmp_path / "backfill.json"))
+    manager = BackfillManager(nodes)
+    stats = EmbeddingBackfill(manager, 2, checkpoint).backfill_label(LABEL)
+    assert stats == {"scanned": 3, "embedded": 3, "failed": 0}
+    assert embedded_ids(nodes) == set(nodes)
+    assert checkpoint.get(LABEL)["done"]
+
+    manager = BackfillManager(nodes)
+    EmbeddingBackfill(manager, 2, checkpoint).backfill_label(LABEL)
+    assert manager.embedded == []
+
+
+def test_backfill_with_failures_is_not_marked_done(tmp_path):
+    nodes = messages(4)
+    checkpoint = BackfillCheckpoint(str(tmp_path / "backfill.json"))
+    failing = BackfillManager(nodes, failing=["001"])
+    stats = EmbeddingBackfill(failing, 2, checkpoint).backfill_label(LABEL)
+    assert stats["failed"] == 1
+    assert checkpoint.get(LABEL) == {"cursor": None, "done": False, "failed": 0}
+
+    manager = BackfillManager(nodes)
+    stats = EmbeddingBackfill(manager, 2, checkpoint).backfill_label(LABEL)
+    assert stats == {"scanned": 4, "embedded": 1, "failed": 0}
+    assert embedded_ids(nodes) == set(nodes)
+    assert checkpoint.get(LABEL)["done"]
+
+
+def test_failures_before_an_interruption_are_kept(tmp_path):
+    nodes = messages(4)
+    checkpoint = BackfillCheckpoint(str(tmp_path / "backfill.json"))
+    interrupted = BackfillManager(nodes, failing=["000"], interrupt_after=1)
+    with pytest.raises(Interrupted):
+        EmbeddingBackfill(interrupted, 2, checkpoint).backfill_label(LABEL)
+
+    stats = EmbeddingBackfill(BackfillManager(nodes), 2, checkpoint).backfill_label(
+        LABEL
+    )
+    assert stats["failed"] == 1
+    assert not checkpoint.get(LABEL)["done"]